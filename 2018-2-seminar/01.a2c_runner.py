@@ -11,6 +11,7 @@ import utils_kdm as u
 from algorithm_rl.algo01_a2c import A2C
 from utils_kdm.checkpoint import Checkpoint
 from utils_kdm.drawer import Drawer
+from utils_kdm.seeding import set_default_seeds
 from utils_kdm.trainer_metadata import TrainerMetadata
 
 
@@ -41,12 +42,74 @@ class RLAgent(u.TorchSerializable):
         self.algorithm_rl.train_model(current_sars, current_done)
 
 
+def run_n_step(agent, envs, episodes, is_save=False, render=False):
+    # 환경 N개를 같이 돌리면서 N_STEPS 마다 T*N개 전이로 한 번 업데이트
+    # 어느 환경이든 에피소드 하나가 끝날 때마다 한 에피소드로 기록
+    algorithm_rl = agent.algorithm_rl
+    num_envs = len(envs)
+
+    states = np.stack([env.reset() for env in envs])
+    scores = np.zeros(num_envs)
+
+    i_episode = TrainerMetadata().current_epoch
+    TrainerMetadata().start_episode()
+    while i_episode < episodes:
+        TrainerMetadata().start_step()
+
+        # 정책망 forward 는 환경 N개에 대해 한 번
+        actions = algorithm_rl.get_actions(states)
+
+        next_states = np.empty_like(states)
+        rewards = np.empty(num_envs, dtype=np.float32)
+        dones = np.empty(num_envs, dtype=np.bool_)
+        finished_scores = list()
+        for i, env in enumerate(envs):
+            next_state, reward, done, _ = env.step(actions[i])
+            reward = reward if not done or scores[i] == 499 else -100
+            scores[i] += reward
+
+            if done:
+                # 끝난 환경은 바로 다시 시작 (마지막 전이의 다음 상태는 (1 - done) 마스크로 안 쓰임)
+                finished_scores.append(scores[i])
+                scores[i] = 0
+                next_state = env.reset()
+
+            next_states[i], rewards[i], dones[i] = next_state, reward, done
+
+        algorithm_rl.append_rollout(states, actions, rewards, dones)
+        states = next_states
+
+        if algorithm_rl.is_rollout_full():
+            algorithm_rl.train_model_n_step(states)
+
+        envs[0].render() if render else None
+        TrainerMetadata().finish_step()
+
+        for score in finished_scores:
+            TrainerMetadata().log(score + 100, 'score')
+            TrainerMetadata().finish_episode(i_episode)
+
+            if is_save:
+                TrainerMetadata().save()
+
+            i_episode += 1
+            TrainerMetadata().start_episode()
+
+        scores_so_far = TrainerMetadata().indicators['score']['default_var']
+        if len(scores_so_far) >= 10 and np.mean(scores_so_far[-10:]) > 490:
+            return
+
+
 if __name__ == "__main__":
     #####################
     # 환경 설정
     #####################
 
     # 0. 일반 설정
+    # 시드 = 실행 시드 하나에서 환경, 리플레이 샘플링, 노이즈, torch 등 구성 요소마다 따로 파생 (None 이면 안 정함)
+    # 결정적 실행 = cuDNN 자동 튜닝 끄기, 학습 스레드 끄기 (최적화 전후 결과를 비트 단위로 비교할 때)
+    SEED, DETERMINISTIC = None, False
+    seeds = set_default_seeds(SEED, deterministic=DETERMINISTIC)
     FORCE_CPU = False
     TrainerMetadata().set_device(force_cpu=FORCE_CPU)
 
@@ -58,6 +121,10 @@ if __name__ == "__main__":
     # 2. 저장 관련 설정
     VERSION = 1
     IS_LOAD, IS_SAVE, SAVE_INTERVAL = False, True, 400
+    # 비동기 저장 = 직렬화/파일 쓰기를 백그라운드 스레드에서
+    IS_ASYNC_SAVE = True
+    # 샤드 저장 = 변수별 파일 / 보존 정책 = 최근 K개, 최고 점수 K개 (None 이면 전부 보존)
+    IS_SHARDED_SAVE, KEEP_LAST, KEEP_BEST = False, None, None
     SAVE_FULL_PATH = __file__
 
     # 3. 실험 환경 관련 설정
@@ -66,18 +133,29 @@ if __name__ == "__main__":
     LOG_INTERVAL = 1
     EPISODES = 30000
 
+    # 4. 알고리즘 설정
+    # n-step 학습 = 환경 NUM_ENVS 개를 N_STEPS 스텝씩 돌려서 모은 전이로 한 번에 업데이트
+    # False 면 기존처럼 환경 1개, 매 스텝 전이 1개로 업데이트
+    USE_N_STEP, NUM_ENVS, N_STEPS = False, 8, 5
+    # 행동 선택을 trace 한 정책망 (정책망 + 샘플링/노이즈/자르기를 그래프 하나로) 으로
+    USE_COMPILED_POLICY = False
+
     #####################
     # 객체 구성
     #####################
     viz = Drawer(reset=VISDOM_RESET, env=VIZ_ENV_NAME)
-    checkpoint = Checkpoint(VERSION, IS_SAVE, SAVE_INTERVAL)
+    checkpoint = Checkpoint(VERSION, IS_SAVE, SAVE_INTERVAL, is_async=IS_ASYNC_SAVE,
+                            is_sharded=IS_SHARDED_SAVE, keep_last=KEEP_LAST, keep_best=KEEP_BEST)
 
     # Agent 생성
     env = gym.make(GYM_ENV)
+    seeds.seed_env(env)
     state_size = env.observation_space.shape[0]
     action_size = env.action_space.n
 
     algorithm_rl = A2C(state_size, action_size)
+    algorithm_rl.n_steps = N_STEPS
+    algorithm_rl.use_compiled_policy = USE_COMPILED_POLICY
     agent = RLAgent(algorithm_rl, state_size, action_size)
 
     # 메타데이터 관리 클래스 설정
@@ -93,6 +171,14 @@ if __name__ == "__main__":
     if IS_LOAD:
         TrainerMetadata().load()
 
+    if USE_N_STEP:
+        envs = [env] + [gym.make(GYM_ENV) for _ in range(NUM_ENVS - 1)]
+        # 환경마다 다른 시드 (같은 시드면 같은 에피소드가 반복됨)
+        for i in range(1, NUM_ENVS):
+            seeds.seed_env(envs[i], 'env.{}'.format(i))
+        run_n_step(agent, envs, EPISODES, is_save=IS_SAVE, render=RENDER)
+        sys.exit()
+
     # 최대 에피소드 수만큼 돌린다
     for i_episode in range(TrainerMetadata().current_epoch, EPISODES):
         TrainerMetadata().start_episode()
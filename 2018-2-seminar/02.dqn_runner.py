@@ -12,7 +12,9 @@ from algorithm_rl.algo02_dqn import DQN
 from algorithm_rl.algo03_ddpg import DDPG, Transition
 from utils_kdm.checkpoint import Checkpoint
 from utils_kdm.drawer import Drawer
+from utils_kdm.evaluator import AsyncEvaluator
 from utils_kdm.replay_memory import ReplayMemory
+from utils_kdm.seeding import set_default_seeds
 from utils_kdm.trainer_metadata import TrainerMetadata
 
 
@@ -49,6 +51,10 @@ if __name__ == "__main__":
     #####################
 
     # 0. 일반 설정
+    # 시드 = 실행 시드 하나에서 환경, 리플레이 샘플링, 노이즈, torch 등 구성 요소마다 따로 파생 (None 이면 안 정함)
+    # 결정적 실행 = cuDNN 자동 튜닝 끄기, 학습 스레드 끄기 (최적화 전후 결과를 비트 단위로 비교할 때)
+    SEED, DETERMINISTIC = None, False
+    seeds = set_default_seeds(SEED, deterministic=DETERMINISTIC)
     FORCE_CPU = False
     TrainerMetadata().set_device(force_cpu=FORCE_CPU)
 
@@ -60,6 +66,10 @@ if __name__ == "__main__":
     # 2. 저장 관련 설정
     VERSION = 1
     IS_LOAD, IS_SAVE, SAVE_INTERVAL = False, True, 400
+    # 비동기 저장 = 직렬화/파일 쓰기를 백그라운드 스레드에서
+    IS_ASYNC_SAVE = True
+    # 샤드 저장 = 변수별 파일 / 보존 정책 = 최근 K개, 최고 점수 K개 (None 이면 전부 보존)
+    IS_SHARDED_SAVE, KEEP_LAST, KEEP_BEST = False, None, None
     SAVE_FULL_PATH = __file__
 
     # 3. 실험 환경 관련 설정
@@ -68,18 +78,29 @@ if __name__ == "__main__":
     LOG_INTERVAL = 1
     EPISODES = 30000
 
+    # 평가 = EVAL_INTERVAL 에피소드마다 노이즈 없이 EVAL_EPISODES 에피소드 (프로세스 EVAL_WORKERS 개, 학습과 겹쳐서)
+    # 0 이면 평가 안 함
+    EVAL_INTERVAL, EVAL_EPISODES, EVAL_WORKERS = 0, 5, 2
+
+    # 4. 알고리즘 설정
+    # 행동 선택을 trace 한 정책망 (정책망 + 샘플링/노이즈/자르기를 그래프 하나로) 으로
+    USE_COMPILED_POLICY = False
+
     #####################
     # 객체 구성
     #####################
     viz = Drawer(reset=VISDOM_RESET, env=VIZ_ENV_NAME)
-    checkpoint = Checkpoint(VERSION, IS_SAVE, SAVE_INTERVAL)
+    checkpoint = Checkpoint(VERSION, IS_SAVE, SAVE_INTERVAL, is_async=IS_ASYNC_SAVE,
+                            is_sharded=IS_SHARDED_SAVE, keep_last=KEEP_LAST, keep_best=KEEP_BEST)
 
     # Agent 생성
     env = gym.make(GYM_ENV)
+    seeds.seed_env(env)
     state_size = env.observation_space.shape[0]
     action_size = env.action_space.n
 
     algorithm_rl = DQN(state_size, action_size)
+    algorithm_rl.use_compiled_policy = USE_COMPILED_POLICY
     agent = RLAgent(algorithm_rl, state_size, action_size)
 
     # 메타데이터 관리 클래스 설정
@@ -95,6 +116,11 @@ if __name__ == "__main__":
     if IS_LOAD:
         TrainerMetadata().load()
 
+    evaluator = None
+    if EVAL_INTERVAL > 0:
+        evaluator = AsyncEvaluator(GYM_ENV, interval=EVAL_INTERVAL, episodes=EVAL_EPISODES, num_workers=EVAL_WORKERS,
+                                   seed=seeds.derive('eval') if seeds.is_seeded() else None)
+
     # 최대 에피소드 수만큼 돌린다
     for i_episode in range(TrainerMetadata().current_epoch, EPISODES):
         TrainerMetadata().start_episode()
@@ -128,11 +154,16 @@ if __name__ == "__main__":
                 break
 
         TrainerMetadata().log(score + 100, 'score')
+        if evaluator is not None:
+            evaluator.poll()
         TrainerMetadata().finish_episode(i_episode)
 
         if IS_SAVE:
             TrainerMetadata().save()
 
+        if evaluator is not None:
+            evaluator.maybe_submit(i_episode, agent.algorithm_rl.evaluation_policy)
+
         scores = TrainerMetadata().indicators['score']['default_var']
         if torch.mean(torch.cat(scores[-10:])) > 490:
             sys.exit()
@@ -13,7 +13,11 @@ from algorithm_im.im_sm import PredictiveSurpriseMotivation
 from algorithm_rl.algo03_ddpg import DDPG, Transition
 from utils_kdm.checkpoint import Checkpoint
 from utils_kdm.drawer import Drawer
+from utils_kdm.evaluator import AsyncEvaluator
+from utils_kdm.memory_monitor import MemoryMonitor
 from utils_kdm.normalized_mujoco import NormalizedMujocoEnv
+from utils_kdm.seeding import set_default_seeds
+from utils_kdm.synthetic_env import register_synthetic_envs, synthetic_env_id
 from utils_kdm.trainer_metadata import TrainerMetadata
 
 
@@ -72,9 +76,10 @@ if __name__ == "__main__":
     #####################
 
     # 0. 일반 설정
-    # TODO: 시드 넣기
-    # env.seed(args.seed)
-    # torch.manual_seed(args.seed)
+    # 시드 = 실행 시드 하나에서 환경, 리플레이 샘플링, 노이즈, torch 등 구성 요소마다 따로 파생 (None 이면 안 정함)
+    # 결정적 실행 = cuDNN 자동 튜닝 끄기, 학습 스레드 끄기 (최적화 전후 결과를 비트 단위로 비교할 때)
+    SEED, DETERMINISTIC = None, False
+    seeds = set_default_seeds(SEED, deterministic=DETERMINISTIC)
     FORCE_CPU = False
     TrainerMetadata().set_device(force_cpu=FORCE_CPU)
 
@@ -86,25 +91,51 @@ if __name__ == "__main__":
     # 2. 저장 관련 설정
     VERSION = 1
     IS_LOAD, IS_SAVE, SAVE_INTERVAL = False, False, 2
+    # 비동기 저장 = 직렬화/파일 쓰기를 백그라운드 스레드에서
+    IS_ASYNC_SAVE = True
+    # 샤드 저장 = 변수별 파일 / 보존 정책 = 최근 K개, 최고 점수 K개 (None 이면 전부 보존)
+    IS_SHARDED_SAVE, KEEP_LAST, KEEP_BEST = False, None, None
     SAVE_FULL_PATH = __file__
 
     # 3. 실험 환경 관련 설정
     GYM_ENV = 'Swimmer-v2'
+    # MuJoCo 없이 같은 상태/행동 크기의 가짜 환경으로 (벤치마크, 실행 확인용 / 스텝당 SYNTHETIC_STEP_COST 초 지연)
+    USE_SYNTHETIC_ENV, SYNTHETIC_STEP_COST = False, 0.0
     RENDER = False
     LOG_INTERVAL = 1
     EPISODES = 30000
 
+    # 평가 = EVAL_INTERVAL 에피소드마다 노이즈 없이 EVAL_EPISODES 에피소드 (프로세스 EVAL_WORKERS 개, 학습과 겹쳐서)
+    # 0 이면 평가 안 함
+    EVAL_INTERVAL, EVAL_EPISODES, EVAL_WORKERS = 0, 5, 2
+
+    # 메모리 기록 = MEMORY_REPORT_INTERVAL 에피소드마다 구성 요소별 크기 (리플레이, 지역 트리, 지표, RSS, CUDA) 기록
+    # MEMORY_BUDGETS 를 넘으면 경고 / 0 이면 기록 안 함
+    MEMORY_REPORT_INTERVAL = 0
+    MEMORY_BUDGETS = {'rss_bytes': 16 * 2 ** 30, 'exemplars': 10 ** 6}
+
     # 4. 알고리즘 설정
     USE_INTRINSIC = False
+    # 환경 1스텝당 학습 스텝 수
+    UPDATE_TO_DATA_RATIO = 1
+    # 학습 스레드 = 환경 스텝과 학습 스텝을 겹쳐서 (행동 선택용 정책망은 ACTOR_SYNC_INTERVAL 학습 스텝마다 갱신)
+    USE_LEARNER_THREAD, ACTOR_SYNC_INTERVAL = False, 100
+    # 행동 선택을 trace 한 정책망 (정책망 + 샘플링/노이즈/자르기를 그래프 하나로) 으로
+    USE_COMPILED_POLICY = False
 
     #####################
     # 객체 구성
     #####################
     viz = Drawer(reset=VISDOM_RESET, env=VIZ_ENV_NAME)
-    checkpoint = Checkpoint(VERSION, IS_SAVE, SAVE_INTERVAL)
+    checkpoint = Checkpoint(VERSION, IS_SAVE, SAVE_INTERVAL, is_async=IS_ASYNC_SAVE,
+                            is_sharded=IS_SHARDED_SAVE, keep_last=KEEP_LAST, keep_best=KEEP_BEST)
 
     # Agent 생성
+    if USE_SYNTHETIC_ENV:
+        register_synthetic_envs(step_cost=SYNTHETIC_STEP_COST)
+        GYM_ENV = synthetic_env_id(GYM_ENV)
     env = gym.make(GYM_ENV)
+    seeds.seed_env(env)
     state_size = env.observation_space.shape[0]
     action_size = env.action_space.shape[0]
     action_range = (min(env.action_space.low), max(env.action_space.high))
@@ -123,6 +154,10 @@ if __name__ == "__main__":
     # algorithm_im = PredictiveFamiliarityMotivation(state_size, action_size)
 
     algorithm_rl = DDPG(state_size, action_size, action_range)
+    algorithm_rl.updates_per_step = UPDATE_TO_DATA_RATIO
+    algorithm_rl.use_learner_thread = USE_LEARNER_THREAD
+    algorithm_rl.actor_sync_interval = ACTOR_SYNC_INTERVAL
+    algorithm_rl.use_compiled_policy = USE_COMPILED_POLICY
     agent = RLAgent(algorithm_im, algorithm_rl,
                     state_size, action_size, action_range,
                     use_intrinsic=USE_INTRINSIC)
@@ -152,6 +187,16 @@ if __name__ == "__main__":
     if IS_LOAD:
         TrainerMetadata().load()
 
+    evaluator = None
+    if EVAL_INTERVAL > 0:
+        evaluator = AsyncEvaluator(GYM_ENV, interval=EVAL_INTERVAL, episodes=EVAL_EPISODES, num_workers=EVAL_WORKERS,
+                                   seed=seeds.derive('eval') if seeds.is_seeded() else None)
+
+    memory_monitor = None
+    if MEMORY_REPORT_INTERVAL > 0:
+        memory_monitor = MemoryMonitor(interval=MEMORY_REPORT_INTERVAL, budgets=MEMORY_BUDGETS)
+        memory_monitor.watch_agent(agent)
+
     # 최대 에피소드 수만큼 돌린다
     for i_episode in range(TrainerMetadata().current_epoch, EPISODES):
         TrainerMetadata().start_episode()
@@ -184,12 +229,25 @@ if __name__ == "__main__":
 
         TrainerMetadata().log(score, 'score')
         # TrainerMetadata().log(len(agent.algorithm_rl.memory), 'memory_len')
+        if evaluator is not None:
+            evaluator.poll()
+        if memory_monitor is not None:
+            memory_monitor.maybe_report(i_episode)
         TrainerMetadata().finish_episode(i_episode)
 
         if IS_SAVE:
-            TrainerMetadata().save()
+            # 학습 스레드가 가중치를 고치는 도중에 저장하지 않도록
+            with agent.algorithm_rl.paused():
+                TrainerMetadata().save()
+
+        # 일정 간격마다 노이즈 없이 테스트 (결과는 다음 poll() 에서 기록)
+        if evaluator is not None:
+            evaluator.maybe_submit(i_episode, agent.algorithm_rl.evaluation_policy)
 
-        # TODO: 일정 간격마다 노이즈 없이 테스트?
         # if score > env.spec.reward_threshold:
         #     print("Solved! Running reward is now {}".format(score))
         #    break
+
+    agent.algorithm_rl.stop_learner()
+    if evaluator is not None:
+        evaluator.close()
@@ -13,14 +13,20 @@ from algorithm_im.im_sm import PredictiveSurpriseMotivation
 from algorithm_rl.algo05_ppo import PPO
 from utils_kdm.checkpoint import Checkpoint
 from utils_kdm.drawer import Drawer
+from utils_kdm.evaluator import AsyncEvaluator, snapshot_normalization
+from utils_kdm.memory_monitor import MemoryMonitor
 from utils_kdm.normalized_mujoco import NormalizedMujocoEnv
+from utils_kdm.shared_normalizer import SharedNormalizer
+from utils_kdm.seeding import set_default_seeds
+from utils_kdm.synthetic_env import register_synthetic_envs, synthetic_env_id
 from utils_kdm.trainer_metadata import TrainerMetadata
 
 
 # noinspection PyPep8Naming
 class RLAgent(u.TorchSerializable):
 
-    def __init__(self, algorithm_im, algorithm_rl, state_size, action_size, action_range, use_intrinsic=True):
+    def __init__(self, algorithm_im, algorithm_rl, state_size, action_size, action_range, use_intrinsic=True,
+                 running_state=None):
         super().__init__()
 
         self._set_hyper_parameters()
@@ -40,6 +46,13 @@ class RLAgent(u.TorchSerializable):
             'algorithm_rl',
         ])
 
+        # 상태 정규화 통계 (ZFilter) - 불러온 뒤에도 같은 정규화가 되도록 같이 저장
+        self.running_state = running_state
+        if self.running_state is not None:
+            self.register_serializable([
+                'running_state',
+            ])
+
     def _set_hyper_parameters(self):
         pass
 
@@ -86,9 +99,10 @@ if __name__ == "__main__":
     #####################
 
     # 0. 일반 설정
-    # TODO: 시드 넣기
-    # env.seed(args.seed)
-    # torch.manual_seed(args.seed)
+    # 시드 = 실행 시드 하나에서 환경, 리플레이 샘플링, 노이즈, torch 등 구성 요소마다 따로 파생 (None 이면 안 정함)
+    # 결정적 실행 = cuDNN 자동 튜닝 끄기, 학습 스레드 끄기 (최적화 전후 결과를 비트 단위로 비교할 때)
+    SEED, DETERMINISTIC = None, False
+    seeds = set_default_seeds(SEED, deterministic=DETERMINISTIC)
     FORCE_CPU = False
     TrainerMetadata().set_device(force_cpu=FORCE_CPU)
 
@@ -101,31 +115,58 @@ if __name__ == "__main__":
     VERSION = 1
     # TODO: 알고리즘 episode 당 인터벌 계산하는 거 제대로 처리 후 다시 저장 켜기
     IS_LOAD, IS_SAVE, SAVE_INTERVAL = False, False, 422
+    # 비동기 저장 = 직렬화/파일 쓰기를 백그라운드 스레드에서
+    IS_ASYNC_SAVE = True
+    # 샤드 저장 = 변수별 파일 / 보존 정책 = 최근 K개, 최고 점수 K개 (None 이면 전부 보존)
+    IS_SHARDED_SAVE, KEEP_LAST, KEEP_BEST = False, None, None
     SAVE_FULL_PATH = __file__
 
     # 3. 실험 환경 관련 설정
     GYM_ENV = 'Swimmer-v2'
+    # MuJoCo 없이 같은 상태/행동 크기의 가짜 환경으로 (벤치마크, 실행 확인용 / 스텝당 SYNTHETIC_STEP_COST 초 지연)
+    USE_SYNTHETIC_ENV, SYNTHETIC_STEP_COST = False, 0.0
     RENDER = True
     LOG_INTERVAL = 1
     EPOCHS = 100000
     MAX_EPISODES = 30000
+
+    # 평가 = EVAL_INTERVAL epoch 마다 노이즈 없이 EVAL_EPISODES 에피소드 (프로세스 EVAL_WORKERS 개, 학습과 겹쳐서)
+    # 0 이면 평가 안 함
+    EVAL_INTERVAL, EVAL_EPISODES, EVAL_WORKERS = 0, 5, 2
+
+    # 메모리 기록 = MEMORY_REPORT_INTERVAL epoch 마다 구성 요소별 크기 (리플레이, 지역 트리, 지표, RSS, CUDA) 기록
+    # MEMORY_BUDGETS 를 넘으면 경고 / 0 이면 기록 안 함
+    MEMORY_REPORT_INTERVAL = 0
+    MEMORY_BUDGETS = {'rss_bytes': 16 * 2 ** 30, 'exemplars': 10 ** 6}
     STEPS_PER_EPOCH = 4000  # From OpenAI, (논문은 2048)
 
     # 4. 알고리즘 설정
     USE_INTRINSIC = False
+    # 학습 지표 기록 수준 (0 = 끔, 1 = 업데이트 단위, 2 = 미니배치 단위 상세)
+    DIAGNOSTICS_LEVEL = 2
+    # 행동 선택을 trace 한 정책망 (정책망 + 샘플링/노이즈/자르기를 그래프 하나로) 으로
+    USE_COMPILED_POLICY = False
+    # 상태 정규화 통계를 rollout 동안 고정하고 epoch 끝에 한 번에 갱신 (False 면 스텝마다 갱신하는 ZFilter)
+    USE_SHARED_NORMALIZER = False
 
     #####################
     # 객체 구성
     #####################
     viz = Drawer(reset=VISDOM_RESET, env=VIZ_ENV_NAME)
-    checkpoint = Checkpoint(VERSION, IS_SAVE, SAVE_INTERVAL)
+    checkpoint = Checkpoint(VERSION, IS_SAVE, SAVE_INTERVAL, is_async=IS_ASYNC_SAVE,
+                            is_sharded=IS_SHARDED_SAVE, keep_last=KEEP_LAST, keep_best=KEEP_BEST)
 
     # Agent 생성
+    if USE_SYNTHETIC_ENV:
+        register_synthetic_envs(step_cost=SYNTHETIC_STEP_COST)
+        GYM_ENV = synthetic_env_id(GYM_ENV)
     env = gym.make(GYM_ENV)
+    seeds.seed_env(env)
     state_size = env.observation_space.shape[0]
     action_size = env.action_space.shape[0]
     action_range = (min(env.action_space.low), max(env.action_space.high))
-    env = NormalizedMujocoEnv(env, state_size, clip=5)
+    normalizer = SharedNormalizer((state_size,), clip=5) if USE_SHARED_NORMALIZER else None
+    env = NormalizedMujocoEnv(env, state_size, clip=5, normalizer=normalizer)
 
     # Random = 보수 랜덤으로 (지정된 범위 내에서)
     # NM = 예측한 다음 상태와 실제 다음 상태의 오차가 클수록 보상 높음
@@ -139,10 +180,13 @@ if __name__ == "__main__":
     # algorithm_im = PredictiveSurpriseMotivation(state_size, action_size)
     algorithm_im = PredictiveFamiliarityMotivation(state_size, action_size)
 
-    algorithm_rl = PPO(state_size, action_size)
+    algorithm_rl = PPO(state_size, action_size, steps_per_epoch=STEPS_PER_EPOCH)
+    algorithm_rl.diagnostics.level = DIAGNOSTICS_LEVEL
+    algorithm_rl.use_compiled_policy = USE_COMPILED_POLICY
     agent = RLAgent(algorithm_im, algorithm_rl,
                     state_size, action_size, action_range,
-                    use_intrinsic=USE_INTRINSIC)
+                    use_intrinsic=USE_INTRINSIC,
+                    running_state=env.running_state)
 
     # 메타데이터 관리 클래스 설정
     TrainerMetadata().reset(
@@ -174,6 +218,16 @@ if __name__ == "__main__":
     if IS_LOAD:
         TrainerMetadata().load()
 
+    evaluator = None
+    if EVAL_INTERVAL > 0:
+        evaluator = AsyncEvaluator(GYM_ENV, interval=EVAL_INTERVAL, episodes=EVAL_EPISODES, num_workers=EVAL_WORKERS,
+                                   seed=seeds.derive('eval') if seeds.is_seeded() else None)
+
+    memory_monitor = None
+    if MEMORY_REPORT_INTERVAL > 0:
+        memory_monitor = MemoryMonitor(interval=MEMORY_REPORT_INTERVAL, budgets=MEMORY_BUDGETS)
+        memory_monitor.watch_agent(agent)
+
     # TODO: i_epoch 변수 만들고 resume 가능하게
     for i_epoch in range(EPOCHS):
         TrainerMetadata().start_episode()
@@ -212,8 +266,20 @@ if __name__ == "__main__":
             if step_in_epoch == STEPS_PER_EPOCH:
                 break
 
+        if USE_SHARED_NORMALIZER:
+            # 이번 epoch 에 모은 원본 관측으로 정규화 통계 갱신 (다음 epoch 부터 적용)
+            normalizer.update()
         agent.finish_epoch()
+        if evaluator is not None:
+            evaluator.poll()
+        if memory_monitor is not None:
+            memory_monitor.maybe_report(i_epoch)
         TrainerMetadata().finish_episode(i_epoch)
 
         if IS_SAVE:
             TrainerMetadata().save()
+
+        if evaluator is not None:
+            # 평가 환경도 학습 환경과 같은 (고정된) 상태 정규화로
+            evaluator.maybe_submit(i_epoch, agent.algorithm_rl.evaluation_policy,
+                                   lambda: snapshot_normalization(env.running_state))
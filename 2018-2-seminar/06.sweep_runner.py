@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# 하이퍼파라미터 스윕 (알고리즘 x 내적 동기 x 하이퍼파라미터)
+# 프로세스 풀에서 시행 여러 개를 동시에, 연속 반감 (successive halving) 으로 가망 없는 시행은 일찍 멈춘다
+
+from sweep.launcher import Sweep
+from sweep.space import LogUniform, Uniform
+
+if __name__ == "__main__":
+    #####################
+    # 환경 설정
+    #####################
+
+    # 1. 탐색 공간
+    # 리스트 = 후보 (격자 탐색은 모든 조합), LogUniform 등 = 랜덤 탐색에서 범위 안에서 뽑기, 그 외 = 고정
+    # 예약된 키 = algorithm, im, env, steps_per_epoch / 'im.' 으로 시작 = 내적 동기 쪽 하이퍼파라미터
+    SPACE = {
+        'env': 'Swimmer-v2',
+        'algorithm': ['trpo', 'ppo'],
+        'im': ['none', 'nm', 'lpm', 'fm'],
+        'steps_per_epoch': 4000,
+        'max_kl': [0.01, 0.02],
+    }
+    RANDOM_SPACE = {
+        'env': 'Swimmer-v2',
+        'algorithm': ['trpo', 'ppo'],
+        'im': ['none', 'random', 'nm', 'lpm', 'sm', 'fm'],
+        'steps_per_epoch': 4000,
+        'max_kl': LogUniform(0.005, 0.05),
+        'im.intrinsic_reward_ratio': Uniform(0.1, 0.9),
+    }
+
+    # 2. 탐색 방법
+    # 'grid' = SPACE 의 모든 조합 / 'random' = RANDOM_SPACE 에서 NUM_TRIALS 개
+    SEARCH = 'grid'
+    NUM_TRIALS = 24
+    SEARCH_SEED = 0
+
+    # 3. 실행 설정
+    # 워커 = 코어 하나씩 고정 (None 이면 코어 수만큼)
+    NUM_WORKERS = None
+    BASE_SEED = 0
+    RESULTS_DIR = 'sweep_results'
+
+    # 4. 연속 반감
+    # 예산 = 에피소드 (A2C, DQN, DDPG) 또는 epoch (TRPO, PPO)
+    # MIN_BUDGET 에서 시작해서 단계마다 ETA 배로, 상위 1/ETA 만 남김 (False 면 전부 MAX_BUDGET 까지)
+    USE_HALVING = True
+    MIN_BUDGET, MAX_BUDGET, ETA = 10, 270, 3
+    # 점수 = 마지막 SCORE_WINDOW 에피소드 (또는 epoch) 평균
+    SCORE_WINDOW = 10
+
+    #####################
+    # 실행
+    #####################
+    sweep = Sweep.from_space(SPACE if SEARCH == 'grid' else RANDOM_SPACE,
+                             search=SEARCH, num_trials=NUM_TRIALS, search_seed=SEARCH_SEED,
+                             results_dir=RESULTS_DIR, num_workers=NUM_WORKERS, base_seed=BASE_SEED,
+                             use_halving=USE_HALVING, min_budget=MIN_BUDGET, max_budget=MAX_BUDGET, eta=ETA,
+                             score_window=SCORE_WINDOW)
+    ranking = sweep.run()
+
+    print('Best trials')
+    for trial_id, score in ranking[:5]:
+        print('{}: {:.2f} {}'.format(trial_id, score, sweep.configs[trial_id]))
@@ -5,7 +5,7 @@ from abc import ABCMeta, abstractmethod
 import torch
 
 from utils_kdm import TorchSerializable
-from utils_kdm.trainer_metadata import TrainerMetadata
+from utils_kdm.trainer_context import resolve_context
 
 
 # noinspection PyPep8Naming
@@ -14,11 +14,12 @@ from utils_kdm.trainer_metadata import TrainerMetadata
 class IntrinsicMotivation(TorchSerializable):
     __metaclass__ = ABCMeta
 
-    def __init__(self, state_size, action_size):
+    def __init__(self, state_size, action_size, context=None):
         super().__init__()
 
         self._set_hyper_parameters()
-        self.device = TrainerMetadata().device
+        self.context = resolve_context(context)
+        self.device = self.context.device
 
         self.state_size, self.action_size = state_size, action_size
 
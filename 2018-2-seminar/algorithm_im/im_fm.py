@@ -40,10 +40,10 @@ class StatePredictor(nn.Module):
 
 class PredictiveFamiliarityMotivation(IntrinsicMotivation):
 
-    def __init__(self, state_size, action_size):
-        super().__init__(state_size, action_size)
+    def __init__(self, state_size, action_size, context=None):
+        super().__init__(state_size, action_size, context=context)
         self._set_hyper_parameters()
-        self.region_manager = RegionManager(self.state_size, self.action_size)
+        self.region_manager = RegionManager(self.state_size, self.action_size, device=self.device)
 
         self.register_serializable([
             'self.region_manager',
@@ -60,9 +60,9 @@ class PredictiveFamiliarityMotivation(IntrinsicMotivation):
         current_state, current_action, current_reward, current_next_state = current_sars
 
         examplar = ExemplarStructure(
-            u.t_float32(current_state),
-            u.t_float32(current_action),
-            u.t_float32(current_next_state)
+            u.t_float32(current_state, self.device),
+            u.t_float32(current_action, self.device),
+            u.t_float32(current_next_state, self.device)
         )
         self.region_manager.add(examplar)
 
@@ -70,7 +70,7 @@ class PredictiveFamiliarityMotivation(IntrinsicMotivation):
         current_error = region.get_current_error_mean()
         intrinsic_reward = self.intrinsic_scale_1 / current_error
 
-        intrinsic_reward = u.t_float32(intrinsic_reward)
+        intrinsic_reward = u.t_float32(intrinsic_reward, self.device)
         # TrainerMetadata().log(value=intrinsic_reward, indicator='intrinsic_reward',
         # variable='raw', interval=1, show_only_last=False, compute_maxmin=False)
         intrinsic_reward = torch.clamp(intrinsic_reward, min=-2, max=2)
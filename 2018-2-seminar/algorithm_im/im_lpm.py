@@ -10,10 +10,10 @@ from algorithm_im.region import RegionManager, ExemplarStructure
 class LearningProgressMotivation(IntrinsicMotivation):
     # Oudeyer et al. (2007)
 
-    def __init__(self, state_size, action_size):
-        super().__init__(state_size, action_size)
+    def __init__(self, state_size, action_size, context=None):
+        super().__init__(state_size, action_size, context=context)
         self._set_hyper_parameters()
-        self.region_manager = RegionManager(self.state_size, self.action_size)
+        self.region_manager = RegionManager(self.state_size, self.action_size, device=self.device)
 
         self.register_serializable([
             'self.region_manager',
@@ -27,9 +27,9 @@ class LearningProgressMotivation(IntrinsicMotivation):
         current_state, current_action, current_reward, current_next_state = current_sars
 
         examplar = ExemplarStructure(
-            u.t_float32(current_state),
-            u.t_float32(current_action),
-            u.t_float32(current_next_state)
+            u.t_float32(current_state, self.device),
+            u.t_float32(current_action, self.device),
+            u.t_float32(current_next_state, self.device)
         )
         self.region_manager.add(examplar)
 
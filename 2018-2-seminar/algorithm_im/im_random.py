@@ -15,8 +15,8 @@ from utils_kdm.trainer_metadata import TrainerMetadata
 
 class RandomMotivation(IntrinsicMotivation):
 
-    def __init__(self, state_size, action_size):
-        super().__init__(state_size, action_size)
+    def __init__(self, state_size, action_size, context=None):
+        super().__init__(state_size, action_size, context=context)
         self._set_hyper_parameters()
 
     def _set_hyper_parameters(self):
@@ -33,7 +33,7 @@ class RandomMotivation(IntrinsicMotivation):
         # Random motivation
         current_state, current_action, current_reward, current_next_state = current_sars
 
-        intrinsic_reward = torch.rand_like(u.t_float32(current_reward))
+        intrinsic_reward = torch.rand_like(u.t_float32(current_reward, self.device))
         intrinsic_reward = (self.a * intrinsic_reward) + self.b
 
         return intrinsic_reward
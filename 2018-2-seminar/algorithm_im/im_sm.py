@@ -64,8 +64,8 @@ class MetaPredictor(nn.Module):
 
 class PredictiveSurpriseMotivation(IntrinsicMotivation):
 
-    def __init__(self, state_size, action_size):
-        super().__init__(state_size, action_size)
+    def __init__(self, state_size, action_size, context=None):
+        super().__init__(state_size, action_size, context=context)
         self._set_hyper_parameters()
 
         # Expert Network: (s, a') => (s+1')
@@ -135,9 +135,9 @@ class PredictiveSurpriseMotivation(IntrinsicMotivation):
         current_state, current_action, current_reward, current_next_state = current_sars
 
         state_prediction_error, meta_prediction_error = self._train_model(
-            u.t_float32(current_state),
-            u.t_float32(current_action),
-            u.t_float32(current_next_state)
+            u.t_float32(current_state, self.device),
+            u.t_float32(current_action, self.device),
+            u.t_float32(current_next_state, self.device)
         )
         intrinsic_reward = self.intrinsic_scale_1 * (state_prediction_error / meta_prediction_error)
 
@@ -49,11 +49,11 @@ class Region(u.TorchSerializable):
 
     # TODO: 리전별로 객체화 하면 엄청 느릴 것 같은데..
     # TODO: Torch stack으로?
-    def __init__(self, state_size, action_size):
+    def __init__(self, state_size, action_size, device=None):
         super().__init__()
 
         self._set_hyper_parameters()
-        self.device = TrainerMetadata().device
+        self.device = device if device else TrainerMetadata().device
         self.state_size = state_size
         self.action_size = action_size
 
@@ -238,12 +238,12 @@ class Region(u.TorchSerializable):
 
 class RegionManager(u.TorchSerializable):
 
-    def __init__(self, state_size, action_size):
+    def __init__(self, state_size, action_size, device=None):
         super().__init__()
 
         self._set_hyper_parameters()
-        self.device = TrainerMetadata().device
-        self.region_head = Region(state_size, action_size)
+        self.device = device if device else TrainerMetadata().device
+        self.region_head = Region(state_size, action_size, device=self.device)
 
         self.register_serializable([
             'self.region_head',
@@ -279,10 +279,10 @@ class RegionManager(u.TorchSerializable):
                 min_weighted_var, min_cutting_dim, min_left_indices, min_right_indices = \
                     weighted_var, dim, left_indices, right_indices
 
-        min_left_child = Region(region.state_size, region.action_size)
+        min_left_child = Region(region.state_size, region.action_size, device=region.device)
         min_left_child.add_all(list(compress(region.exemplars, min_left_indices)))
 
-        min_right_child = Region(region.state_size, region.action_size)
+        min_right_child = Region(region.state_size, region.action_size, device=region.device)
         min_right_child.add_all(list(compress(region.exemplars, min_right_indices)))
 
         first_dim, second_dim = region.global_dim_to_local_dim(min_cutting_dim)
@@ -313,6 +313,28 @@ class RegionManager(u.TorchSerializable):
 
         return min_weighted_var, min_left_indices, min_right_indices
 
+    def regions(self):
+        # 트리의 모든 지역 (루프, 트리가 깊어도 재귀 한도 걱정 없음)
+        stack = [self.region_head]
+        while stack:
+            region = stack.pop()
+            yield region
+            if not region.is_leaf():
+                stack.append(region.left_child)
+                stack.append(region.right_child)
+
+    def memory_stats(self):
+        # (지역 수, 잎 지역 수, 예시 수, 예시 텐서 바이트) / 예시는 잎 지역에만 있다 (분할하면 부모는 지움)
+        num_regions, num_leaves, num_exemplars = 0, 0, 0
+        exemplars = list()
+        for region in self.regions():
+            num_regions += 1
+            if region.is_leaf():
+                num_leaves += 1
+                num_exemplars += len(region.exemplars)
+                exemplars.append(region.exemplars)
+        return num_regions, num_leaves, num_exemplars, u.tensor_nbytes(exemplars)
+
     def find_region(self, sars, region=None):
         # TODO: 재귀에서 루프로 바꾸기 (트리가 엄청 깊음)
         current = region if region else self.region_head
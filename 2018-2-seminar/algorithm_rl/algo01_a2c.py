@@ -3,6 +3,7 @@
 
 from collections import namedtuple
 
+import numpy as np
 import torch
 import torch.nn as nn
 # noinspection PyPep8Naming
@@ -11,6 +12,9 @@ import torch.optim as optim
 from torch.distributions import Categorical
 
 import utils_kdm as u
+from utils_kdm.evaluator import snapshot_policy
+from utils_kdm.policy_export import CategoricalPolicyExport, trace_policy, save_policy
+from utils_kdm.trainer_context import resolve_context
 from utils_kdm.trainer_metadata import TrainerMetadata
 
 # Python Pickle은 nested namedtuple save를 지원하지 않음
@@ -21,9 +25,9 @@ Transition = namedtuple('Transition', ('state', 'action', 'reward', 'next_state'
 
 class Actor(nn.Module):
 
-    def __init__(self, state_size, action_size):
+    def __init__(self, state_size, action_size, device=None):
         super(Actor, self).__init__()
-        self.device = TrainerMetadata().device
+        self.device = device if device else TrainerMetadata().device
         self.layer_sizes = [state_size, 24, action_size]
 
         self.linear1 = nn.Linear(self.layer_sizes[0], self.layer_sizes[1])
@@ -41,9 +45,9 @@ class Actor(nn.Module):
 
 class Critic(nn.Module):
 
-    def __init__(self, state_size, value_size):
+    def __init__(self, state_size, value_size, device=None):
         super(Critic, self).__init__()
-        self.device = TrainerMetadata().device
+        self.device = device if device else TrainerMetadata().device
         self.layer_sizes = [state_size, 24, 24, value_size]
 
         self.linear1 = nn.Linear(self.layer_sizes[0], self.layer_sizes[1])
@@ -61,19 +65,20 @@ class Critic(nn.Module):
 
 class A2C(u.TorchSerializable):
 
-    def __init__(self, state_size, action_size):
+    def __init__(self, state_size, action_size, context=None):
         super().__init__()
 
         self._set_hyper_parameters()
-        self.device = TrainerMetadata().device
+        self.context = resolve_context(context)
+        self.device = self.context.device
 
         # 기본 설정
         self.state_size, self.action_size = state_size, action_size
         self.value_size = 1
 
         # 모델 빌드
-        self.actor = Actor(self.state_size, self.action_size).to(self.device)
-        self.critic = Critic(self.state_size, self.value_size).to(self.device)
+        self.actor = Actor(self.state_size, self.action_size, device=self.device).to(self.device)
+        self.critic = Critic(self.state_size, self.value_size, device=self.device).to(self.device)
 
         # Optimizer
         self.actor_optimizer = optim.Adam(
@@ -86,6 +91,12 @@ class A2C(u.TorchSerializable):
             lr=self.learning_rate_critic
         )
 
+        # n-step 학습용: 환경 N개에서 한 스텝씩 모은 (상태, 행동, 보상, 종료) 묶음 T개
+        self.rollout = list()
+
+        # use_compiled_policy 일 때 첫 get_action() 에서 만듦
+        self.compiled_policy = None
+
         self.register_serializable([
             'self.actor',
             'self.critic',
@@ -101,21 +112,44 @@ class A2C(u.TorchSerializable):
         # 평가망 학습 하이퍼 파라미터
         self.discount_factor = 0.99
 
+        # n-step 학습 (train_model_n_step) 에서 한 번 업데이트할 때 모으는 스텝 수
+        self.n_steps = 5
+
+        # 행동 선택을 trace 한 정책망 (정책망 + 후처리를 그래프 하나로) 으로 할 것인가
+        self.use_compiled_policy = False
+
     def reset(self):
         pass
 
     def get_action(self, state):
-        state = u.t_from_np_to_float32(state)
+        state = u.t_from_np_to_float32(state, self.device)
+        if self.use_compiled_policy:
+            if self.compiled_policy is None:
+                self.compiled_policy = self.export_policy()
+            with torch.no_grad():
+                return self.compiled_policy(state).item()
+
         probs = self.actor(state)
         return Categorical(probs).sample().item()
 
+    def export_policy(self, path=None):
+        # 정책망 + 샘플링을 trace 해서 반환 (path 가 있으면 파일로도 저장)
+        traced = trace_policy(CategoricalPolicyExport(self.actor), torch.zeros(self.state_size, device=self.device))
+        if path is not None:
+            save_policy(traced, path)
+        return traced
+
+    def evaluation_policy(self):
+        # 노이즈 없는 평가용 정책망 스냅샷 (행동 확률 argmax)
+        return snapshot_policy(self.actor, Actor, (self.state_size, self.action_size), 'greedy')
+
     def train_model(self, sars, done):
         (state, action, reward, next_state) = sars
 
-        state = u.t_float32(state)
-        action = u.t_float32(action)
-        reward = u.t_float32(reward)
-        next_state = u.t_float32(next_state)
+        state = u.t_float32(state, self.device)
+        action = u.t_float32(action, self.device)
+        reward = u.t_float32(reward, self.device)
+        next_state = u.t_float32(next_state, self.device)
 
         value = self.critic(state)
         next_value = self.critic(next_state)
@@ -139,5 +173,66 @@ class A2C(u.TorchSerializable):
         self.critic_optimizer.step()
 
         if done:
-            TrainerMetadata().log(critic_loss, 'critic_loss')
-            TrainerMetadata().log(actor_loss, 'actor_loss')
+            self.context.metadata.log(critic_loss, 'critic_loss')
+            self.context.metadata.log(actor_loss, 'actor_loss')
+
+    def get_actions(self, states):
+        # 환경 N개의 상태 [N, state_size] -> 행동 N개 (정책망 forward 1번)
+        states = u.t_from_np_to_float32(states, self.device)
+        with torch.no_grad():
+            probs = self.actor(states)
+        return Categorical(probs).sample().cpu().numpy()
+
+    def append_rollout(self, states, actions, rewards, dones):
+        # 각 인자는 환경 N개 분량의 numpy 배열
+        self.rollout.append((states, actions, rewards, dones))
+
+    def is_rollout_full(self):
+        return len(self.rollout) >= self.n_steps
+
+    def _get_n_step_returns(self, rewards, masks, next_value):
+        # rewards, masks = [T, N], next_value = [N]
+        # R_t = r_t + γ * (1 - done_t) * R_t+1, 맨 끝은 평가망 추정값으로 부트스트랩
+        # 시간 축으로만 T번 돌고, 환경 N개는 한꺼번에 계산
+        returns = torch.empty_like(rewards)
+        running_return = next_value
+        for t in reversed(range(rewards.size(0))):
+            running_return = rewards[t] + self.discount_factor * masks[t] * running_return
+            returns[t] = running_return
+        return returns
+
+    def train_model_n_step(self, next_states):
+        # 환경 N개 x T스텝 = T*N개 전이로 정책망, 평가망을 한 번에 업데이트
+        # 한 스텝마다 업데이트하는 train_model() 과 달리 forward/backward/step 이 T*N개당 한 번
+        states, actions, rewards, dones = [np.stack(field) for field in zip(*self.rollout)]
+        self.rollout = list()
+        n_steps, num_envs = rewards.shape
+
+        # 필드당 호스트->디바이스 복사 1번
+        states = u.t_from_np_to_float32(states.reshape(n_steps * num_envs, -1), self.device)
+        actions = u.t_from_np_to_long(actions.reshape(-1), self.device)
+        masks = u.t_from_np_to_float32(1 - dones.astype(np.float32), self.device)
+        rewards = u.t_from_np_to_float32(rewards, self.device)
+        next_states = u.t_from_np_to_float32(next_states, self.device)
+
+        with torch.no_grad():
+            next_value = self.critic(next_states).view(num_envs)
+        returns = self._get_n_step_returns(rewards, masks, next_value).view(-1)
+
+        values = self.critic(states).view(-1)
+        advantages = returns - values.detach()
+
+        probs = self.actor(states)
+        actor_loss = -torch.mean(Categorical(probs).log_prob(actions) * advantages)
+        critic_loss = torch.mean((returns - values) ** 2)
+
+        # 정책망, 평가망은 파라미터를 공유하지 않으므로 합쳐서 backward 한 번
+        self.actor_optimizer.zero_grad()
+        self.critic_optimizer.zero_grad()
+        (actor_loss + critic_loss).backward()
+        self.actor_optimizer.step()
+        self.critic_optimizer.step()
+
+        if dones.any():
+            self.context.metadata.log(critic_loss, 'critic_loss')
+            self.context.metadata.log(actor_loss, 'actor_loss')
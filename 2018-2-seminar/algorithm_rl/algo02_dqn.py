@@ -6,11 +6,8 @@
 # https://pytorch.org/tutorials/_downloads/reinforcement_q_learning.py
 #
 
-import random
 from collections import namedtuple
-from itertools import compress
 
-import numpy as np
 import torch
 import torch.nn as nn
 # noinspection PyPep8Naming
@@ -18,8 +15,13 @@ import torch.nn.functional as F
 import torch.optim as optim
 
 import utils_kdm as u
-from utils_kdm.replay_memory import ReplayMemory
+from utils_kdm.evaluator import snapshot_policy
+from utils_kdm.policy_export import GreedyPolicyExport, trace_policy, save_policy
+from utils_kdm.replay_memory import ColumnarReplayMemory
+from utils_kdm.target_network import TargetNetworkUpdater
+from utils_kdm.trainer_context import resolve_context
 from utils_kdm.trainer_metadata import TrainerMetadata
+from utils_kdm.transition_staging import TransitionStaging
 
 # Python Pickle은 nested namedtuple save를 지원하지 않음
 # https://stackoverflow.com/questions/4677012/python-cant-pickle-type-x-attribute-lookup-failed
@@ -29,9 +31,9 @@ Transition = namedtuple('Transition', ('state', 'action', 'reward', 'next_state'
 
 class DQNNetwork(nn.Module):
 
-    def __init__(self, state_size, action_size, action_range=(-1, 1)):
+    def __init__(self, state_size, action_size, action_range=(-1, 1), device=None):
         super(DQNNetwork, self).__init__()
-        self.device = TrainerMetadata().device
+        self.device = device if device else TrainerMetadata().device
         self.layer_sizes = [state_size, 24, 24, action_size]
 
         # TODO: 정규화된 입력인지 검사 문구 넣고 range 빼기
@@ -51,11 +53,12 @@ class DQNNetwork(nn.Module):
 
 class DQN(u.TorchSerializable):
 
-    def __init__(self, state_size, action_size, action_range=(-1, 1)):
+    def __init__(self, state_size, action_size, action_range=(-1, 1), context=None):
         super().__init__()
 
         self._set_hyper_parameters()
-        self.device = TrainerMetadata().device
+        self.context = resolve_context(context)
+        self.device = self.context.device
 
         # 기본 설정
         self.state_size, self.action_size = state_size, action_size
@@ -63,8 +66,8 @@ class DQN(u.TorchSerializable):
         self.action_low, self.action_high = action_range
 
         # 모델 빌드
-        self.policy = DQNNetwork(self.state_size, self.action_size).to(self.device)
-        self.target_policy = DQNNetwork(self.state_size, self.action_size).to(self.device)
+        self.policy = DQNNetwork(self.state_size, self.action_size, device=self.device).to(self.device)
+        self.target_policy = DQNNetwork(self.state_size, self.action_size, device=self.device).to(self.device)
 
         # 타겟 정책망을 정책망 가중치로 초기화
         self.target_policy.load_state_dict(self.policy.state_dict())
@@ -72,6 +75,9 @@ class DQN(u.TorchSerializable):
         # 타겟망은 오차계산 및 업데이트 안 하는 평가 전용모드임을 선언
         self.target_policy.eval()
 
+        # 가중치 복사를 파라미터 버퍼 하나에 대한 copy_ 한 번으로
+        self.target_updater = TargetNetworkUpdater(self.policy, self.target_policy)
+
         # Optimizer
         self.policy_optimizer = optim.Adam(
             self.policy.parameters(),
@@ -80,8 +86,30 @@ class DQN(u.TorchSerializable):
 
         # 리플레이 메모리
         # DQN, DDPG에서 제안하고 쓰는 개념이므로 정의는 따로 두더라도 인스턴스는 알고리즘 내부에서 갖고 있는다
+        # 필드별 텐서로 들고 있어서 샘플링 결과가 바로 배치 텐서 (torch.stack 불필요)
+        # done 은 곱하기 마스크로 쓰므로 실수로 저장
         self.transition_structure = Transition
-        self.memory = ReplayMemory(self.memory_maxlen, self.transition_structure)
+        field_sizes = [self.state_size, 1, 1, self.state_size, 1]
+        field_dtypes = [torch.float32, torch.long, torch.float32, torch.float32, torch.float32]
+        self.memory = ColumnarReplayMemory(self.memory_maxlen, field_sizes, field_dtypes,
+                                           self.transition_structure, device=self.device,
+                                           generator=self.context.seeds.torch_generator('replay'))
+        # ε-탐험용 난수 (리플레이 샘플링, 정책망과 따로)
+        self.rng = self.context.seeds.python_rng('exploration')
+
+        # 스텝마다 텐서 5개 만드는 대신 모았다가 한 번에 리플레이 메모리로
+        self.staging = None
+        if self.staging_chunk_size > 0:
+            self.staging = TransitionStaging(
+                field_sizes=field_sizes,
+                field_dtypes=field_dtypes,
+                sink=self.memory.push_batch,
+                chunk_size=self.staging_chunk_size,
+                device=self.device
+            )
+
+        # use_compiled_policy 일 때 첫 get_action() 에서 만듦
+        self.compiled_policy = None
 
         self.register_serializable([
             'self.policy',
@@ -108,68 +136,76 @@ class DQN(u.TorchSerializable):
         self.batch_size = 64
         self.memory_maxlen = 2000
         self.train_start = 64
+        # 전이를 이만큼 모았다가 한 번에 리플레이 메모리로 (0 = 안 씀, 매 스텝 바로 넣음)
+        # 주의: 켜면 알고리즘이 바뀐다 (그래서 기본은 끔, 예: 32)
+        #   - 덩어리가 차거나 에피소드가 끝나야 메모리에 들어가므로 학습은 최대 (chunk_size - 1) 스텝 늦은 메모리에서 샘플링
+        #   - len(memory) >= train_start 로 학습을 시작하는 시점도 그만큼 늦어진다
+        self.staging_chunk_size = 0
+
+        # 행동 선택을 trace 한 정책망 (정책망 + 후처리를 그래프 하나로) 으로 할 것인가
+        self.use_compiled_policy = False
 
     def reset(self):
         # 정책망에서 타겟망으로 가중치 복사 (한 에피소드 끝날 때마다 호출됨)
-        self.target_policy.load_state_dict(self.policy.state_dict())
+        self.target_updater.hard_update()
 
     def append_sample(self, sars, done):
         state, action, reward, next_state = sars
-        self.memory.push(
-            u.t_float32(state),
-            u.t_long(action),
-            u.t_float32(reward),
-            u.t_float32(next_state),
-            u.t_uint8(done)
-        )
+        if self.staging is not None:
+            self.staging.push(state, action, reward, next_state, done)
+            if done:
+                self.staging.flush()
+            return
+
+        self.memory.push(state, action, reward, next_state, done)
 
     def get_action(self, state):
-        if np.random.rand() <= self.epsilon:
+        if self.rng.random() <= self.epsilon:
             # 낮은 확률로 랜덤으로 선택한다
-            return random.randrange(self.action_size)
+            return self.rng.randrange(self.action_size)
         else:
             # 현재 상태 기준으로 정책망에서 행동 보상을 예측한 값을 갖고 오고, 큰 쪽을 행동으로 취한다
-            state = u.t_from_np_to_float32(state)
+            state = u.t_from_np_to_float32(state, self.device)
+            if self.use_compiled_policy:
+                if self.compiled_policy is None:
+                    self.compiled_policy = self.export_policy()
+                with torch.no_grad():
+                    return self.compiled_policy(state).item()
+
             max_val, max_index = self.policy(state).max(dim=0)
             return max_index.item()
 
+    def export_policy(self, path=None):
+        # 정책망 + argmax 를 trace 해서 반환 (path 가 있으면 파일로도 저장)
+        traced = trace_policy(GreedyPolicyExport(self.policy), torch.zeros(self.state_size, device=self.device))
+        if path is not None:
+            save_policy(traced, path)
+        return traced
+
+    def evaluation_policy(self):
+        # 노이즈 없는 평가용 정책망 스냅샷 (ε-탐험 없이 큐함수 argmax)
+        return snapshot_policy(self.policy, DQNNetwork, (self.state_size, self.action_size), 'greedy')
+
     def train_model(self, sars, done):
         if self.epsilon > self.epsilon_min:
             self.epsilon *= self.epsilon_decay
 
         # 메모리에서 일정 크기만큼 기억을 불러온다
-        # 그 후 기억을 모아 각 변수별로 모은다. (즉, 전치행렬)
-        # TODO: random과 zip func 글카에서 하기
-        transitions = self.memory.sample(self.batch_size)
+        # 필드별로 이미 [batch_size, 필드 크기] 텐서로 나온다 (디바이스 위에서 인덱싱만)
         # SARS = State, Action, Reward, next State
-        sars_batch = self.transition_structure(*zip(*transitions))
-
-        # TODO: 이거 튜플로 묶으면 다시 GPU에서 CPU로 오나?
-        # 텐서의 집합에서 고차원 텐서로
-        # tuple(tensor, ...) -> tensor()
-        s_batch = torch.stack(sars_batch.state).to(self.device)
-        a_batch = torch.stack(sars_batch.action).to(self.device)
-        r_batch = torch.stack(sars_batch.reward).to(self.device)
-        next_s_batch = torch.stack(sars_batch.next_state).to(self.device)
-        done_batch = torch.stack(sars_batch.done).to(self.device)
+        s_batch, a_batch, r_batch, next_s_batch, done_batch = self.memory.sample(self.batch_size)
 
         # 정책망에 각각의 기억에 대해 상태를 넣어서 각각의 액션 보상을 구한다.
         # 그 다음에 선택한 액션 쪽의 보상을 가져온다.
         state_action_values = self.policy(s_batch).gather(1, a_batch)
 
-        # 타겟망 예측에서, 아직 안 죽은 거에만 큐함수 추정을 더해주기 위해 마스크를 만들기
-        # 어렵게 마스크를 만드는 이유? 한번에 모아서 신경망에 보내면 실행 속도가 빨라짐..
-        # 안 죽었을 때의 상태들만 가져오기
-        not_done = [not i for i in done_batch]
-        non_final_mask = u.t_uint8(not_done).squeeze().to(self.device)
-        non_final_next_states = torch.stack(list(compress(next_s_batch, not_done)))
-
-        # 안 죽었을 때의 타겟망 보상 추정하기
-        next_state_values = torch.zeros(len(s_batch), device=self.device)
-        next_state_values[non_final_mask] = self.target_policy(non_final_next_states).max(1)[0].detach()
-        next_state_values = next_state_values.unsqueeze(dim=1)
+        # 타겟망 예측에서, 아직 안 죽은 거에만 큐함수 추정을 더해주기
+        # 안 죽은 상태만 골라내서 다시 쌓는 대신, 전부 타겟망에 넣고 (1 - done)을 곱한다
+        # -> 파이썬 루프, 호스트 왕복 없이 고정된 몇 개의 커널로 끝남
+        with torch.no_grad():
+            next_state_values = self.target_policy(next_s_batch).max(dim=1, keepdim=True)[0]
         # 기존 보상에 안 죽었을 때만 큐함수 추정을 더하기
-        expected_state_action_values = r_batch + (self.discount_factor * next_state_values)
+        expected_state_action_values = r_batch + (self.discount_factor * next_state_values * (1 - done_batch))
 
         # 정책망의 예측 보상과 타겟망의 예측 보상을 MSE 비교
         self.policy_optimizer.zero_grad()
@@ -179,4 +215,4 @@ class DQN(u.TorchSerializable):
         self.policy_optimizer.step()
 
         if done:
-            TrainerMetadata().log(loss, 'policy_loss')
+            self.context.metadata.log(loss, 'policy_loss')
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 # DDPG
 
+import copy
+import threading
 from collections import namedtuple
+from contextlib import contextmanager
 
 import numpy as np
 import torch
@@ -12,8 +15,14 @@ import torch.optim as optim
 
 import utils_kdm as u
 from utils_ext.noise import OrnsteinUhlenbeckNoise
-from utils_kdm.replay_memory import ReplayMemory
+from utils_kdm.evaluator import snapshot_policy
+from utils_kdm.learner_thread import LearnerThread
+from utils_kdm.policy_export import DeterministicPolicyExport, trace_policy, save_policy
+from utils_kdm.replay_memory import ColumnarReplayMemory
+from utils_kdm.target_network import TargetNetworkUpdater
+from utils_kdm.trainer_context import resolve_context
 from utils_kdm.trainer_metadata import TrainerMetadata
+from utils_kdm.transition_staging import TransitionStaging
 
 # Python Pickle은 nested namedtuple save를 지원하지 않음
 # https://stackoverflow.com/questions/4677012/python-cant-pickle-type-x-attribute-lookup-failed
@@ -23,9 +32,9 @@ Transition = namedtuple('Transition', ('state', 'action', 'reward', 'next_state'
 
 class Actor(nn.Module):
 
-    def __init__(self, state_size, action_size, action_range=(-1, 1)):
+    def __init__(self, state_size, action_size, action_range=(-1, 1), device=None):
         super(Actor, self).__init__()
-        self.device = TrainerMetadata().device
+        self.device = device if device else TrainerMetadata().device
         self.layer_sizes = [state_size, 400, 300, action_size]
 
         # TODO: 정규화된 입력인지 검사 문구 넣고 range 빼기
@@ -47,9 +56,9 @@ class Actor(nn.Module):
 
 class Critic(nn.Module):
 
-    def __init__(self, state_size, action_size):
+    def __init__(self, state_size, action_size, device=None):
         super(Critic, self).__init__()
-        self.device = TrainerMetadata().device
+        self.device = device if device else TrainerMetadata().device
         self.layer_sizes = [state_size + action_size, 400, 300, action_size]
 
         self.linear1 = nn.Linear(self.layer_sizes[0], self.layer_sizes[1])
@@ -74,11 +83,12 @@ class Critic(nn.Module):
 
 class DDPG(u.TorchSerializable):
 
-    def __init__(self, state_size, action_size, action_range=(-1, 1)):
+    def __init__(self, state_size, action_size, action_range=(-1, 1), context=None):
         super().__init__()
 
         self._set_hyper_parameters()
-        self.device = TrainerMetadata().device
+        self.context = resolve_context(context)
+        self.device = self.context.device
 
         # 기본 설정
         self.state_size, self.action_size = state_size, action_size
@@ -86,10 +96,10 @@ class DDPG(u.TorchSerializable):
         self.action_low, self.action_high = action_range
 
         # 모델 빌드
-        self.actor = Actor(self.state_size, self.action_size).to(self.device)
-        self.critic = Critic(self.state_size, self.action_size).to(self.device)
-        self.target_actor = Actor(self.state_size, self.action_size).to(self.device)
-        self.target_critic = Critic(self.state_size, self.action_size).to(self.device)
+        self.actor = Actor(self.state_size, self.action_size, device=self.device).to(self.device)
+        self.critic = Critic(self.state_size, self.action_size, device=self.device).to(self.device)
+        self.target_actor = Actor(self.state_size, self.action_size, device=self.device).to(self.device)
+        self.target_critic = Critic(self.state_size, self.action_size, device=self.device).to(self.device)
 
         # 타겟 정책망, 타겟 평가망 가중치를 각각 정책망, 평가망 가중치로 초기화
         self.target_actor.load_state_dict(self.actor.state_dict())
@@ -99,6 +109,10 @@ class DDPG(u.TorchSerializable):
         self.target_actor.eval()
         self.target_critic.eval()
 
+        # 타겟망 soft update 를 파라미터 버퍼 하나에 대한 lerp_ 한 번으로
+        self.target_actor_updater = TargetNetworkUpdater(self.actor, self.target_actor)
+        self.target_critic_updater = TargetNetworkUpdater(self.critic, self.target_critic)
+
         # Optimizer
         self.actor_optimizer = optim.Adam(
             self.actor.parameters(),
@@ -113,11 +127,38 @@ class DDPG(u.TorchSerializable):
 
         # 리플레이 메모리
         # DQN, DDPG에서 제안하고 쓰는 개념이므로 정의는 따로 두더라도 인스턴스는 알고리즘 내부에서 갖고 있는다
+        # 필드별 텐서로 들고 있어서 샘플링 결과가 바로 배치 텐서 (학습 스레드에서 샘플링해도 파이썬 리스트 조작 없음)
         self.transition_structure = Transition
-        self.memory = ReplayMemory(self.memory_maxlen, self.transition_structure)
+        field_sizes = [self.state_size, self.action_size, 1, self.state_size, 1]
+        field_dtypes = [torch.float32, torch.float32, torch.float32, torch.float32, torch.float32]
+        self.memory = ColumnarReplayMemory(self.memory_maxlen, field_sizes, field_dtypes,
+                                           self.transition_structure, device=self.device,
+                                           generator=self.context.seeds.torch_generator('replay'))
+
+        # 스텝마다 텐서 5개 만드는 대신 모았다가 한 번에 리플레이 메모리로
+        self.staging = None
+        if self.staging_chunk_size > 0:
+            self.staging = TransitionStaging(
+                field_sizes=field_sizes,
+                field_dtypes=field_dtypes,
+                sink=self._push_batch,
+                chunk_size=self.staging_chunk_size,
+                device=self.device
+            )
+
+        # 학습 스레드 (use_learner_thread 일 때 첫 train_model() 에서 시작)
+        # 학습 스레드가 정책망을 고치는 동안 행동 선택은 따로 복사해 둔 정책망(acting_actor)으로 한다
+        self.learner = None
+        self.acting_actor = None
+        self.acting_actor_updater = None
+        self.acting_lock = threading.Lock()
+        self.last_losses = None
+
+        # use_compiled_policy 일 때 첫 get_action() 에서 만듦 (학습 스레드를 쓰면 acting_actor 기준)
+        self.compiled_policy = None
 
         # 오른스타인-우렌벡 과정
-        self.noise = OrnsteinUhlenbeckNoise(self.action_size)
+        self.noise = OrnsteinUhlenbeckNoise(self.action_size, rng=self.context.seeds.numpy_rng('noise'))
 
         self.register_serializable([
             'self.actor',
@@ -151,29 +192,97 @@ class DDPG(u.TorchSerializable):
         # self.memory_maxlen = int(1e+6)
         self.memory_maxlen = 750000
         self.train_start = 2000
+        # 전이를 이만큼 모았다가 한 번에 리플레이 메모리로 (0 = 안 씀, 매 스텝 바로 넣음)
+        # 주의: 켜면 알고리즘이 바뀐다 (그래서 기본은 끔, 예: 64)
+        #   - 덩어리가 차거나 에피소드가 끝나야 메모리에 들어가므로 학습은 최대 (chunk_size - 1) 스텝 늦은 메모리에서 샘플링
+        #   - len(memory) >= train_start 로 학습을 시작하는 시점도 그만큼 늦어진다
+        self.staging_chunk_size = 0
+
+        # 환경 1스텝당 학습 스텝 수 (update-to-data ratio)
+        self.updates_per_step = 1
+        # 학습을 별도 스레드에서 (환경 스텝과 학습 스텝이 겹쳐서 돌아감)
+        self.use_learner_thread = False
+        # 학습 스레드 사용 시, 행동 선택용 정책망을 몇 학습 스텝마다 갱신할지
+        self.actor_sync_interval = 100
+        # 학습 스레드에 밀린 학습 스텝이 이만큼 넘으면 환경 스텝을 잠시 멈춘다
+        self.max_pending_updates = 1000
 
     def reset(self):
         self.noise.reset()
 
+    def _push_batch(self, *args):
+        # 학습 스레드가 샘플링하는 도중에 position, size 가 바뀌면 안 된다
+        with self.paused():
+            self.memory.push_batch(*args)
+
     def append_sample(self, sars, done):
         state, action, reward, next_state = sars
-        self.memory.push(
-            u.t_float32(state),
-            u.t_float32(action),
-            u.t_float32(reward),
-            u.t_float32(next_state),
-            u.t_uint8(done)
-        )
+        if self.staging is not None:
+            self.staging.push(state, action, reward, next_state, done)
+            if done:
+                self.staging.flush()
+            return
+
+        with self.paused():
+            self.memory.push(state, action, reward, next_state, done)
+
+    @contextmanager
+    def paused(self):
+        # 학습 스레드를 잠시 멈추기 (리플레이 메모리 넣기, 체크포인트 저장 등)
+        # 학습 스레드가 없으면 아무 것도 안 함
+        if self.learner is None:
+            yield
+            return
+        with self.learner.paused():
+            yield
 
     def get_action(self, state):
-        state = u.t_from_np_to_float32(state)
+        if self.use_compiled_policy:
+            return self._get_compiled_action(state)
+
+        state = u.t_from_np_to_float32(state, self.device)
         noise = self.noise.sample()
-        action = self.actor(state).detach().cpu().numpy()
+        if self.acting_actor is None:
+            action = self.actor(state).detach().cpu().numpy()
+        else:
+            with self.acting_lock, torch.no_grad():
+                action = self.acting_actor(state).cpu().numpy()
         action += noise
         # TODO: 이렇게 하는게 맞나?
         return np.clip(action, a_min=self.action_low, a_max=self.action_high)
         # return action
 
+    def _get_compiled_action(self, state):
+        if self.compiled_policy is None:
+            self.compiled_policy = self.export_policy()
+
+        # 상태와 노이즈를 이어 붙여서 디바이스로 한 번에 보내고, 정책망 + 노이즈 + 자르기는 그래프 하나로
+        state_with_noise = u.t_from_np_to_float32(np.concatenate([np.reshape(state, -1), self.noise.sample()]), self.device)
+        if self.acting_actor is None:
+            with torch.no_grad():
+                return self.compiled_policy(state_with_noise).cpu().numpy()
+        with self.acting_lock, torch.no_grad():
+            return self.compiled_policy(state_with_noise).cpu().numpy()
+
+    def export_policy(self, path=None):
+        # 행동 선택용 정책망 + 노이즈 + 자르기를 trace 해서 반환 (path 가 있으면 파일로도 저장)
+        actor = self.actor if self.acting_actor is None else self.acting_actor
+        example_input = torch.zeros(self.state_size + self.action_size, device=self.device)
+        traced = trace_policy(DeterministicPolicyExport(actor, self.state_size, self.action_low, self.action_high),
+                              example_input)
+        if path is not None:
+            save_policy(traced, path)
+        return traced
+
+    def evaluation_policy(self):
+        # 노이즈 없는 평가용 정책망 스냅샷 (결정적 출력 그대로)
+        # 학습 스레드를 쓰면 행동 선택용 복사본을 (갱신 중이 아닐 때) 복사
+        module_args = (self.state_size, self.action_size, (self.action_low, self.action_high))
+        if self.acting_actor is None:
+            return snapshot_policy(self.actor, Actor, module_args, 'deterministic')
+        with self.acting_lock:
+            return snapshot_policy(self.acting_actor, Actor, module_args, 'deterministic')
+
     def get_critic_loss(self, s_batch, a_batch, r_batch, next_s_batch):
         # <평가망(critic) 최적화>
         # (무엇을, 어디서, 어떻게, 왜)
@@ -231,21 +340,35 @@ class DDPG(u.TorchSerializable):
 
         return actor_loss
 
-    def train_model(self, sars, done):
+    def _start_learner(self):
+        # 행동 선택용 정책망 = 학습 중인 정책망의 복사본 (actor_sync_interval 학습 스텝마다 갱신)
+        self.acting_actor = copy.deepcopy(self.actor)
+        self.acting_actor.eval()
+        self.acting_actor_updater = TargetNetworkUpdater(self.actor, self.acting_actor)
+        # 이제부터 행동 선택은 acting_actor 로 하므로 다시 trace
+        self.compiled_policy = None
+        self.learner = LearnerThread(self._learner_update,
+                                     max_pending_updates=self.max_pending_updates,
+                                     name='ddpg-learner')
+
+    def stop_learner(self):
+        if self.learner is not None:
+            self.learner.stop()
+
+    def _learner_update(self):
+        # 학습 스레드에서 호출됨 (learner.lock 을 잡은 상태)
+        # TrainerMetadata().log() 는 메인 스레드에서만 부르도록 마지막 오차만 남겨 둔다
+        self.last_losses = self._update()
+
+        if self.learner.update_count % self.actor_sync_interval == 0:
+            with self.acting_lock:
+                self.acting_actor_updater.hard_update()
+
+    def _update(self):
         # 메모리에서 일정 크기만큼 기억을 불러온다
-        # 그 후 기억을 모아 각 변수별로 모은다. (즉, 전치행렬)
-        # TODO: random과 zip func 글카에서 하기
-        transitions = self.memory.sample(self.batch_size)
+        # 필드별로 이미 [batch_size, 필드 크기] 텐서로 나온다 (디바이스 위에서 인덱싱만)
         # SARS = State, Action, Reward, next State
-        sars_batch = self.transition_structure(*zip(*transitions))
-
-        # TODO: 이거 튜플로 묶으면 다시 GPU에서 CPU로 오나?
-        # 텐서의 집합에서 고차원 텐서로
-        # tuple(tensor, ...) -> tensor()
-        s_batch = torch.stack(sars_batch.state).to(self.device)
-        a_batch = torch.stack(sars_batch.action).to(self.device)
-        r_batch = torch.stack(sars_batch.reward).to(self.device)
-        next_s_batch = torch.stack(sars_batch.next_state).to(self.device)
+        s_batch, a_batch, r_batch, next_s_batch, _ = self.memory.sample(self.batch_size)
 
         self.critic_optimizer.zero_grad()
         critic_loss = self.get_critic_loss(s_batch, a_batch, r_batch, next_s_batch)
@@ -263,11 +386,25 @@ class DDPG(u.TorchSerializable):
         self.actor_optimizer.step()
 
         # 현재 평가망, 정책망의 가중치를 타겟 평가망에다 덮어쓰기
-        u.soft_update_from_to(src_nn=self.critic, dst_nn=self.target_critic, tau=self.soft_target_update_tau)
-        u.soft_update_from_to(src_nn=self.actor, dst_nn=self.target_actor, tau=self.soft_target_update_tau)
-
-        if done:
-            TrainerMetadata().log(critic_loss, 'critic_loss', show_only_last=False)
-            TrainerMetadata().log(actor_loss, 'actor_loss', show_only_last=False)
+        self.target_critic_updater.soft_update(self.soft_target_update_tau)
+        self.target_actor_updater.soft_update(self.soft_target_update_tau)
 
+        return critic_loss.detach(), actor_loss.detach()
 
+    def train_model(self, sars, done):
+        # 결정적 실행 모드에서는 학습 스레드를 안 쓴다 (환경 스텝과 학습 스텝이 겹치는 순서가 타이밍에 달림)
+        if self.use_learner_thread and not self.context.seeds.is_deterministic():
+            # 학습 스텝은 학습 스레드에 맡기고 바로 돌아간다
+            if self.learner is None:
+                self._start_learner()
+            self.learner.request_updates(self.updates_per_step)
+            losses = self.last_losses
+        else:
+            losses = None
+            for _ in range(self.updates_per_step):
+                losses = self._update()
+
+        if done and losses is not None:
+            critic_loss, actor_loss = losses
+            self.context.metadata.log(critic_loss, 'critic_loss', show_only_last=False)
+            self.context.metadata.log(actor_loss, 'actor_loss', show_only_last=False)
@@ -9,7 +9,6 @@ import copy
 import math
 from collections import namedtuple
 
-import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -19,15 +18,22 @@ import torch.optim as optim
 
 import utils_kdm as u
 from utils_ext.gae import GAE
-from utils_ext.kl_divergence import kl_divergence
-from utils_ext.conjugate_gradient import conjugate_gradient
+from utils_ext.kl_divergence import kl_divergence_from_stats
+from utils_ext.conjugate_gradient import conjugate_gradient, FisherDiagonalEstimator
+from utils_kdm.diagnostics import Diagnostics
+from utils_kdm.evaluator import snapshot_policy
+from utils_kdm.minibatch import MinibatchSampler
+from utils_kdm.policy_export import GaussianPolicyExport, trace_policy, save_policy
+from utils_kdm.trainer_context import resolve_context
 from utils_kdm.trainer_metadata import TrainerMetadata
+from utils_kdm.rollout_buffer import RolloutBuffer
 
 
 # Python Pickle은 nested namedtuple save를 지원하지 않음
 # https://stackoverflow.com/questions/4677012/python-cant-pickle-type-x-attribute-lookup-failed
 
-Transition = namedtuple('Transition', ('state', 'action', 'reward', 'done'))
+# log_prob, meow, logstd, value = 행동할 때 (get_action) 정책의 log 확률, 평균, log 표준편차와 가치 추정
+Transition = namedtuple('Transition', ('state', 'action', 'reward', 'done', 'log_prob', 'meow', 'logstd', 'value'))
 
 
 # -> 그냥 '적절한' 것을 쓰라고 함
@@ -51,9 +57,9 @@ Transition = namedtuple('Transition', ('state', 'action', 'reward', 'done'))
 # lam=0.97, -> GAE
 class Actor(nn.Module):
 
-    def __init__(self, state_size, action_size):
+    def __init__(self, state_size, action_size, device=None):
         super().__init__()
-        self.device = TrainerMetadata().device
+        self.device = device if device else TrainerMetadata().device
         # 64, 64는 논문 저자 공식 레포지토리
         self.layer_sizes = [state_size, 64, 64, action_size]
 
@@ -89,9 +95,9 @@ class Actor(nn.Module):
 
 class Critic(nn.Module):
 
-    def __init__(self, state_size):
+    def __init__(self, state_size, device=None):
         super().__init__()
-        self.device = TrainerMetadata().device
+        self.device = device if device else TrainerMetadata().device
         # 액션 크기는 안 받는 이유는? Q(s, a) 아닌가?
         # Q 함수 추정이 아니라 V (Value) 추정이다
         # 나중에 GAE 에서 이득(A) 계산할 때 V가 필요
@@ -117,18 +123,19 @@ class Critic(nn.Module):
 
 class TRPO(u.TorchSerializable):
 
-    def __init__(self, state_size, action_size):
+    def __init__(self, state_size, action_size, steps_per_epoch=4000, num_envs=1, context=None):
         super().__init__()
 
         self._set_hyper_parameters()
-        self.device = TrainerMetadata().device
+        self.context = resolve_context(context)
+        self.device = self.context.device
 
         # 기본 설정
         self.state_size, self.action_size = state_size, action_size
 
         # 모델 빌드
-        self.actor = Actor(self.state_size, self.action_size).to(self.device)
-        self.critic = Critic(self.state_size).to(self.device)
+        self.actor = Actor(self.state_size, self.action_size, device=self.device).to(self.device)
+        self.critic = Critic(self.state_size, device=self.device).to(self.device)
 
         # Optimizer
         # critic 에만 L2 weight decay 넣음
@@ -138,10 +145,34 @@ class TRPO(u.TorchSerializable):
             weight_decay=self.l2_weight_decay
         )
 
+        # 한 epoch 분량 [steps_per_epoch, num_envs, 필드 크기] 버퍼를 미리 할당해 두고 제자리에 쓴다
+        # 학습할 때는 필드별 연속 뷰를 받아서 쓴다 (torch.stack 없음)
+        self.steps_per_epoch, self.num_envs = steps_per_epoch, num_envs
         self.transition_structure = Transition
-        self.memory = list()
+        self.memory = RolloutBuffer(
+            steps=self.steps_per_epoch,
+            num_envs=self.num_envs,
+            field_sizes=[self.state_size, self.action_size, 1, 1, 1, self.action_size, self.action_size, 1],
+            structure=self.transition_structure,
+            device=self.device
+        )
+        # 마지막 get_action() 의 (log 확률, 평균, log 표준편차, 가치 추정)
+        self.acting_stats = None
+        # use_compiled_policy 일 때 첫 get_action() 에서 만듦
+        self.compiled_policy = None
+
+        self.gae = GAE(gamma=self.gamma, device=self.device)
+
+        # 켤레 기울기법 Jacobi 전처리용
+        self.fisher_diagonal = FisherDiagonalEstimator(
+            num_samples=self.cg_precond_samples,
+            decay=self.cg_precond_decay
+        )
+        # 피셔-벡터곱에서 쓰는 (s_batch, ∇D_KL) - 한 업데이트 안에서는 한 번만 계산
+        self._kl_grad_cache = None
 
-        self.gae = GAE(gamma=self.gamma)
+        # 라인 서치, 평가망 학습 중 지표는 모아 뒀다가 업데이트 끝날 때 한 번에 기록
+        self.diagnostics = Diagnostics(level=self.diagnostics_level, device=self.device, metadata=self.context.metadata)
 
         self.register_serializable([
             'self.actor',
@@ -164,6 +195,14 @@ class TRPO(u.TorchSerializable):
         self.gamma = 0.99
         # 켤레 기울기법(Conjugate Gradient) 몇 번 돌 것인가
         self.cg_iters = 10
+        # 잔차가 이것보다 작아지면 일찍 끝냄 / 잔차 검사(GPU 동기화)는 몇 반복마다 할 것인가
+        self.cg_residual_tol = 1e-10
+        self.cg_check_interval = 5
+        # Jacobi 전처리 (피셔 행렬 대각 성분을 Hutchinson 방법으로 추정, 업데이트마다 EMA)
+        # 추정에 피셔-벡터곱이 cg_precond_samples 번 더 든다
+        self.cg_use_preconditioner = False
+        self.cg_precond_samples = 1
+        self.cg_precond_decay = 0.9
         # line search 최대 몇 번 할 것인가 / 얼마씩 줄여 갈 것인가
         self.backtrack_iters = 20
         self.backtrack_coeff = 0.8
@@ -177,6 +216,12 @@ class TRPO(u.TorchSerializable):
         # value 함수 학습을 같은 데이터에 대해 몇 번 할 것인가
         self.train_v_iters = 10
 
+        # 학습 지표 기록 수준 (0 = 끔, 1 = 업데이트 단위, 2 = 상세)
+        self.diagnostics_level = Diagnostics.VERBOSE
+
+        # 행동 선택을 trace 한 정책망 (정책망 + 후처리를 그래프 하나로) 으로 할 것인가
+        self.use_compiled_policy = False
+
     def reset(self):
         self._memory_clear()
 
@@ -185,22 +230,63 @@ class TRPO(u.TorchSerializable):
 
     def append_sample(self, sars, done):
         state, action, reward, next_state = sars
-        state, action, reward = u.t_float32(state), u.t_float32(action), u.t_float32(reward)
-        # FIXME: 이거 t_uint8로도 할 수 있을텐데 GAE 파트에서 실수 값에 Byte 곱한다고 에러 뿜뿜
-        done = u.t_float32(done)
-        transition = self.transition_structure(state, action, reward, done)
-        self.memory.append(transition)
+        # get_action() 에서 남겨 둔 행동 당시의 log 확률, 평균, log 표준편차, 가치 추정
+        log_prob, meow, logstd, value = self.acting_stats
+        # done 도 실수로 저장 (GAE 에서 실수 값에 곱함)
+        self.memory.push(state, action, reward, float(done), log_prob, meow, logstd, value)
 
     def get_action(self, state):
         # 왜 액터에서 바로 안 구하고 뮤랑 표준편차 꺼내서 다시 계산? 모듈화 때문인가?
         # -> 이 알고리즘에서의 actor는 표준분포에 의한 행동을 뽑아내는게 아니라 표준분포 그 자체를 생성한다
         # -> 생성한 표준 분포를 따라서 행동을 하나 샘플
-        state = u.t_from_np_to_float32(state)
-        meow, logstd, std = self.actor(state)
-        meow, std = meow.detach(), std.detach()
-        action = torch.normal(meow, std).cpu().numpy()
+        state = u.t_from_np_to_float32(state, self.device)
+        with torch.no_grad():
+            if self.use_compiled_policy:
+                if self.compiled_policy is None:
+                    self.compiled_policy = self.export_policy()
+                # 샘플링, log 확률, 가치 추정까지 그래프 하나로 (출력 배치는 아래 packed 와 같음)
+                packed = self.compiled_policy(state)
+            else:
+                packed = self._get_packed_action(state)
+            # 호스트로는 한 번에 복사
+            packed = packed.cpu().numpy()
+
+        a = self.action_size
+        action = packed[:a]
+        self.acting_stats = (packed[a:a + 1], packed[a + 1:2 * a + 1], packed[2 * a + 1:3 * a + 1], packed[3 * a + 1:])
         return action
 
+    def _get_packed_action(self, state):
+        meow, logstd, std = self.actor(state)
+        action = torch.normal(meow, std)
+
+        # 학습할 때 전체 배치로 다시 forward 하지 않도록, 행동할 때의 정책 통계와 가치 추정을 남겨 둔다
+        # (append_sample() 에서 전이와 같이 저장)
+        log_prob = self._log_density(action.view(1, -1), meow.view(1, -1), std.view(1, -1), logstd.view(1, -1))
+        value = self.critic(state)
+
+        return torch.cat([action, log_prob.view(-1), meow, logstd, value.view(-1)])
+
+    def export_policy(self, path=None, normalizer=None):
+        # 정책망 + 샘플링 + log 확률 + 가치 추정을 trace 해서 반환 (path 가 있으면 파일로도 저장)
+        # normalizer (SharedNormalizer) 를 주면 상태 정규화를 첫 Linear 층에 접어 넣은 복사본으로
+        # -> 원본 관측을 그대로 넣으면 됨 (학습 중인 정책망과 파라미터를 공유하지 않는 스냅샷)
+        actor, critic = self.actor, self.critic
+        if normalizer is not None:
+            actor, critic = copy.deepcopy(actor), copy.deepcopy(critic)
+            actor.linear1 = normalizer.fold_into(actor.linear1)
+            critic.linear1 = normalizer.fold_into(critic.linear1)
+
+        traced = trace_policy(GaussianPolicyExport(actor, critic),
+                              torch.zeros(self.state_size, device=self.device))
+        if path is not None:
+            save_policy(traced, path)
+        return traced
+
+    def evaluation_policy(self):
+        # 노이즈 없는 평가용 정책망 스냅샷 (정규분포 평균)
+        return snapshot_policy(self.actor, Actor, (self.state_size, self.action_size), 'gaussian_mean')
+
     def get_critic_loss(self, s_batch, return_batch, advantage_batch):
         critic_loss = nn.MSELoss().to(self.device)
         v_batch = self.critic(s_batch)
@@ -240,22 +326,30 @@ class TRPO(u.TorchSerializable):
         Hx = ∇((∇D_KL(새로운θ|옛날θ))^T * x)
         """
         (p, s_batch) = vector_p_with_state_batch
-        p.detach()
-        # 왜 같은게 들어가냐면 현재 policy에 대한 다이버전스를 구하는 거라서
-        kl = kl_divergence(new_actor=self.actor, old_actor=self.actor, s_batch=s_batch)
-        kl = kl.mean()
-        kl_grad = autograd.grad(kl, self.actor.parameters(), create_graph=True)
-        kl_grad = parameters_to_vector(kl_grad)  # check kl_grad == 0
+        p = p.detach()
+        # ∇D_KL 은 p 와 상관 없으므로 같은 s_batch 면 켤레 기울기법 반복 동안 한 번만 구해 두고 재사용
+        # (그래프를 남겨 두고 반복마다 backward 1번)
+        if self._kl_grad_cache is None or self._kl_grad_cache[0] is not s_batch:
+            # 왜 같은게 들어가냐면 현재 policy에 대한 다이버전스를 구하는 거라서
+            # 옛날 쪽은 떼어 낸 같은 통계 (actor forward 1번)
+            meow, logstd, _ = self.actor(s_batch)
+            kl = kl_divergence_from_stats(meow.detach(), logstd.detach(), meow, logstd)
+            kl = kl.mean()
+            kl_grad = autograd.grad(kl, self.actor.parameters(), create_graph=True)
+            kl_grad = parameters_to_vector(kl_grad)  # check kl_grad == 0
+            self._kl_grad_cache = (s_batch, kl_grad)
+        kl_grad = self._kl_grad_cache[1]
 
         kl_grad_p = (kl_grad * p).sum()
-        kl_hessian_p = autograd.grad(kl_grad_p, self.actor.parameters())
+        kl_hessian_p = autograd.grad(kl_grad_p, self.actor.parameters(), retain_graph=True)
         kl_hessian_p = parameters_to_vector(kl_hessian_p)
 
         return kl_hessian_p + self.damping_coeff * p
 
-    def _line_search(self, old_loss, loss_grad, step_vector_x, advantage_batch, s_batch, old_policy, a_batch):
-        old_actor = copy.deepcopy(self.actor)
-
+    def _line_search(self, old_loss, loss_grad, step_vector_x, advantage_batch, s_batch, old_policy, a_batch,
+                     meow_old, logstd_old):
+        # 옛날 정책은 저장해 둔 통계 (meow_old, logstd_old) 로, 실패하면 평탄화한 파라미터로 되돌린다
+        # (정책망 deepcopy, 옛날 정책망 forward 없음)
         actor_flat_params = parameters_to_vector(self.actor.parameters())
         expected_improve = (loss_grad * step_vector_x).sum(0, keepdim=True)
         expected_improve = expected_improve.cpu().numpy()
@@ -268,23 +362,26 @@ class TRPO(u.TorchSerializable):
             vector_to_parameters(constraint_params, self.actor.parameters())
 
             # 바꾼 actor를 기반으로 다시 평균(log정책(a|s)*A) 구해봄
-            meow, logstd, std = self.actor(s_batch)
-            new_policy = self._log_density(a_batch, meow, std, logstd)
-            constraint_loss = self._surrogate_loss(
-                old_policy=old_policy,
-                new_policy=new_policy,
-                advantage_batch=advantage_batch
-            )
-            loss_improve = (constraint_loss - old_loss).detach().cpu().numpy()
-            weighted_expected_improve = backtrack_ratio * expected_improve
-            kl = kl_divergence(new_actor=self.actor, old_actor=old_actor, s_batch=s_batch)
-            kl = kl.mean()
-
-            TrainerMetadata().log(kl, 'KL', 'current_kl', compute_maxmin=True)
-            TrainerMetadata().log(self.max_kl, 'KL', 'max_kl')
-            TrainerMetadata().log(loss_improve / weighted_expected_improve, 'real / expected (improve)', 'real_ratio', compute_maxmin=True)
-            TrainerMetadata().log(0.5, 'real / expected (improve)', 'threshold ')
-            # TrainerMetadata().log(expected_improve, 'expected_improve', compute_maxmin=True)
+            with torch.no_grad():
+                meow, logstd, std = self.actor(s_batch)
+                new_policy = self._log_density(a_batch, meow, std, logstd)
+                constraint_loss = self._surrogate_loss(
+                    old_policy=old_policy,
+                    new_policy=new_policy,
+                    advantage_batch=advantage_batch
+                )
+                loss_improve = (constraint_loss - old_loss).detach().cpu().numpy()
+                weighted_expected_improve = backtrack_ratio * expected_improve
+                # 방금 구한 새 정책 출력을 그대로 써서 KL 계산
+                kl = kl_divergence_from_stats(meow_old, logstd_old, meow, logstd)
+                kl = kl.mean()
+
+            self.diagnostics.record(kl, 'KL', 'current_kl', compute_maxmin=True)
+            self.diagnostics.record(self.max_kl, 'KL', 'max_kl')
+            self.diagnostics.record(loss_improve / weighted_expected_improve, 'real / expected (improve)', 'real_ratio',
+                                    compute_maxmin=True, level=Diagnostics.VERBOSE)
+            self.diagnostics.record(0.5, 'real / expected (improve)', 'threshold ', level=Diagnostics.VERBOSE)
+            # self.diagnostics.record(expected_improve, 'expected_improve', compute_maxmin=True)
 
             # see https://en.wikipedia.org/wiki/Backtracking_line_search
             # TODO: 0.5 인 이유? 1.0 보다 커야 개선된 것 아닌가
@@ -293,28 +390,33 @@ class TRPO(u.TorchSerializable):
                 line_search_succeed = True
                 break
 
-        TrainerMetadata().console_log('KL_iter', i)
+        self.context.metadata.console_log('KL_iter', i)
 
         if not line_search_succeed:
-            self.actor = copy.deepcopy(old_actor)
+            vector_to_parameters(actor_flat_params, self.actor.parameters())
             print('policy update does not impove the surrogate')
 
     def train_model(self):
         # 알고리즘 줄 번호는 OpenAI 기준
         # 줄 1~3 = 초기화
         # 줄 4 = 현재 정책 π로 trajectory 모으기
-        transitions = self.memory
-        # random.shuffle(transitions)
-        sar_batch = self.transition_structure(*zip(*transitions))
-        s_batch = torch.stack(sar_batch.state).to(self.device)
-        a_batch = torch.stack(sar_batch.action).to(self.device)
-        r_batch = torch.stack(sar_batch.reward).to(self.device)
-        done_batch = torch.stack(sar_batch.done).to(self.device)
+        # 필드별 [T, N, 크기] 연속 뷰 (디바이스로 복사 1번)
+        rollout = self.memory.get()
 
         # 줄 5 = rewards-to-go (R) 구하기
         # 줄 6 = 현재 가치 함수 (V)를 기반으로 추정 advantage (A) 구하기
-        v_batch = self.critic(s_batch)
-        return_batch, advantage_batch = self.gae.get_return_advantage(r_batch, done_batch, v_batch)
+        # 행동할 때 저장해 둔 가치 추정 사용 (평가망 전체 배치 forward 없음)
+        # GAE 는 시간 축 T 를 따라 돌고, 환경 N개는 한꺼번에 계산
+        return_batch, advantage_batch = self.gae.get_return_advantage(rollout.reward, rollout.done, rollout.value)
+
+        # 여기부터는 [T*N, 크기] 로 (연속 뷰라서 복사 없음)
+        s_batch = rollout.state.reshape(-1, self.state_size)
+        a_batch = rollout.action.reshape(-1, self.action_size)
+        return_batch, advantage_batch = return_batch.reshape(-1, 1), advantage_batch.reshape(-1, 1)
+        # 행동할 때 저장해 둔 옛날 정책 통계
+        old_policy = rollout.log_prob.reshape(-1, 1)
+        meow_old = rollout.meow.reshape(-1, self.action_size)
+        logstd_old = rollout.logstd.reshape(-1, self.action_size)
 
         # 줄 7 = 정책 그라디언트 구하기
         # 그라디언트 = '각 정책에 대한' 평균(∇log정책(a|s)*A)
@@ -322,8 +424,9 @@ class TRPO(u.TorchSerializable):
         # log정책(a|s)
         # 평균(log정책(a|s)*A)
         # g = '각 정책에 대한' 평균(∇log정책(a|s)*A)
+        # 그라디언트를 구해야 하므로 현재 정책 forward 는 필요 (옛날 정책 쪽은 저장해 둔 log 확률)
         meow, logstd, std = self.actor(s_batch)
-        old_policy = self._log_density(a_batch, meow, std, logstd)
+        new_policy = self._log_density(a_batch, meow, std, logstd)
 
         # 아래 3줄이 처음에 이해가 안 갔다
         #
@@ -342,7 +445,7 @@ class TRPO(u.TorchSerializable):
         #    따라서 원래의 방향을 미리 알아둬야 하고, 이를 위해 미리 구해두는 것
         loss = self._surrogate_loss(
             old_policy=old_policy,
-            new_policy=old_policy,
+            new_policy=new_policy,
             advantage_batch=advantage_batch
         )
         loss_grad = autograd.grad(loss, self.actor.parameters())
@@ -351,7 +454,17 @@ class TRPO(u.TorchSerializable):
         # 줄 8 = 켤레 기울기법 적용해서 x 추정하기
         # x = H의 역행렬 * 그라디언트
         # 결론으로 구한 x는 우리가 어디로 가야 할 지 알려주는 방향 = step_direction_x
-        step_direction_x = conjugate_gradient(self._fisher_vector_product, s_batch, loss_grad.data, cg_iters=self.cg_iters)
+        inverse_diagonal = None
+        if self.cg_use_preconditioner:
+            self.fisher_diagonal.update(self._fisher_vector_product, s_batch, like=loss_grad.data)
+            inverse_diagonal = self.fisher_diagonal.inverse()
+        step_direction_x = conjugate_gradient(
+            self._fisher_vector_product, s_batch, loss_grad.data,
+            cg_iters=self.cg_iters,
+            residual_tol=self.cg_residual_tol,
+            inverse_diagonal=inverse_diagonal,
+            check_interval=self.cg_check_interval
+        )
 
         # 줄 9 = 백트래킹 방법으로 정책 업데이트하기
         # 새로운 파라미터 = 파라미터 + sqrt(2*최대 kl 크기 제한 / H의 이차형식) * x
@@ -359,26 +472,25 @@ class TRPO(u.TorchSerializable):
         # 크기: sqrt(2*최대 kl 크기 제한 / (x^-1)(Hx))
         # 방향벡터: sqrt(2*최대 kl 크기 제한 / (x^-1)(Hx)) * x
         xhx = (step_direction_x * self._fisher_vector_product((step_direction_x, s_batch))).sum(0, keepdim=True)
+        # 남겨 둔 ∇D_KL 그래프 해제
+        self._kl_grad_cache = None
         step_size_x = torch.sqrt((2 * self.max_kl) / xhx).to(self.device)
         step_vector_x = step_size_x * step_direction_x
-        self._line_search(loss, loss_grad, step_vector_x, advantage_batch, s_batch, old_policy, a_batch)
+        self._line_search(loss, loss_grad, step_vector_x, advantage_batch, s_batch, old_policy, a_batch,
+                          meow_old, logstd_old)
 
         # 줄 10 = 가치 함수 MSE로 경사 하강법 최적화
-        n = len(s_batch)
-        arr = np.arange(n)
+        # epoch 마다 디바이스 위에서 섞고, 미니배치는 미리 할당한 버퍼에 채운다
+        sampler = MinibatchSampler([s_batch, return_batch, advantage_batch], batch_size=self.batch_size)
         for epoch in range(self.train_v_iters):
-            np.random.shuffle(arr)
             critic_loss = 0
 
-            for i in range(n // self.batch_size):
-                batch_index = arr[self.batch_size * i: self.batch_size * (i + 1)]
-                batch_index = u.t_long(batch_index)
-                inputs = s_batch[batch_index]
-                target1 = return_batch[batch_index]
-                target2 = advantage_batch[batch_index]
+            for _, (inputs, target1, target2) in sampler:
                 self.critic_optimizer.zero_grad()
                 critic_loss = self.get_critic_loss(inputs, target1, target2)
                 critic_loss.backward()
                 self.critic_optimizer.step()
 
-            TrainerMetadata().log(critic_loss, 'critic_loss', show_only_last=True, compute_maxmin=True)
+            self.diagnostics.record(critic_loss, 'critic_loss', compute_maxmin=True)
+
+        self.diagnostics.flush()
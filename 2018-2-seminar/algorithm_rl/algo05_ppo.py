@@ -7,7 +7,6 @@ import copy
 import math
 from collections import namedtuple
 
-import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -16,22 +15,29 @@ from torch import autograd
 from torch.nn.utils import parameters_to_vector
 
 import utils_kdm as u
-from utils_ext.kl_divergence import kl_divergence
+from utils_ext.kl_divergence import KLMonitor
 from utils_ext.gae import GAE
+from utils_kdm.diagnostics import Diagnostics
+from utils_kdm.evaluator import snapshot_policy
+from utils_kdm.minibatch import MinibatchSampler
+from utils_kdm.policy_export import GaussianPolicyExport, trace_policy, save_policy
+from utils_kdm.trainer_context import resolve_context
 from utils_kdm.trainer_metadata import TrainerMetadata
+from utils_kdm.rollout_buffer import RolloutBuffer
 
 
 # Python Pickle은 nested namedtuple save를 지원하지 않음
 # https://stackoverflow.com/questions/4677012/python-cant-pickle-type-x-attribute-lookup-failed
 
-Transition = namedtuple('Transition', ('state', 'action', 'reward', 'done'))
+# log_prob, meow, logstd, value = 행동할 때 (get_action) 정책의 log 확률, 평균, log 표준편차와 가치 추정
+Transition = namedtuple('Transition', ('state', 'action', 'reward', 'done', 'log_prob', 'meow', 'logstd', 'value'))
 
 
 class Actor(nn.Module):
 
-    def __init__(self, state_size, action_size):
+    def __init__(self, state_size, action_size, device=None):
         super().__init__()
-        self.device = TrainerMetadata().device
+        self.device = device if device else TrainerMetadata().device
         # 64, 64는 논문 저자 공식 레포지토리
         self.layer_sizes = [state_size, 64, 64, action_size]
 
@@ -68,9 +74,9 @@ class Actor(nn.Module):
 
 class Critic(nn.Module):
 
-    def __init__(self, state_size):
+    def __init__(self, state_size, device=None):
         super().__init__()
-        self.device = TrainerMetadata().device
+        self.device = device if device else TrainerMetadata().device
         # 액션 크기는 안 받는 이유는? Q(s, a) 아닌가?
         # Q 함수 추정이 아니라 V (Value) 추정이다
         # 나중에 GAE 에서 이득(A) 계산할 때 V가 필요
@@ -97,18 +103,19 @@ class Critic(nn.Module):
 
 class PPO(u.TorchSerializable):
 
-    def __init__(self, state_size, action_size):
+    def __init__(self, state_size, action_size, steps_per_epoch=4000, num_envs=1, context=None):
         super().__init__()
 
         self._set_hyper_parameters()
-        self.device = TrainerMetadata().device
+        self.context = resolve_context(context)
+        self.device = self.context.device
 
         # 기본 설정
         self.state_size, self.action_size = state_size, action_size
 
         # 모델 빌드
-        self.actor = Actor(self.state_size, self.action_size).to(self.device)
-        self.critic = Critic(self.state_size).to(self.device)
+        self.actor = Actor(self.state_size, self.action_size, device=self.device).to(self.device)
+        self.critic = Critic(self.state_size, device=self.device).to(self.device)
 
         # Optimizer
         self.actor_critic_optimizer = optim.Adam(
@@ -116,10 +123,29 @@ class PPO(u.TorchSerializable):
             lr=self.learning_rate
         )
 
+        # 한 epoch 분량 [steps_per_epoch, num_envs, 필드 크기] 버퍼를 미리 할당해 두고 제자리에 쓴다
+        # 학습할 때는 필드별 연속 뷰를 받아서 쓴다 (torch.stack 없음)
+        self.steps_per_epoch, self.num_envs = steps_per_epoch, num_envs
         self.transition_structure = Transition
-        self.memory = list()
+        self.memory = RolloutBuffer(
+            steps=self.steps_per_epoch,
+            num_envs=self.num_envs,
+            field_sizes=[self.state_size, self.action_size, 1, 1, 1, self.action_size, self.action_size, 1],
+            structure=self.transition_structure,
+            device=self.device
+        )
+        # 마지막 get_action() 의 (log 확률, 평균, log 표준편차, 가치 추정)
+        self.acting_stats = None
+        # use_compiled_policy 일 때 첫 get_action() 에서 만듦
+        self.compiled_policy = None
+
+        self.gae = GAE(gamma=self.gae_gamma, device=self.device)
+
+        # 미니배치마다 나오는 지표는 모아 뒀다가 업데이트 끝날 때 한 번에 기록
+        self.diagnostics = Diagnostics(level=self.diagnostics_level, device=self.device, metadata=self.context.metadata)
 
-        self.gae = GAE(gamma=self.gae_gamma)
+        # early stopping 용 KL 은 옛날 정책 출력을 캐시해 두고 싸게 추정
+        self.kl_monitor = KLMonitor(mode=self.kl_estimate_mode, subsample_size=self.kl_subsample_size)
 
         self.register_serializable([
             'self.actor',
@@ -138,6 +164,15 @@ class PPO(u.TorchSerializable):
 
         # Early Stopping
         self.max_kl = 0.01
+        # KL 추정 방법 (KLMonitor 참고): 'minibatch' (추가 forward 없음), 'subsample', 'full'
+        self.kl_estimate_mode = KLMonitor.MINIBATCH
+        self.kl_subsample_size = 512
+
+        # 학습 지표 기록 수준 (0 = 끔, 1 = 업데이트 단위, 2 = 미니배치 단위 상세)
+        self.diagnostics_level = Diagnostics.VERBOSE
+
+        # 행동 선택을 trace 한 정책망 (정책망 + 후처리를 그래프 하나로) 으로 할 것인가
+        self.use_compiled_policy = False
 
     def reset(self):
         self._memory_clear()
@@ -147,22 +182,63 @@ class PPO(u.TorchSerializable):
 
     def append_sample(self, sars, done):
         state, action, reward, next_state = sars
-        state, action, reward = u.t_float32(state), u.t_float32(action), u.t_float32(reward)
-        # FIXME: 이거 t_uint8로도 할 수 있을텐데 GAE 파트에서 실수 값에 Byte 곱한다고 에러 뿜뿜
-        done = u.t_float32(done)
-        transition = self.transition_structure(state, action, reward, done)
-        self.memory.append(transition)
+        # get_action() 에서 남겨 둔 행동 당시의 log 확률, 평균, log 표준편차, 가치 추정
+        log_prob, meow, logstd, value = self.acting_stats
+        # done 도 실수로 저장 (GAE 에서 실수 값에 곱함)
+        self.memory.push(state, action, reward, float(done), log_prob, meow, logstd, value)
 
     def get_action(self, state):
         # 왜 액터에서 바로 안 구하고 뮤랑 표준편차 꺼내서 다시 계산? 모듈화 때문인가?
         # -> 이 알고리즘에서의 actor는 표준분포에 의한 행동을 뽑아내는게 아니라 표준분포 그 자체를 생성한다
         # -> 생성한 표준 분포를 따라서 행동을 하나 샘플
-        state = u.t_from_np_to_float32(state)
-        meow, logstd, std = self.actor(state)
-        meow, std = meow.detach(), std.detach()
-        action = torch.normal(meow, std).cpu().numpy()
+        state = u.t_from_np_to_float32(state, self.device)
+        with torch.no_grad():
+            if self.use_compiled_policy:
+                if self.compiled_policy is None:
+                    self.compiled_policy = self.export_policy()
+                # 샘플링, log 확률, 가치 추정까지 그래프 하나로 (출력 배치는 아래 packed 와 같음)
+                packed = self.compiled_policy(state)
+            else:
+                packed = self._get_packed_action(state)
+            # 호스트로는 한 번에 복사
+            packed = packed.cpu().numpy()
+
+        a = self.action_size
+        action = packed[:a]
+        self.acting_stats = (packed[a:a + 1], packed[a + 1:2 * a + 1], packed[2 * a + 1:3 * a + 1], packed[3 * a + 1:])
         return action
 
+    def _get_packed_action(self, state):
+        meow, logstd, std = self.actor(state)
+        action = torch.normal(meow, std)
+
+        # 학습할 때 전체 배치로 다시 forward 하지 않도록, 행동할 때의 정책 통계와 가치 추정을 남겨 둔다
+        # (append_sample() 에서 전이와 같이 저장)
+        log_prob = self._log_density(action.view(1, -1), meow.view(1, -1), std.view(1, -1), logstd.view(1, -1))
+        value = self.critic(state)
+
+        return torch.cat([action, log_prob.view(-1), meow, logstd, value.view(-1)])
+
+    def export_policy(self, path=None, normalizer=None):
+        # 정책망 + 샘플링 + log 확률 + 가치 추정을 trace 해서 반환 (path 가 있으면 파일로도 저장)
+        # normalizer (SharedNormalizer) 를 주면 상태 정규화를 첫 Linear 층에 접어 넣은 복사본으로
+        # -> 원본 관측을 그대로 넣으면 됨 (학습 중인 정책망과 파라미터를 공유하지 않는 스냅샷)
+        actor, critic = self.actor, self.critic
+        if normalizer is not None:
+            actor, critic = copy.deepcopy(actor), copy.deepcopy(critic)
+            actor.linear1 = normalizer.fold_into(actor.linear1)
+            critic.linear1 = normalizer.fold_into(critic.linear1)
+
+        traced = trace_policy(GaussianPolicyExport(actor, critic),
+                              torch.zeros(self.state_size, device=self.device))
+        if path is not None:
+            save_policy(traced, path)
+        return traced
+
+    def evaluation_policy(self):
+        # 노이즈 없는 평가용 정책망 스냅샷 (정규분포 평균)
+        return snapshot_policy(self.actor, Actor, (self.state_size, self.action_size), 'gaussian_mean')
+
     def _improve_ratio(self, old_policy, new_policy):
         # 현재 정책과 과거 정책의 비율, 즉 r(θ_old) = 1
         return torch.exp(new_policy - old_policy)
@@ -172,10 +248,11 @@ class PPO(u.TorchSerializable):
         improve_ratio = self._improve_ratio(old_policy, new_policy)
         clipped_ratio = torch.clamp(improve_ratio, 1 - self.epsilon, 1 + self.epsilon)
 
-        TrainerMetadata().log(torch.max(improve_ratio),
-                              'improve_ratio', 'max', show_only_last=True, compute_maxmin=True)
-        TrainerMetadata().log(torch.min(improve_ratio),
-                              'improve_ratio', 'min', show_only_last=True, compute_maxmin=True)
+        if self.diagnostics.is_enabled(Diagnostics.VERBOSE):
+            self.diagnostics.record(torch.max(improve_ratio), 'improve_ratio', 'max',
+                                    compute_maxmin=True, level=Diagnostics.VERBOSE)
+            self.diagnostics.record(torch.min(improve_ratio), 'improve_ratio', 'min',
+                                    compute_maxmin=True, level=Diagnostics.VERBOSE)
         # TODO: advantage 나중에 곱해보기?
         loss_cpi = improve_ratio * advantage_batch
         loss_clip = clipped_ratio * advantage_batch
@@ -212,48 +289,47 @@ class PPO(u.TorchSerializable):
         return log_density.sum(1, keepdim=True).to(self.device)
 
     def train_model(self):
-        transitions = self.memory
-        sar_batch = self.transition_structure(*zip(*transitions))
-        s_batch = torch.stack(sar_batch.state).to(self.device)
-        a_batch = torch.stack(sar_batch.action).to(self.device)
-        r_batch = torch.stack(sar_batch.reward).to(self.device)
-        done_batch = torch.stack(sar_batch.done).to(self.device)
+        # 필드별 [T, N, 크기] 연속 뷰 (디바이스로 복사 1번)
+        rollout = self.memory.get()
 
         # 현재 가치 함수 (V)를 기반으로 추정 advantage (A) 구하기 (GAE)
-        v_batch = self.critic(s_batch)
-        return_batch, advantage_batch = self.gae.get_return_advantage(r_batch, done_batch, v_batch)
+        # 행동할 때 저장해 둔 가치 추정 사용 (평가망 전체 배치 forward 없음)
+        # GAE 는 시간 축 T 를 따라 돌고, 환경 N개는 한꺼번에 계산
+        return_batch, advantage_batch = self.gae.get_return_advantage(rollout.reward, rollout.done, rollout.value)
+
+        # 여기부터는 [T*N, 크기] 로 (연속 뷰라서 복사 없음)
+        s_batch = rollout.state.reshape(-1, self.state_size)
+        a_batch = rollout.action.reshape(-1, self.action_size)
+        return_batch, advantage_batch = return_batch.reshape(-1, 1), advantage_batch.reshape(-1, 1)
+        # 행동할 때 저장해 둔 옛날 정책 통계 (정책망 전체 배치 forward 없음)
+        old_policy = rollout.log_prob.reshape(-1, 1)
+        meow_old = rollout.meow.reshape(-1, self.action_size)
+        logstd_old = rollout.logstd.reshape(-1, self.action_size)
 
         # 그라디언트 안 구하고 이렇게 원본 복사해서 detach 해서 구하는 아이디어가 맞는 방법?
         # ->　맞음. 그러나 애초에 상태 저장할 때 분포랑 이득까지 저장하는 방법도 있음.
-        old_actor = copy.deepcopy(self.actor)
-        meow, logstd, std = old_actor(s_batch)
-        meow = meow.detach()
-        logstd = logstd.detach()
-        std = std.detach()
+        # -> 지금은 상태 저장할 때 분포도 저장 (get_action, append_sample)
         # PPO도 log 씌운 확률분포로 구해도 됨
-        old_policy = self._log_density(a_batch, meow, std, logstd)
+        self.kl_monitor.reset(s_batch, meow_old, logstd_old)
 
-        n = len(s_batch)
-        arr = np.arange(n)
+        # epoch 마다 디바이스 위에서 섞고, 미니배치는 미리 할당한 버퍼에 채운다
+        sampler = MinibatchSampler(
+            [s_batch, a_batch, return_batch, advantage_batch, old_policy],
+            batch_size=self.batch_size
+        )
         for epoch in range(self.num_epochs):
-            np.random.shuffle(arr)
-
-            for i in range(n // self.batch_size):
-                batch_index = arr[self.batch_size * i: self.batch_size * (i + 1)]
-                batch_index = u.t_long(batch_index)
-
-                sampled_s_batch = s_batch[batch_index]
-                sampled_a_batch = a_batch[batch_index]
-                sampled_return_batch = return_batch[batch_index]
-                sampled_advantage_batch = advantage_batch[batch_index]
+            for batch_index, sampled_batches in sampler:
+                sampled_s_batch, sampled_a_batch, sampled_return_batch, sampled_advantage_batch, \
+                    sampled_old_policy = sampled_batches
 
                 # TODO: 엔트로피 넣기
                 sampled_v_batch = self.critic(sampled_s_batch)
                 meow, logstd, std = self.actor(sampled_s_batch)
                 new_policy = self._log_density(sampled_a_batch, meow, std, logstd)
+                self.kl_monitor.accumulate(batch_index, meow, logstd)
 
                 surrogate_loss = -1 * self._surrogate_loss(
-                    old_policy=old_policy[batch_index],
+                    old_policy=sampled_old_policy,
                     new_policy=new_policy,
                     advantage_batch=sampled_advantage_batch
                 )
@@ -264,15 +340,16 @@ class PPO(u.TorchSerializable):
                 loss.backward()
                 self.actor_critic_optimizer.step()
 
-                TrainerMetadata().log(surrogate_loss, 'actor_loss', show_only_last=True, compute_maxmin=True)
-                TrainerMetadata().log(critic_loss, 'critic_loss', show_only_last=True, compute_maxmin=True)
-                TrainerMetadata().log(loss, 'loss', show_only_last=True, compute_maxmin=True)
+                self.diagnostics.record(surrogate_loss, 'actor_loss', compute_maxmin=True)
+                self.diagnostics.record(critic_loss, 'critic_loss', compute_maxmin=True)
+                self.diagnostics.record(loss, 'loss', compute_maxmin=True)
 
-            kl = kl_divergence(new_actor=self.actor, old_actor=old_actor, s_batch=s_batch)
-            kl = kl.mean()
-            TrainerMetadata().log(kl, 'KL', 'current_kl', compute_maxmin=True)
-            TrainerMetadata().log(self.max_kl, 'KL', 'max_kl')
+            kl = self.kl_monitor.estimate(self.actor)
+            self.diagnostics.record(kl, 'KL', 'current_kl', compute_maxmin=True)
+            self.diagnostics.record(self.max_kl, 'KL', 'max_kl')
 
             if kl > self.max_kl:
-                TrainerMetadata().log(epoch, 'early_stopped_epoch', compute_maxmin=True)
+                self.diagnostics.record(epoch, 'early_stopped_epoch', compute_maxmin=True)
                 break
+
+        self.diagnostics.flush()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# DQN 학습 1스텝 벤치마크 (batch_size 64, 512)
+# 기존 구현 (리스트 리플레이 메모리 + torch.stack + 파이썬으로 not_done 마스크 만들고 compress) 과
+# 현재 구현 (ColumnarReplayMemory + 곱하기 마스크) 비교
+#
+# 실행: python -m benchmark.bench_dqn_train [--cpu]
+
+import argparse
+from itertools import compress
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+import utils_kdm as u
+from algorithm_rl.algo02_dqn import DQN, Transition
+from benchmark.bench_utils import measure, summarize, print_table
+from utils_kdm.replay_memory import ReplayMemory
+from utils_kdm.trainer_metadata import TrainerMetadata
+
+
+def legacy_train_step(dqn, memory, batch_size):
+    transitions = memory.sample(batch_size)
+    sars_batch = Transition(*zip(*transitions))
+
+    s_batch = torch.stack(sars_batch.state).to(dqn.device)
+    a_batch = torch.stack(sars_batch.action).to(dqn.device)
+    r_batch = torch.stack(sars_batch.reward).to(dqn.device)
+    next_s_batch = torch.stack(sars_batch.next_state).to(dqn.device)
+    done_batch = torch.stack(sars_batch.done).to(dqn.device)
+
+    state_action_values = dqn.policy(s_batch).gather(1, a_batch)
+
+    not_done = [not i for i in done_batch]
+    non_final_mask = u.t_uint8(not_done).squeeze().to(dqn.device)
+    non_final_next_states = torch.stack(list(compress(next_s_batch, not_done)))
+
+    next_state_values = torch.zeros(len(s_batch), device=dqn.device)
+    next_state_values[non_final_mask] = dqn.target_policy(non_final_next_states).max(1)[0].detach()
+    next_state_values = next_state_values.unsqueeze(dim=1)
+    expected_state_action_values = r_batch + (dqn.discount_factor * next_state_values)
+
+    dqn.policy_optimizer.zero_grad()
+    loss = nn.MSELoss().to(dqn.device)
+    loss = loss(state_action_values, expected_state_action_values)
+    loss.backward()
+    dqn.policy_optimizer.step()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cpu', action='store_true')
+    parser.add_argument('--repeat', type=int, default=500)
+    args = parser.parse_args()
+
+    TrainerMetadata().set_device(force_cpu=args.cpu)
+    device = TrainerMetadata().device
+
+    # CartPole
+    state_size, action_size = 4, 2
+
+    rows = list()
+    for batch_size in (64, 512):
+        dqn = DQN(state_size, action_size)
+        dqn.batch_size = batch_size
+
+        legacy_memory = ReplayMemory(dqn.memory.capacity, Transition)
+        for i in range(dqn.memory.capacity):
+            state, next_state = np.random.randn(state_size), np.random.randn(state_size)
+            action, reward, done = np.random.randint(action_size), 1.0, np.random.rand() < 0.05
+            legacy_memory.push(u.t_float32(state), u.t_long(action), u.t_float32(reward),
+                               u.t_float32(next_state), u.t_uint8(done))
+            dqn.append_sample((state, action, reward, next_state), done)
+        if dqn.staging is not None:
+            dqn.staging.flush()
+
+        impls = [
+            ('legacy', lambda: legacy_train_step(dqn, legacy_memory, batch_size)),
+            ('current', lambda: dqn.train_model(None, False)),
+        ]
+        for impl_name, impl in impls:
+            row = summarize(measure(impl, repeat=args.repeat, warmup=20, device=device))
+            row['batch_size'], row['impl'] = batch_size, impl_name
+            rows.append(row)
+
+    print('device: {}'.format(device))
+    print_table(rows, ['batch_size', 'impl', 'mean_us', 'p50_us', 'p90_us', 'p99_us'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+# 자주 불리는 유틸 함수 (커널) 마이크로벤치마크 + 크기별 스케일링 곡선
+#
+# 커널마다 크기 변수 하나 (rollout 길이, 상태 차원, 예시 개수 = 트리 깊이, 버퍼 용량 등) 를 여러 값으로 바꿔 가며 재고
+#   - 표: 크기별 mean / p50 / p90 / p99 (마이크로초)
+#   - 스케일링 지수: log(시간) = k * log(크기) + c 의 k (1 이면 선형, 2 면 제곱, 0 이면 크기와 무관)
+#   - --output: JSON 으로 저장 (최적화 전후 비교용)
+#   - --visdom: 커널마다 창 하나에 크기 - 시간 곡선
+#
+# 실행: python -m benchmark.bench_kernels [--cpu] [--kernels gae cg ...] [--output kernels.json] [--visdom env]
+
+import argparse
+import copy
+import json
+import random
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+import utils_kdm as u
+from algorithm_im.region import ExemplarStructure, Region, RegionManager
+from algorithm_rl.algo04_trpo import TRPO
+from benchmark.bench_utils import measure, summarize, print_table
+from utils_ext import k_means
+from utils_ext.conjugate_gradient import conjugate_gradient
+from utils_ext.gae import GAE
+from utils_ext.kl_divergence import kl_divergence
+from utils_ext.running_state import ZFilter
+from utils_kdm.replay_memory import ColumnarReplayMemory, ReplayMemory
+from utils_kdm.target_network import TargetNetworkUpdater
+from utils_kdm.trainer_metadata import TrainerMetadata
+
+
+# 커널 함수 = (크기, 디바이스, 반복 횟수) -> [(구현 이름, 시간 배열, 추가 정보 dict), ...]
+
+def bench_gae(rollout_length, device, repeat):
+    r_batch = torch.randn(rollout_length, 1, device=device)
+    # 에피소드 1000 스텝마다 끝
+    not_done_batch = torch.ones(rollout_length, 1, device=device)
+    not_done_batch[999::1000] = 0
+    v_batch = torch.randn(rollout_length, 1, device=device)
+    gae = GAE(device=device)
+
+    times = measure(lambda: gae.get_return_advantage(r_batch, not_done_batch.clone(), v_batch),
+                    repeat=repeat, warmup=1, device=device)
+    return [('get_return_advantage', times, dict())]
+
+
+def bench_cg(state_size, device, repeat):
+    # TRPO 의 피셔-벡터곱으로 켤레 기울기법 한 번 (rollout 4000 스텝, HalfCheetah 행동 크기)
+    trpo = TRPO(state_size, 6)
+    s_batch = torch.randn(4000, state_size, device=device)
+    num_params = sum(p.numel() for p in trpo.actor.parameters())
+    loss_grad = torch.randn(num_params, device=device)
+
+    def _solve():
+        trpo._kl_grad_cache = None
+        conjugate_gradient(trpo._fisher_vector_product, s_batch, loss_grad,
+                           cg_iters=trpo.cg_iters, residual_tol=trpo.cg_residual_tol,
+                           check_interval=trpo.cg_check_interval)
+        trpo._kl_grad_cache = None
+
+    times = measure(_solve, repeat=repeat, warmup=2, device=device)
+    return [('conjugate_gradient+fvp', times, {'num_params': num_params})]
+
+
+def bench_kl(batch_size, device, repeat):
+    trpo = TRPO(17, 6)
+    old_actor = copy.deepcopy(trpo.actor)
+    s_batch = torch.randn(batch_size, 17, device=device)
+
+    def _forward_backward():
+        kl = kl_divergence(trpo.actor, old_actor, s_batch).mean()
+        trpo.actor.zero_grad()
+        kl.backward()
+
+    with torch.no_grad():
+        forward = measure(lambda: kl_divergence(trpo.actor, old_actor, s_batch), repeat=repeat, device=device)
+    backward = measure(_forward_backward, repeat=repeat, device=device)
+    return [('forward', forward, dict()), ('forward+backward', backward, dict())]
+
+
+def _random_exemplar(state_size, action_size, device):
+    return ExemplarStructure(torch.randn(state_size, device=device),
+                             torch.randn(action_size, device=device),
+                             torch.randn(state_size, device=device))
+
+
+def _tree_depth(region):
+    if region.is_leaf():
+        return 0
+    return 1 + max(_tree_depth(region.left_child), _tree_depth(region.right_child))
+
+
+def bench_region_find(num_exemplars, device, repeat):
+    # 예시를 많이 넣을수록 지역 트리가 깊어진다 (지역당 region_maxlen 개 넘으면 분할)
+    region_manager = RegionManager(8, 2, device=device)
+    for _ in range(num_exemplars):
+        region_manager.add(_random_exemplar(8, 2, device))
+
+    queries = [_random_exemplar(8, 2, device) for _ in range(100)]
+    index = [0]
+
+    def _find():
+        region_manager.find_region(queries[index[0] % len(queries)])
+        index[0] += 1
+
+    times = measure(_find, repeat=repeat, device=device)
+    return [('find_region', times, {'depth': _tree_depth(region_manager.region_head)})]
+
+
+def bench_region_split(state_size, device, repeat):
+    # 분할 직전 (region_maxlen + 1 개) 지역 하나를 나누기 / 나누면 지역이 바뀌므로 반복마다 새 지역
+    region_manager = RegionManager(state_size, 2, device=device)
+    regions = list()
+    for _ in range(repeat + 1):
+        region = Region(state_size, 2, device=device)
+        region.add_all([_random_exemplar(state_size, 2, device) for _ in range(region_manager.region_maxlen + 1)])
+        regions.append(region)
+
+    times = measure(lambda: region_manager.split_region(regions.pop()), repeat=repeat, warmup=1, device=device)
+    return [('split_region', times, dict())]
+
+
+def bench_replay(capacity, device, repeat):
+    # 용량까지 채운 뒤 push 1번 / sample (배치 128) 1번
+    state_size, action_size, batch_size = 17, 6, 128
+    transition = (torch.randn(state_size, device=device), torch.randn(action_size, device=device),
+                  torch.randn(1, device=device), torch.randn(state_size, device=device),
+                  torch.zeros(1, device=device))
+
+    # 기존 리스트 메모리 (같은 텐서를 참조로 채움)
+    memory = ReplayMemory(capacity)
+    for _ in range(capacity):
+        memory.push(*transition)
+
+    columnar = ColumnarReplayMemory(capacity, [state_size, action_size, 1, state_size, 1], [torch.float32] * 5,
+                                    device=device)
+    chunk = [t.unsqueeze(0).expand(capacity, -1) for t in transition]
+    columnar.push_batch(*chunk)
+
+    return [
+        ('ReplayMemory.push', measure(lambda: memory.push(*transition), repeat=repeat, device=device), dict()),
+        ('ReplayMemory.sample', measure(lambda: memory.sample(batch_size), repeat=repeat, device=device), dict()),
+        ('Columnar.push', measure(lambda: columnar.push(*transition), repeat=repeat, device=device), dict()),
+        ('Columnar.sample', measure(lambda: columnar.sample(batch_size), repeat=repeat, device=device), dict()),
+    ]
+
+
+def bench_soft_update(hidden_size, device, repeat):
+    src = nn.Sequential(nn.Linear(hidden_size, hidden_size), nn.ReLU(),
+                        nn.Linear(hidden_size, hidden_size), nn.ReLU(),
+                        nn.Linear(hidden_size, hidden_size)).to(device)
+    dst = copy.deepcopy(src)
+    updater_dst = copy.deepcopy(src)
+    updater = TargetNetworkUpdater(src, updater_dst)
+    num_params = sum(p.numel() for p in src.parameters())
+
+    return [
+        ('soft_update_from_to', measure(lambda: u.soft_update_from_to(src, dst, 0.001), repeat=repeat, device=device),
+         {'num_params': num_params}),
+        ('TargetNetworkUpdater', measure(lambda: updater.soft_update(0.001), repeat=repeat, device=device),
+         {'num_params': num_params}),
+    ]
+
+
+def bench_zfilter(state_size, device, repeat):
+    z_filter = ZFilter((state_size,), clip=5)
+    states = np.random.randn(100, state_size)
+    index = [0]
+
+    def _call():
+        z_filter(states[index[0] % len(states)])
+        index[0] += 1
+
+    return [('__call__', measure(_call, repeat=repeat), dict())]
+
+
+def bench_k_means(num_points, device, repeat):
+    # 3차원 점 num_points 개를 3개 클러스터로 (초기 좌표는 반복마다 같게)
+    X = np.concatenate([np.random.randn(num_points // 3, 3) + 5 * i for i in range(3)]).astype(np.float32)
+    times = measure(lambda: k_means.execute(X, 3, device=device, rng=np.random.RandomState(0)),
+                    repeat=repeat, warmup=1, device=device)
+    return [('execute', times, dict())]
+
+
+# 이름 -> (크기 변수 이름, 크기 목록, 기본 반복 횟수, 커널 함수)
+KERNELS = {
+    'gae': ('rollout_length', [250, 1000, 4000, 16000], 5, bench_gae),
+    'cg': ('state_size', [8, 17, 64, 256], 20, bench_cg),
+    'kl': ('batch_size', [1000, 4000, 16000, 64000], 100, bench_kl),
+    'region_find': ('num_exemplars', [250, 1000, 4000], 1000, bench_region_find),
+    'region_split': ('state_size', [8, 17, 32], 5, bench_region_split),
+    'replay': ('capacity', [10000, 100000, 1000000], 1000, bench_replay),
+    'soft_update': ('hidden_size', [64, 256, 1024], 1000, bench_soft_update),
+    'zfilter': ('state_size', [8, 17, 64, 256, 1024], 5000, bench_zfilter),
+    'k_means': ('num_points', [1000, 10000, 100000], 5, bench_k_means),
+}
+
+
+def scaling_exponent(sizes, means):
+    # log-log 기울기 (크기가 2개 이상일 때만)
+    if len(sizes) < 2:
+        return None
+    return float(np.polyfit(np.log(sizes), np.log(means), 1)[0])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cpu', action='store_true')
+    parser.add_argument('--kernels', nargs='+', default=sorted(KERNELS.keys()), choices=sorted(KERNELS.keys()))
+    # 기본 반복 횟수에 곱할 배수
+    parser.add_argument('--repeat-scale', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--visdom', default=None)
+    args = parser.parse_args()
+
+    TrainerMetadata().set_device(force_cpu=args.cpu)
+    device = TrainerMetadata().device
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    rows = list()
+    curves = dict()
+    for name in args.kernels:
+        param_name, sizes, repeat, func = KERNELS[name]
+        repeat = max(1, int(repeat * args.repeat_scale))
+
+        for size in sizes:
+            for impl_name, times, extra in func(size, device, repeat):
+                row = summarize(times)
+                row.update(extra)
+                row['kernel'], row['impl'], row['param'], row['size'] = name, impl_name, param_name, size
+                rows.append(row)
+                curves.setdefault((name, impl_name), list()).append((size, row['mean_us']))
+
+    print('device: {}'.format(device))
+    print_table(rows, ['kernel', 'impl', 'param', 'size', 'mean_us', 'p50_us', 'p90_us', 'p99_us'])
+
+    exponents = dict()
+    print('')
+    for (name, impl_name), points in sorted(curves.items()):
+        sizes, means = zip(*points)
+        exponent = scaling_exponent(sizes, means)
+        exponents['{}/{}'.format(name, impl_name)] = exponent
+        if exponent is not None:
+            print('{}/{}: time ~ {}^{:.2f}'.format(name, impl_name, KERNELS[name][0], exponent))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'device': str(device), 'rows': rows, 'scaling_exponents': exponents}, f, indent=2)
+
+    if args.visdom is not None:
+        from utils_kdm.drawer import Drawer
+        viz = Drawer(reset=True, env=args.visdom)
+        for (name, impl_name), points in sorted(curves.items()):
+            for size, mean_us in points:
+                viz.draw_line(y=mean_us, x=size, win='{} (us)'.format(name), variable=impl_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# 행동 선택 (get_action, 상태 1개) 지연 시간 벤치마크
+# 기존 구현 (정책망 forward + 파이썬/numpy 후처리) 과
+# trace 한 정책망 (use_compiled_policy = 정책망 + 샘플링/노이즈/자르기/argmax 를 그래프 하나로) 비교
+#
+# 실행: python -m benchmark.bench_policy_latency [--cpu]
+
+import argparse
+
+import numpy as np
+
+from algorithm_rl.algo01_a2c import A2C
+from algorithm_rl.algo02_dqn import DQN
+from algorithm_rl.algo03_ddpg import DDPG
+from algorithm_rl.algo04_trpo import TRPO
+from algorithm_rl.algo05_ppo import PPO
+from benchmark.bench_utils import measure, summarize, print_table
+from utils_kdm.trainer_metadata import TrainerMetadata
+
+
+def build_algorithms():
+    # (이름, 상태 크기, 알고리즘) = CartPole (4/2), Swimmer (8/2), HalfCheetah (17/6)
+    dqn = DQN(4, 2)
+    # ε-탐험은 정책망을 안 거치므로 항상 정책망으로 고르게
+    dqn.epsilon = 0.0
+
+    return [
+        ('A2C', 4, A2C(4, 2)),
+        ('DQN', 4, dqn),
+        ('DDPG-Swimmer', 8, DDPG(8, 2, (-1, 1))),
+        ('DDPG-HalfCheetah', 17, DDPG(17, 6, (-1, 1))),
+        ('TRPO-Swimmer', 8, TRPO(8, 2)),
+        ('TRPO-HalfCheetah', 17, TRPO(17, 6)),
+        ('PPO-Swimmer', 8, PPO(8, 2)),
+        ('PPO-HalfCheetah', 17, PPO(17, 6)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cpu', action='store_true')
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    TrainerMetadata().set_device(force_cpu=args.cpu)
+    device = TrainerMetadata().device
+
+    rows = list()
+    for name, state_size, algorithm_rl in build_algorithms():
+        state = np.random.randn(state_size).astype(np.float32)
+
+        for impl_name, use_compiled_policy in (('eager', False), ('compiled', True)):
+            algorithm_rl.use_compiled_policy = use_compiled_policy
+            row = summarize(measure(lambda: algorithm_rl.get_action(state), repeat=args.repeat, device=device))
+            row['algorithm'], row['impl'] = name, impl_name
+            rows.append(row)
+
+    print('device: {}'.format(device))
+    print_table(rows, ['algorithm', 'impl', 'mean_us', 'p50_us', 'p90_us', 'p99_us'])
+
+
+if __name__ == "__main__":
+    main()
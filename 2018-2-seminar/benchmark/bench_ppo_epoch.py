@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# PPO 한 epoch (미니배치 n // batch_size 개) 벤치마크
+# 기존 구현 (numpy arange 셔플 + 미니배치마다 u.t_long() 으로 인덱스 텐서 생성 + 고급 인덱싱) 과
+# 현재 구현 (MinibatchSampler = 디바이스 위 randperm 1번 + 뷰 슬라이스 + 미리 할당한 버퍼) 비교
+#
+# 실행: python -m benchmark.bench_ppo_epoch [--cpu]
+
+import argparse
+
+import numpy as np
+import torch
+
+import utils_kdm as u
+from algorithm_rl.algo05_ppo import PPO
+from benchmark.bench_utils import measure, summarize, print_table
+from utils_kdm.minibatch import MinibatchSampler
+from utils_kdm.trainer_metadata import TrainerMetadata
+
+
+def minibatch_step(ppo, s, a, ret, adv, old_policy):
+    # PPO.train_model 의 미니배치 한 번 (로그 기록만 뺌)
+    v = ppo.critic(s)
+    meow, logstd, std = ppo.actor(s)
+    new_policy = ppo._log_density(a, meow, std, logstd)
+
+    ratio = torch.exp(new_policy - old_policy)
+    clipped_ratio = torch.clamp(ratio, 1 - ppo.epsilon, 1 + ppo.epsilon)
+    surrogate_loss = -torch.min(ratio * adv, clipped_ratio * adv).mean()
+
+    loss = ppo._actor_critic_loss(surrogate_loss, ppo.get_critic_loss(v, ret))
+    ppo.actor_critic_optimizer.zero_grad()
+    loss.backward()
+    ppo.actor_critic_optimizer.step()
+
+
+def legacy_epoch(ppo, batches, arr):
+    s_batch, a_batch, return_batch, advantage_batch, old_policy = batches
+    np.random.shuffle(arr)
+    for i in range(len(arr) // ppo.batch_size):
+        batch_index = arr[ppo.batch_size * i: ppo.batch_size * (i + 1)]
+        batch_index = u.t_long(batch_index)
+        minibatch_step(ppo, s_batch[batch_index], a_batch[batch_index], return_batch[batch_index],
+                       advantage_batch[batch_index], old_policy[batch_index])
+
+
+def current_epoch(ppo, sampler):
+    for _, (s, a, ret, adv, old_policy) in sampler:
+        minibatch_step(ppo, s, a, ret, adv, old_policy)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cpu', action='store_true')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--steps', type=int, default=4000)
+    args = parser.parse_args()
+
+    TrainerMetadata().set_device(force_cpu=args.cpu)
+    device = TrainerMetadata().device
+
+    rows = list()
+    # (이름, 상태 크기, 행동 크기) = Swimmer, HalfCheetah
+    for env_name, state_size, action_size in (('Swimmer', 8, 2), ('HalfCheetah', 17, 6)):
+        ppo = PPO(state_size, action_size)
+        n = args.steps
+
+        s_batch = torch.randn(n, state_size, device=device)
+        a_batch = torch.randn(n, action_size, device=device)
+        return_batch = torch.randn(n, 1, device=device)
+        advantage_batch = torch.randn(n, 1, device=device)
+        with torch.no_grad():
+            meow, logstd, std = ppo.actor(s_batch)
+            old_policy = ppo._log_density(a_batch, meow, std, logstd)
+        batches = [s_batch, a_batch, return_batch, advantage_batch, old_policy]
+
+        arr = np.arange(n)
+        sampler = MinibatchSampler(batches, batch_size=ppo.batch_size)
+
+        impls = [
+            ('legacy', lambda: legacy_epoch(ppo, batches, arr)),
+            ('current', lambda: current_epoch(ppo, sampler)),
+        ]
+        for impl_name, impl in impls:
+            row = summarize(measure(impl, repeat=args.repeat, warmup=3, device=device))
+            row['env'], row['impl'] = env_name, impl_name
+            rows.append(row)
+
+    print('device: {}, steps per epoch: {}'.format(device, args.steps))
+    print_table(rows, ['env', 'impl', 'mean_us', 'p50_us', 'p90_us', 'p99_us'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# 타겟망 soft update 벤치마크 (DDPG 는 학습 스텝마다 2번 호출)
+# 기존 구현 (파라미터별 target*(1-tau) + param*tau) / 파라미터별 lerp_ / 평탄화 버퍼 lerp_ 비교
+#
+# 실행: python -m benchmark.bench_soft_update [--cpu]
+
+import argparse
+import copy
+
+import torch
+
+import utils_kdm as u
+from algorithm_rl.algo03_ddpg import Actor, Critic
+from benchmark.bench_utils import measure, summarize, print_table
+from utils_kdm.target_network import TargetNetworkUpdater
+from utils_kdm.trainer_metadata import TrainerMetadata
+
+
+def legacy_soft_update_from_to(src_nn, dst_nn, tau=1.0):
+    for target_param, param in zip(dst_nn.parameters(), src_nn.parameters()):
+        target_param.data.copy_(
+            target_param.data * (1.0 - tau) + param.data * tau
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cpu', action='store_true')
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    TrainerMetadata().set_device(force_cpu=args.cpu)
+    device = TrainerMetadata().device
+    tau = 0.001
+
+    rows = list()
+    # (이름, 상태 크기, 행동 크기) = Swimmer, HalfCheetah
+    for env_name, state_size, action_size in (('Swimmer', 8, 2), ('HalfCheetah', 17, 6)):
+        actor = Actor(state_size, action_size).to(device)
+        critic = Critic(state_size, action_size).to(device)
+        target_actor, target_critic = copy.deepcopy(actor), copy.deepcopy(critic)
+
+        def legacy():
+            legacy_soft_update_from_to(critic, target_critic, tau)
+            legacy_soft_update_from_to(actor, target_actor, tau)
+
+        def per_tensor_lerp():
+            u.soft_update_from_to(critic, target_critic, tau)
+            u.soft_update_from_to(actor, target_actor, tau)
+
+        impls = [('legacy', legacy), ('lerp_ per tensor', per_tensor_lerp)]
+
+        # 평탄화는 파라미터를 바꾸므로 위 두 개를 다 잰 다음에 만든다
+        for impl_name, impl in impls:
+            row = summarize(measure(impl, repeat=args.repeat, device=device))
+            row['env'], row['impl'] = env_name, impl_name
+            rows.append(row)
+
+        critic_updater = TargetNetworkUpdater(critic, target_critic)
+        actor_updater = TargetNetworkUpdater(actor, target_actor)
+
+        def flat_lerp():
+            critic_updater.soft_update(tau)
+            actor_updater.soft_update(tau)
+
+        row = summarize(measure(flat_lerp, repeat=args.repeat, device=device))
+        row['env'], row['impl'] = env_name, 'flat buffer lerp_'
+        rows.append(row)
+
+    print('device: {}, 1회 = actor + critic 갱신'.format(device))
+    print_table(rows, ['env', 'impl', 'mean_us', 'p50_us', 'p90_us', 'p99_us'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# 전체 학습 처리량 벤치마크 (알고리즘 x 내적 동기)
+# 설정마다 새 프로세스에서 sweep 의 Trial 로 학습을 돌려서
+#   - env_steps_per_sec      = 환경 스텝 / 초 (학습 시간 포함)
+#   - grad_steps_per_sec     = 경사 하강 스텝 / 초 (알고리즘마다 업데이트 1번 = 몇 스텝인지 다름)
+#   - update_p50/p90/p99_ms  = 업데이트 (train_model() 한 번) 지연 시간
+#   - peak_rss_mb            = 프로세스 최대 메모리 (설정마다 새 프로세스라 설정별 값)
+# 을 재고 JSON 으로 저장, 기준 결과 (--baseline) 와 비교해서 tolerance 넘게 나빠지거나 실패한 설정이 있으면 종료 코드 1
+#
+# 연속 행동 알고리즘 (DDPG, TRPO, PPO) 은 MuJoCo 없는 가짜 환경 (SyntheticSwimmer-v0 등) 에서
+# 내적 동기 없이 + Random / NM / SM / LPM / FM 각각
+# 이산 행동 알고리즘 (A2C, DQN) 은 CartPole (MuJoCo 불필요) 에서 내적 동기 없이만 (내적 동기는 연속 행동용)
+#
+# 실행: python -m benchmark.bench_throughput [--cpu] [--output result.json] [--baseline baseline.json]
+
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+import time
+
+import numpy as np
+
+from benchmark.bench_utils import synchronize, print_table
+
+ALGORITHMS = ('a2c', 'dqn', 'ddpg', 'trpo', 'ppo')
+MOTIVATIONS = ('none', 'random', 'nm', 'sm', 'lpm', 'fm')
+DISCRETE_ENV = 'CartPole-v1'
+
+# 지표 -> 클수록 좋은지
+METRICS = {
+    'env_steps_per_sec': True,
+    'grad_steps_per_sec': True,
+    'update_p50_ms': False,
+    'update_p90_ms': False,
+    'update_p99_ms': False,
+    'peak_rss_mb': False,
+}
+
+
+class UpdateTimer(object):
+    # train_model() 을 감싸서 호출마다 걸린 시간 기록 (CUDA 는 동기화해서)
+    def __init__(self, func, device):
+        self.func = func
+        self.device = device
+        self.times = list()
+        self.recording = False
+
+    def __call__(self, *args, **kwargs):
+        synchronize(self.device)
+        start = time.perf_counter()
+        ret = self.func(*args, **kwargs)
+        synchronize(self.device)
+        if self.recording:
+            self.times.append(time.perf_counter() - start)
+        return ret
+
+
+def grad_steps_per_update(algorithm, algorithm_rl):
+    # train_model() 한 번에 옵티마이저 step() 이 몇 번인지
+    if algorithm == 'ddpg':
+        return algorithm_rl.updates_per_step
+    if algorithm == 'trpo':
+        # 정책 1번 + 평가망 미니배치
+        return 1 + algorithm_rl.train_v_iters * (algorithm_rl.steps_per_epoch // algorithm_rl.batch_size)
+    if algorithm == 'ppo':
+        return algorithm_rl.num_epochs * (algorithm_rl.steps_per_epoch // algorithm_rl.batch_size)
+    return 1
+
+
+def peak_rss_mb():
+    import resource
+    # 리눅스는 KB, macOS 는 바이트
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_config(config, warmup, budget, seed, force_cpu):
+    # 벤치마크 프로세스에서 실행 (설정 하나당 새 프로세스)
+    import torch
+    from sweep.trials import Trial
+    from utils_kdm.drawer import NullDrawer
+    from utils_kdm.seeding import SeedManager
+    from utils_kdm.trainer_context import TrainerContext
+
+    context = TrainerContext(force_cpu=force_cpu, seeds=SeedManager(seed))
+    with context.activate():
+        context.seeds.seed_globals()
+        trial = Trial(config, context)
+        context.seeds.seed_env(trial.env)
+        # 에피소드마다 콘솔 출력 안 하게
+        context.metadata.reset(viz=NullDrawer(), checkpoint=None, agent=trial,
+                               force_cpu=force_cpu, log_interval=sys.maxsize)
+
+        timer = UpdateTimer(trial.algorithm_rl.train_model, context.device)
+        trial.algorithm_rl.train_model = timer
+
+        # 워밍업 = 리플레이 메모리 채우기 (train_start), cuDNN 자동 튜닝 등
+        trial.run(warmup)
+
+        timer.recording = True
+        start_step = context.metadata.global_step
+        start_time = time.perf_counter()
+        trial.run(warmup + budget)
+        synchronize(context.device)
+        elapsed = time.perf_counter() - start_time
+
+    env_steps = context.metadata.global_step - start_step
+    num_updates = len(timer.times)
+    update_ms = np.asarray(timer.times) * 1e3 if num_updates > 0 else np.zeros(1)
+    return {
+        'env_steps': env_steps,
+        'updates': num_updates,
+        'elapsed_sec': elapsed,
+        'env_steps_per_sec': env_steps / elapsed,
+        'grad_steps_per_sec': num_updates * grad_steps_per_update(config['algorithm'], trial.algorithm_rl) / elapsed,
+        'update_p50_ms': float(np.percentile(update_ms, 50)),
+        'update_p90_ms': float(np.percentile(update_ms, 90)),
+        'update_p99_ms': float(np.percentile(update_ms, 99)),
+        'peak_rss_mb': peak_rss_mb(),
+        'torch_threads': torch.get_num_threads(),
+    }
+
+
+def build_configs(algorithms, motivations, envs, steps_per_epoch):
+    # (이름, 설정)
+    configs = list()
+    for algorithm in algorithms:
+        if algorithm in ('a2c', 'dqn'):
+            configs.append(('{}-none-{}'.format(algorithm, DISCRETE_ENV), {'algorithm': algorithm, 'env': DISCRETE_ENV}))
+            continue
+
+        for env_id in envs:
+            for im in motivations:
+                config = {'algorithm': algorithm, 'im': im, 'env': env_id}
+                if algorithm in ('trpo', 'ppo'):
+                    config['steps_per_epoch'] = steps_per_epoch
+                configs.append(('{}-{}-{}'.format(algorithm, im, env_id), config))
+    return configs
+
+
+def compare(results, baseline, tolerance):
+    # 기준보다 tolerance (비율) 넘게 나빠진 (이름, 지표, 기준, 현재) 목록
+    # 기준에는 있는데 결과에 없는 설정 (실패) 도 회귀 (지표 = 'missing', 현재 = None)
+    regressions = list()
+    for name in sorted(set(baseline.keys()) - set(results.keys())):
+        regressions.append((name, 'missing', None, None))
+    for name, metrics in sorted(results.items()):
+        if name not in baseline:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            base, current = baseline[name].get(metric), metrics.get(metric)
+            if not base or current is None:
+                continue
+            change = (current - base) / base
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append((name, metric, base, current))
+    return regressions
+
+
+def main():
+    from utils_kdm.synthetic_env import SYNTHETIC_ENVS
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cpu', action='store_true')
+    parser.add_argument('--algorithms', nargs='+', default=list(ALGORITHMS), choices=ALGORITHMS)
+    parser.add_argument('--motivations', nargs='+', default=list(MOTIVATIONS), choices=MOTIVATIONS)
+    parser.add_argument('--envs', nargs='+', default=['SyntheticSwimmer-v0'],
+                        choices=[synthetic[0] for synthetic in SYNTHETIC_ENVS.values()])
+    # 예산 단위 = 에피소드 (A2C, DQN, DDPG) 또는 epoch (TRPO, PPO)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--budget', type=int, default=5)
+    parser.add_argument('--steps-per-epoch', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    configs = build_configs(args.algorithms, args.motivations, args.envs, args.steps_per_epoch)
+
+    results = dict()
+    failures = dict()
+    # 설정마다 새 프로세스 (최대 메모리를 설정별로 재고, 이전 설정의 캐시/스레드 영향 없이)
+    context = multiprocessing.get_context('spawn')
+    for name, config in configs:
+        pool = context.Pool(1)
+        try:
+            results[name] = pool.apply(run_config, (config, args.warmup, args.budget, args.seed, args.cpu))
+        except Exception as e:
+            failures[name] = str(e)
+            print('{}: {}'.format(name, e))
+        finally:
+            pool.terminate()
+            pool.join()
+
+    rows = [dict(name=name, **metrics) for name, metrics in sorted(results.items())]
+    if rows:
+        print_table(rows, ['name'] + list(METRICS.keys()))
+
+    if args.output is not None:
+        import torch
+        report = {
+            'meta': {
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'python': platform.python_version(),
+                'torch': torch.__version__,
+                'device': 'cpu' if args.cpu or not torch.cuda.is_available() else torch.cuda.get_device_name(0),
+                'args': vars(args),
+            },
+            'results': results,
+            'failures': failures,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for name, metric, base, current in regressions:
+            if current is None:
+                print('REGRESSION {}: missing from results'.format(name))
+            else:
+                print('REGRESSION {} {}: {:.2f} -> {:.2f}'.format(name, metric, base, current))
+        if regressions:
+            sys.exit(1)
+        print('No regressions (tolerance {:.0%})'.format(args.tolerance))
+
+    # 기준 비교가 없어도 실패한 설정이 있으면 실패로 끝낸다
+    if failures:
+        print('FAILED: {}'.format(', '.join(sorted(failures.keys()))))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# numpy -> torch 텐서 변환 마이크로벤치마크
+# 기존 구현 (from_numpy().float().to(), torch.tensor([item]), 매번 ManageDevice() 조회) 과
+# 현재 utils_kdm 구현을 비교한다
+#
+# 실행: python -m benchmark.bench_to_tensor [--cpu]
+
+import argparse
+
+import numpy as np
+import torch
+
+import utils_kdm as u
+from benchmark.bench_utils import measure, summarize, print_table
+from utils_kdm.manage_device import ManageDevice
+from utils_kdm.trainer_metadata import TrainerMetadata
+
+
+def legacy_t_float32(item, device=None):
+    device = device if device else ManageDevice().get()
+    if isinstance(item, np.ndarray):
+        return torch.from_numpy(item).float().to(device)
+    else:
+        return torch.tensor([item], device=device, dtype=torch.float32)
+
+
+def legacy_t_uint8(item, device=None):
+    device = device if device else ManageDevice().get()
+    if isinstance(item, np.ndarray):
+        return torch.from_numpy(item).int().to(device)
+    else:
+        return torch.tensor([item], device=device, dtype=torch.uint8)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cpu', action='store_true')
+    parser.add_argument('--repeat', type=int, default=10000)
+    args = parser.parse_args()
+
+    TrainerMetadata().set_device(force_cpu=args.cpu)
+    device = TrainerMetadata().device
+
+    # Swimmer / HalfCheetah 상태 크기, gym은 float64를 돌려준다
+    cases = [
+        ('state float64 (8,)', np.random.randn(8), legacy_t_float32, u.t_float32),
+        ('state float64 (17,)', np.random.randn(17), legacy_t_float32, u.t_float32),
+        ('action float32 (6,)', np.random.randn(6).astype(np.float32), legacy_t_float32, u.t_float32),
+        ('reward float', 0.5, legacy_t_float32, u.t_float32),
+        ('done bool', False, legacy_t_uint8, u.t_uint8),
+    ]
+
+    rows = list()
+    for name, item, legacy, current in cases:
+        for impl_name, impl in (('legacy', legacy), ('current', current)):
+            row = summarize(measure(lambda: impl(item), repeat=args.repeat, device=device))
+            row['case'] = name
+            row['impl'] = impl_name
+            rows.append(row)
+
+    print('device: {}'.format(device))
+    print_table(rows, ['case', 'impl', 'mean_us', 'p50_us', 'p90_us', 'p99_us'])
+
+
+if __name__ == "__main__":
+    main()
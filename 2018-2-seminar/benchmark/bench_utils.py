@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# 벤치마크 공용 함수
+# 실행은 2018-2-seminar 폴더에서: python -m benchmark.bench_xxx
+
+import time
+
+import numpy as np
+import torch
+
+
+def synchronize(device=None):
+    # CUDA는 비동기라서 동기화 안 하면 커널 던지는 시간만 재게 된다
+    if device is not None and torch.device(device).type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def measure(func, repeat=1000, warmup=100, device=None):
+    # 한 번 호출당 걸린 시간(초) 배열을 반환
+    for _ in range(warmup):
+        func()
+    synchronize(device)
+
+    times = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        synchronize(device)
+        times[i] = time.perf_counter() - start
+    return times
+
+
+def summarize(times):
+    # 마이크로초 단위 통계
+    times = np.asarray(times) * 1e6
+    return {
+        'mean_us': float(np.mean(times)),
+        'p50_us': float(np.percentile(times, 50)),
+        'p90_us': float(np.percentile(times, 90)),
+        'p99_us': float(np.percentile(times, 99)),
+    }
+
+
+def print_table(rows, columns):
+    # rows = [{'name': ..., 'mean_us': ...}, ...]
+    widths = [max(len(str(c)), *(len(_format(row.get(c))) for row in rows)) for c in columns]
+    print('  '.join(str(c).ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(_format(row.get(c)).ljust(w) for c, w in zip(columns, widths)))
+
+
+def _format(value):
+    if isinstance(value, float):
+        return '{:.2f}'.format(value)
+    return str(value)
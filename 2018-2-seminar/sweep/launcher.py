@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import math
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from sweep.space import grid_search, random_search
+from sweep.trials import run_trial
+
+# 하이퍼파라미터 스윕 = 설정 여러 개를 프로세스 풀에서 동시에 학습
+#
+#   - 워커 프로세스마다 CPU 코어 하나씩 고정 (sched_setaffinity) + torch 스레드 1개
+#     (워커 여러 개가 각자 코어 전부를 쓰려고 하면 서로 방해해서 더 느려진다)
+#   - 시행마다 시드 = base_seed + trial_id
+#   - 결과는 끝나는 대로 results.csv 에 한 줄씩 (중간에 멈춰도 끝난 시행은 남는다)
+#     열 (설정 키) 이 다른 이전 results.csv 는 results.<시각>.csv 로 옮기고 새로 쓴다
+#   - 연속 반감 (successive halving)
+#       단계 (rung) 마다 예산을 eta 배로 늘리면서 점수 상위 1/eta 만 남김
+#       다음 단계는 저장해 둔 상태에서 이어서 학습 (처음부터 다시 안 함)
+
+
+def _init_worker(counter, cpus):
+    # 워커 시작 시 한 번: 코어 하나 고르기
+    import torch
+
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {cpus[index % len(cpus)]})
+    torch.set_num_threads(1)
+
+
+def _run_trial_star(args):
+    trial_id, rung, config, seed, budget, state_path, log_path = args
+    start_time = time.time()
+    try:
+        result = run_trial(config, seed, budget, state_path=state_path, log_path=log_path)
+        result['status'] = 'ok'
+    except Exception as e:
+        # 시행 하나가 실패해도 스윕은 계속
+        result = {'scores': list(), 'status': 'error: {}'.format(e)}
+    result['elapsed'] = time.time() - start_time
+    return trial_id, rung, result
+
+
+class Sweep(object):
+    # configs = 설정 딕셔너리 리스트 (space.grid_search(), space.random_search())
+    # 연속 반감을 안 쓰면 (use_halving=False) 모든 설정을 max_budget 까지 한 번에
+    def __init__(self, configs, results_dir, num_workers=None, base_seed=0,
+                 use_halving=True, min_budget=10, max_budget=270, eta=3, score_window=10, pin_cpus=True):
+        self.configs = list(configs)
+        self.results_dir = results_dir
+        self.num_workers = num_workers if num_workers is not None else multiprocessing.cpu_count()
+        self.base_seed = base_seed
+
+        self.use_halving = use_halving
+        self.min_budget, self.max_budget = min_budget, max_budget
+        self.eta = eta
+        # 점수 = 마지막 score_window 에피소드 (또는 epoch) 평균
+        self.score_window = score_window
+        self.pin_cpus = pin_cpus
+
+        self.config_keys = sorted(set(k for config in self.configs for k in config.keys()))
+        self.fieldnames = ['trial_id', 'rung', 'budget', 'seed'] + self.config_keys + \
+                          ['score', 'best', 'progress', 'elapsed', 'status']
+
+        os.makedirs(os.path.join(self.results_dir, 'states'), exist_ok=True)
+        os.makedirs(os.path.join(self.results_dir, 'logs'), exist_ok=True)
+
+    @classmethod
+    def from_space(cls, space, search='grid', num_trials=10, search_seed=0, **kwargs):
+        if search == 'grid':
+            configs = grid_search(space)
+        elif search == 'random':
+            configs = random_search(space, num_trials, seed=search_seed)
+        else:
+            raise ValueError('Unknown search: {}'.format(search))
+        return cls(configs, **kwargs)
+
+    def budgets(self):
+        # 단계별 예산 (min_budget, min_budget * eta, ..., max_budget)
+        if not self.use_halving:
+            return [self.max_budget]
+
+        budgets = list()
+        budget = self.min_budget
+        while budget < self.max_budget:
+            budgets.append(int(budget))
+            budget *= self.eta
+        budgets.append(self.max_budget)
+        return budgets
+
+    def _available_cpus(self):
+        if not self.pin_cpus:
+            return list()
+        if hasattr(os, 'sched_getaffinity'):
+            return sorted(os.sched_getaffinity(0))
+        return list(range(multiprocessing.cpu_count()))
+
+    def _task(self, trial_id, rung, budget):
+        return (trial_id, rung, self.configs[trial_id], self.base_seed + trial_id, budget,
+                os.path.join(self.results_dir, 'states', 'trial_{}.pt'.format(trial_id)),
+                os.path.join(self.results_dir, 'logs', 'trial_{}.log'.format(trial_id)))
+
+    def _score(self, scores):
+        if not scores:
+            return -math.inf
+        return float(np.mean(scores[-self.score_window:]))
+
+    def _write_row(self, writer, f, trial_id, rung, budget, result):
+        scores = result['scores']
+        row = {
+            'trial_id': trial_id,
+            'rung': rung,
+            'budget': budget,
+            'seed': self.base_seed + trial_id,
+            'score': self._score(scores),
+            'best': max(scores) if scores else '',
+            'progress': len(scores),
+            'elapsed': '{:.1f}'.format(result['elapsed']),
+            'status': result['status'],
+        }
+        for key in self.config_keys:
+            row[key] = self.configs[trial_id].get(key, '')
+        writer.writerow(row)
+        # 끝나는 대로 파일에 (스윕 도중에도 결과를 볼 수 있게)
+        f.flush()
+
+    def _open_results(self, results_path):
+        # 이전 스윕의 results.csv 가 열 (설정 키) 이 같으면 이어서 쓰고, 다르면 옆으로 치워 두고 새로
+        # (열이 다른 줄을 덧붙이면 헤더와 안 맞아서 표가 깨진다)
+        if os.path.exists(results_path):
+            with open(results_path, newline='') as f:
+                header = next(csv.reader(f), None)
+            if header == self.fieldnames:
+                return open(results_path, 'a', newline=''), False
+
+            moved_path = '{}.{}.csv'.format(os.path.splitext(results_path)[0], time.strftime('%Y%m%d-%H%M%S'))
+            os.replace(results_path, moved_path)
+            print('results.csv has different columns, moved to {}'.format(moved_path))
+        return open(results_path, 'w', newline=''), True
+
+    def run(self):
+        # 반환 = [(trial_id, 마지막으로 도달한 단계의 점수), ...] 점수 높은 순
+        context = multiprocessing.get_context('spawn')
+        counter = context.Value('i', 0)
+        pool = context.Pool(self.num_workers, initializer=_init_worker,
+                            initargs=(counter, self._available_cpus()))
+
+        # 이전 스윕에서 남은 상태는 지움 (다른 설정의 상태에서 이어서 하지 않게)
+        states_dir = os.path.join(self.results_dir, 'states')
+        for name in os.listdir(states_dir):
+            os.remove(os.path.join(states_dir, name))
+
+        results_path = os.path.join(self.results_dir, 'results.csv')
+        survivors = list(range(len(self.configs)))
+        final_scores = dict()
+
+        try:
+            f, is_new = self._open_results(results_path)
+            with f:
+                writer = csv.DictWriter(f, fieldnames=self.fieldnames)
+                if is_new:
+                    writer.writeheader()
+
+                budgets = self.budgets()
+                for rung, budget in enumerate(budgets):
+                    print('Rung {}: {} trials, budget {}'.format(rung, len(survivors), budget))
+
+                    rung_scores = dict()
+                    tasks = [self._task(trial_id, rung, budget) for trial_id in survivors]
+                    # 끝난 순서대로 받는다 (느린 시행을 기다리느라 기록이 밀리지 않게)
+                    for trial_id, _, result in pool.imap_unordered(_run_trial_star, tasks):
+                        self._write_row(writer, f, trial_id, rung, budget, result)
+                        rung_scores[trial_id] = self._score(result['scores']) if result['status'] == 'ok' else -math.inf
+                        print('Trial {}: {:.2f} ({})'.format(trial_id, rung_scores[trial_id], result['status']))
+
+                    final_scores.update(rung_scores)
+                    if rung == len(budgets) - 1:
+                        break
+
+                    # 상위 1/eta 만 다음 단계로
+                    num_keep = max(1, len(survivors) // self.eta)
+                    survivors = sorted(survivors, key=lambda i: rung_scores[i], reverse=True)[:num_keep]
+        finally:
+            pool.terminate()
+            pool.join()
+
+        return sorted(final_scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import math
+import random
+
+
+# 탐색 공간 = {이름: 후보} 딕셔너리
+#   리스트          -> 후보 중 하나 (격자 탐색은 전부)
+#   Uniform 등     -> 랜덤 탐색에서 범위 안에서 뽑기 (격자 탐색에는 못 씀)
+#   그 외 값        -> 고정
+#
+# 예
+#   space = {
+#       'algorithm': ['trpo', 'ppo'],
+#       'im': ['none', 'lpm', 'fm'],
+#       'learning_rate_critic': LogUniform(1e-4, 1e-2),
+#       'env': 'Swimmer-v2',
+#   }
+
+
+class Uniform(object):
+    def __init__(self, low, high):
+        self.low, self.high = low, high
+
+    def sample(self, rng):
+        return rng.uniform(self.low, self.high)
+
+
+class LogUniform(object):
+    def __init__(self, low, high):
+        self.low, self.high = low, high
+
+    def sample(self, rng):
+        return math.exp(rng.uniform(math.log(self.low), math.log(self.high)))
+
+
+class RandInt(object):
+    # [low, high] 정수
+    def __init__(self, low, high):
+        self.low, self.high = low, high
+
+    def sample(self, rng):
+        return rng.randint(self.low, self.high)
+
+
+def _is_distribution(value):
+    return hasattr(value, 'sample')
+
+
+def grid_search(space):
+    # 리스트인 항목의 모든 조합
+    names = sorted(space.keys())
+    for name in names:
+        assert not _is_distribution(space[name]), 'grid_search: {} is a distribution'.format(name)
+
+    candidates = [space[name] if isinstance(space[name], list) else [space[name]] for name in names]
+    return [dict(zip(names, values)) for values in itertools.product(*candidates)]
+
+
+def random_search(space, num_trials, seed=0):
+    rng = random.Random(seed)
+    names = sorted(space.keys())
+
+    configs = list()
+    for _ in range(num_trials):
+        config = dict()
+        for name in names:
+            value = space[name]
+            if isinstance(value, list):
+                value = rng.choice(value)
+            elif _is_distribution(value):
+                value = value.sample(rng)
+            config[name] = value
+        configs.append(config)
+    return configs
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+import utils_kdm as u
+from algorithm_im.im_fm import PredictiveFamiliarityMotivation
+from algorithm_im.im_lpm import LearningProgressMotivation
+from algorithm_im.im_nm import LearningNoveltyMotivation
+from algorithm_im.im_random import RandomMotivation
+from algorithm_im.im_sm import PredictiveSurpriseMotivation
+from algorithm_rl.algo01_a2c import A2C
+from algorithm_rl.algo02_dqn import DQN
+from algorithm_rl.algo03_ddpg import DDPG
+from algorithm_rl.algo04_trpo import TRPO
+from algorithm_rl.algo05_ppo import PPO
+from utils_kdm.drawer import NullDrawer
+from utils_kdm.seeding import SeedManager
+from utils_kdm.trainer_context import TrainerContext
+
+# 시행 (trial) 하나 = 설정 하나로 정해진 예산 (budget) 만큼 학습
+#   예산 단위 = 에피소드 (A2C, DQN, DDPG) 또는 epoch (TRPO, PPO, epoch 당 steps_per_epoch 스텝)
+#
+# 설정 (config) 의 예약된 키
+#   'algorithm'       = a2c, dqn, ddpg, trpo, ppo
+#   'im'              = none, random, nm, lpm, sm, fm (연속 행동 알고리즘만)
+#   'env'             = gym 환경 이름 (MuJoCo 없이 돌릴 때는 SyntheticSwimmer-v0, SyntheticHalfCheetah-v0)
+#   'steps_per_epoch' = TRPO, PPO 의 epoch 당 스텝 수
+# 나머지 키는 하이퍼파라미터 (_set_hyper_parameters 에서 정하는 속성) 덮어쓰기
+#   'im.' 으로 시작하면 내적 동기 알고리즘 쪽 (예: 'im.intrinsic_reward_ratio')
+
+RESERVED_KEYS = ('algorithm', 'im', 'env', 'steps_per_epoch')
+IM_PREFIX = 'im.'
+
+ALGORITHMS = {
+    'a2c': A2C,
+    'dqn': DQN,
+    'ddpg': DDPG,
+    'trpo': TRPO,
+    'ppo': PPO,
+}
+
+# 'none' = 내적 동기 없이 (가중합에서 내적 비율 0)
+MOTIVATIONS = {
+    'none': RandomMotivation,
+    'random': RandomMotivation,
+    'nm': LearningNoveltyMotivation,
+    'lpm': LearningProgressMotivation,
+    'sm': PredictiveSurpriseMotivation,
+    'fm': PredictiveFamiliarityMotivation,
+}
+
+ON_POLICY = ('trpo', 'ppo')
+DISCRETE = ('a2c', 'dqn')
+
+
+def split_config(config):
+    # 설정 -> (알고리즘 하이퍼파라미터, 내적 동기 하이퍼파라미터)
+    rl_overrides, im_overrides = dict(), dict()
+    for key, value in config.items():
+        if key in RESERVED_KEYS:
+            continue
+        if key.startswith(IM_PREFIX):
+            im_overrides[key[len(IM_PREFIX):]] = value
+        else:
+            rl_overrides[key] = value
+    return rl_overrides, im_overrides
+
+
+def with_hyper_parameters(cls, overrides):
+    # _set_hyper_parameters() 가 끝난 직후에 덮어쓰는 서브클래스
+    # (생성자에서 하이퍼파라미터로 옵티마이저, 버퍼 등을 만들므로 생성 뒤에 바꾸면 늦다)
+    if not overrides:
+        return cls
+
+    def _set_hyper_parameters(self):
+        cls._set_hyper_parameters(self)
+        for name, value in overrides.items():
+            if not hasattr(self, name):
+                raise ValueError('{} has no hyper parameter {}'.format(cls.__name__, name))
+            setattr(self, name, value)
+
+    return type(cls.__name__, (cls,), {'_set_hyper_parameters': _set_hyper_parameters})
+
+
+@contextlib.contextmanager
+def _redirect_stdout(log_path):
+    # 시행마다 콘솔 출력 (TrainerMetadata.finish_episode) 을 로그 파일로
+    if log_path is None:
+        yield
+        return
+
+    with open(log_path, 'a') as f:
+        stdout = sys.stdout
+        sys.stdout = f
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+class Trial(u.TorchSerializable):
+    # 시행 하나의 환경 + 알고리즘 (runner 의 RLAgent 역할)
+    # state_dict 로 이어서 학습 가능 (연속 반감 (successive halving) 다음 단계에서 예산을 늘려 이어감)
+    def __init__(self, config, context):
+        super().__init__()
+
+        # gym 은 시행 프로세스에서만 필요
+        import gym
+        from utils_kdm.normalized_mujoco import NormalizedMujocoEnv
+        from utils_kdm.synthetic_env import maybe_register
+
+        self.config = config
+        self.context = context
+        self.algorithm = config['algorithm']
+        self.is_on_policy = self.algorithm in ON_POLICY
+        self.is_discrete = self.algorithm in DISCRETE
+
+        self.progress = 0
+        self.scores = list()
+
+        # 가짜 환경 (SyntheticSwimmer-v0 등) 도 설정에 그대로 쓸 수 있게
+        maybe_register(config['env'])
+        env = gym.make(config['env'])
+        state_size = env.observation_space.shape[0]
+        rl_overrides, im_overrides = split_config(config)
+        rl_class = with_hyper_parameters(ALGORITHMS[self.algorithm], rl_overrides)
+
+        if self.is_discrete:
+            action_size = env.action_space.n
+            self.algorithm_rl = rl_class(state_size, action_size, context=context)
+            self.algorithm_im = None
+        else:
+            action_size = env.action_space.shape[0]
+            action_range = (min(env.action_space.low), max(env.action_space.high))
+            if self.is_on_policy:
+                steps_per_epoch = config.get('steps_per_epoch', 4000)
+                self.algorithm_rl = rl_class(state_size, action_size, steps_per_epoch=steps_per_epoch,
+                                             context=context)
+                env = NormalizedMujocoEnv(env, state_size, clip=5)
+            else:
+                self.algorithm_rl = rl_class(state_size, action_size, action_range, context=context)
+
+            im_name = config.get('im', 'none')
+            im_class = with_hyper_parameters(MOTIVATIONS[im_name], im_overrides)
+            self.algorithm_im = im_class(state_size, action_size, context=context)
+            self.use_intrinsic = im_name != 'none'
+            if not self.use_intrinsic:
+                self.algorithm_im.intrinsic_reward_ratio = 0
+
+        self.env = env
+        # 상태 정규화 통계 (ZFilter) 도 같이 저장 (이어서 할 때 같은 정규화가 되도록)
+        self.running_state = getattr(env, 'running_state', None)
+
+        self.register_serializable([
+            'algorithm_rl',
+            'progress',
+            'scores',
+        ])
+        if self.algorithm_im is not None:
+            self.register_serializable([
+                'algorithm_im',
+            ])
+        if self.running_state is not None:
+            self.register_serializable([
+                'running_state',
+            ])
+
+    def get_weighted_reward(self, i_epoch, current_step, current_sars, current_done):
+        # runner 03, 04 의 RLAgent 와 같은 가중합
+        if self.algorithm_im is None:
+            return current_sars[2]
+
+        int_reward = 0
+        if self.use_intrinsic:
+            int_reward = self.algorithm_im.get_reward(i_epoch, current_step, current_sars, current_done)
+
+        if current_done:
+            self.algorithm_im.scale_annealing()
+
+        int_ext_reward, _, _ = self.algorithm_im.weighted_reward(int_reward, current_sars[2])
+        return int_ext_reward
+
+    def run(self, budget):
+        # 예산까지 이어서 학습 (이미 한 만큼은 건너뜀)
+        metadata = self.context.metadata
+        while self.progress < budget:
+            metadata.start_episode()
+            if self.is_on_policy:
+                score = self._run_epoch(self.progress)
+            else:
+                score = self._run_episode(self.progress)
+            self.scores.append(float(score))
+            metadata.log(score, 'score', compute_maxmin=True)
+            metadata.finish_episode(self.progress)
+            self.progress += 1
+        return self.scores
+
+    def _run_episode(self, i_episode):
+        # runner 01, 02, 03 의 에피소드 하나
+        metadata = self.context.metadata
+        self.algorithm_rl.reset()
+        state = self.env.reset()
+        score = 0.0
+
+        for t in range(self.env.spec.max_episode_steps):
+            metadata.start_step()
+
+            action = self.algorithm_rl.get_action(state)
+            next_state, reward, done, _ = self.env.step(action)
+            score += reward
+
+            train_reward = self.get_weighted_reward(i_episode, t, (state, action, reward, next_state), done)
+            if self.is_discrete:
+                # runner 01, 02 와 같이 (CartPole) 중간에 쓰러지면 벌점
+                train_reward = train_reward if not done or score >= self.env.spec.max_episode_steps else -100
+            sars = (state, action, train_reward, next_state)
+
+            if self.algorithm == 'a2c':
+                self.algorithm_rl.train_model(sars, done)
+            else:
+                self.algorithm_rl.append_sample(sars, done)
+                if len(self.algorithm_rl.memory) >= self.algorithm_rl.train_start:
+                    self.algorithm_rl.train_model(sars, done)
+
+            state = next_state
+            metadata.finish_step()
+            if done:
+                break
+
+        return score
+
+    def _run_epoch(self, i_epoch):
+        # runner 04, 05 의 epoch 하나 (점수 = epoch 안 에피소드 점수 평균)
+        metadata = self.context.metadata
+        steps_per_epoch = self.algorithm_rl.steps_per_epoch
+        self.algorithm_rl.actor.eval()
+        self.algorithm_rl.critic.eval()
+        self.algorithm_rl.reset()
+
+        scores = list()
+        step_in_epoch = 0
+        while step_in_epoch < steps_per_epoch:
+            state = self.env.reset()
+            score = 0.0
+
+            for _ in range(self.env.spec.max_episode_steps):
+                metadata.start_step()
+
+                action = self.algorithm_rl.get_action(state)
+                next_state, reward, done, _ = self.env.step(action)
+                score += reward
+
+                train_reward = self.get_weighted_reward(i_epoch, step_in_epoch, (state, action, reward, next_state), done)
+                self.algorithm_rl.append_sample((state, action, train_reward, next_state), done)
+
+                state = next_state
+                metadata.finish_step()
+                step_in_epoch += 1
+                if done or step_in_epoch == steps_per_epoch:
+                    break
+
+            scores.append(score)
+
+        self.algorithm_rl.actor.train()
+        self.algorithm_rl.critic.train()
+        self.algorithm_rl.train_model()
+        return float(np.mean(scores))
+
+
+def run_trial(config, seed, budget, state_path=None, log_path=None):
+    # 프로세스 풀 워커에서 실행
+    # state_path 에 이전 단계 상태가 있으면 불러와서 budget 까지 이어서 학습하고 다시 저장
+    # 반환 = 에피소드 (또는 epoch) 별 점수 전체
+    context = TrainerContext(force_cpu=True, seeds=SeedManager(seed))
+
+    with _redirect_stdout(log_path), context.activate():
+        # 가중치 초기화도 시드대로
+        context.seeds.seed_globals()
+        trial = Trial(config, context)
+        context.metadata.reset(viz=NullDrawer(), checkpoint=None, agent=trial, force_cpu=True,
+                               log_interval=max(1, budget // 10))
+
+        resumed = state_path is not None and os.path.exists(state_path)
+        if resumed:
+            trial.load_state_dict(torch.load(state_path, map_location=context.device))
+
+        if resumed:
+            # 이어서 할 때는 이어서 하는 지점을 섞어서 (처음과 같은 난수열을 반복하지 않게)
+            context.seeds.reseed(seed + trial.progress)
+        context.seeds.seed_env(trial.env)
+
+        start_time = time.time()
+        scores = trial.run(budget)
+        elapsed = time.time() - start_time
+
+        if state_path is not None:
+            torch.save(trial.state_dict(), state_path)
+
+    return {
+        'scores': list(scores),
+        'elapsed': elapsed,
+        'resumed': resumed,
+    }
@@ -5,10 +5,10 @@
 # https://github.com/openai/baselines/blob/master/baselines/common/cg.py
 
 import torch
-from utils_kdm.trainer_metadata import TrainerMetadata
 
 
-def conjugate_gradient(func_Ax, s_batch, loss_grad_data, cg_iters=10, residual_tol=1e-10):
+def conjugate_gradient(func_Ax, s_batch, loss_grad_data, cg_iters=10, residual_tol=1e-10,
+                       inverse_diagonal=None, check_interval=1):
     """
     Demmel p 312
 
@@ -38,29 +38,85 @@ def conjugate_gradient(func_Ax, s_batch, loss_grad_data, cg_iters=10, residual_t
            -------------
                r * r
     new_p = r + (meow * p)
+
+    == 추가한 것 ==
+    - inverse_diagonal: Jacobi 전처리 (M^-1 = A 대각 성분의 역수, [n])
+      r*r 대신 r*z (z = M^-1 r) 를 쓰면 조건수가 나쁜 A 에서 더 빨리 수렴
+    - check_interval: 잔차 검사 (GPU -> CPU 동기화) 를 몇 반복마다 할지 (0 이면 검사 없이 cg_iters 번)
+    - loss_grad_data 가 [n, k] 면 우변 k개를 열마다 따로 (α, meow 도 열마다) 한꺼번에 푼다
+      func_Ax 는 벡터 [n] 하나씩 받으므로 열마다 호출
+    - .to(device) 없음 (입력 텐서 디바이스 그대로)
     """
-    device = TrainerMetadata().device
+    is_vector = loss_grad_data.dim() == 1
+    b = loss_grad_data.detach()
+    if is_vector:
+        b = b.unsqueeze(1)
+
+    def _Ax(p):
+        if p.size(1) == 1:
+            return func_Ax((p[:, 0], s_batch)).unsqueeze(1)
+        return torch.stack([func_Ax((p[:, j], s_batch)) for j in range(p.size(1))], dim=1)
+
+    def _precondition(r):
+        return r if inverse_diagonal is None else r * inverse_diagonal.unsqueeze(1)
 
-    p = loss_grad_data.clone().to(device)
-    r = loss_grad_data.clone().to(device)
-    x = torch.zeros_like(loss_grad_data).to(device)
-    dot_rr = torch.dot(r, r).to(device)
+    x = torch.zeros_like(b)
+    r = b.clone()
+    z = _precondition(r)
+    p = z.clone()
+    # 열마다 <r, z>
+    dot_rz = (r * z).sum(0)
 
     for i in range(cg_iters):
         # 원래 여기서 z = Ax를 계산해야 한다
         # 그런데 A를 갖고 있기 힘드니깐 대충 Ax 예상해서 던져주는 놈을 사용할 것이다
-        # z = A * p
-        # z = func_Ap
-        z = func_Ax((p, s_batch))
-        alpha = dot_rr / torch.dot(p, z).to(device)
+        # Ap = A * p
+        Ap = _Ax(p)
+        dot_pAp = (p * Ap).sum(0)
+        # 이미 수렴한 열은 0 으로 나누지 않도록 멈춰 둔다 (검사를 매 반복 하지 않으므로)
+        alpha = torch.where(dot_pAp > 0, dot_rz / dot_pAp, torch.zeros_like(dot_rz))
         x += alpha * p
-        r -= alpha * z
-        new_dot_rr = torch.dot(r, r).to(device)
-        meow = new_dot_rr / dot_rr
-        p = r + (meow * p)
+        r -= alpha * Ap
+
+        z = _precondition(r)
+        new_dot_rz = (r * z).sum(0)
+        meow = torch.where(dot_rz > 0, new_dot_rz / dot_rz, torch.zeros_like(dot_rz))
+        p = z + (meow * p)
+        dot_rz = new_dot_rz
+
+        # 동기화는 check_interval 반복마다 한 번
+        if check_interval and (i + 1) % check_interval == 0:
+            if (r * r).sum(0).max().item() < residual_tol:
+                break
+
+    return x[:, 0] if is_vector else x
+
+
+class FisherDiagonalEstimator(object):
+    # 켤레 기울기법 Jacobi 전처리용 피셔 행렬 대각 성분 추정 (Hutchinson)
+    #   diag(F) ≈ 평균(v ⊙ Fv), v 는 원소가 ±1 인 랜덤 벡터
+    # 피셔-벡터곱 num_samples 번이면 되고, 업데이트 사이에 크게 안 바뀌므로 EMA 로 누적
+    def __init__(self, num_samples=1, decay=0.9, min_value=1e-3):
+        self.num_samples = num_samples
+        self.decay = decay
+        # Hutchinson 추정은 음수가 나올 수 있으므로 아래를 자른다
+        self.min_value = min_value
+        self.diagonal = None
+
+    def update(self, func_Ax, s_batch, like):
+        # like = 파라미터 벡터와 같은 모양/디바이스의 텐서 (예: loss_grad)
+        estimate = torch.zeros_like(like)
+        for _ in range(self.num_samples):
+            v = torch.randint_like(like, 0, 2) * 2 - 1
+            estimate += v * func_Ax((v, s_batch)).detach()
+        estimate /= self.num_samples
 
-        dot_rr = new_dot_rr
-        if dot_rr < residual_tol:
-            break
+        if self.diagonal is None:
+            self.diagonal = estimate
+        else:
+            self.diagonal = self.decay * self.diagonal + (1 - self.decay) * estimate
 
-    return x
+    def inverse(self):
+        if self.diagonal is None:
+            return None
+        return 1.0 / self.diagonal.clamp(min=self.min_value)
@@ -8,8 +8,8 @@ from utils_kdm.trainer_metadata import TrainerMetadata
 class GAE:
     # Generalized Advantage Estimation (Schulman et al. 2016)
 
-    def __init__(self, gamma=0.99):
-        self.device = TrainerMetadata().device
+    def __init__(self, gamma=0.99, device=None):
+        self.device = device if device else TrainerMetadata().device
         self.gamma = gamma
 
     def _flip_0_1(self, batch):
@@ -62,23 +62,25 @@ def _group_pairwise(X, groups, device=None, fun=lambda r, c: _pairwise_distance(
     return group_dict
 
 
-def get_initial_state(X, n_clusters):
+def get_initial_state(X, n_clusters, rng=None):
     """
     X에서 n개 샘플 추출(해서 중심 좌표로 삼기)
 
         Args:
           X: n차원 Numpy 배열 (float 가정)
           n_clusters: 클러스터 갯수
+          rng: np.random.RandomState (없으면 전역 np.random)
         Returns:
           initial_state: 초기 좌표
     """
     _len = len(X)
-    indices = np.random.choice(_len, n_clusters)
+    rng = rng if rng is not None else np.random
+    indices = rng.choice(_len, n_clusters)
     initial_state = X[indices]
     return initial_state
 
 
-def execute(X, n_clusters, device=None, tol=1e-4):
+def execute(X, n_clusters, device=None, tol=1e-4, rng=None):
     """lloyd algorithm_rl
 
         Args:
@@ -86,6 +88,7 @@ def execute(X, n_clusters, device=None, tol=1e-4):
           n_clusters: 클러스터 갯수
           device: PyTorch device 오브젝트
           tol: 계산 도중 중심 이동 간격 최소 기대치
+          rng: 초기 좌표 뽑을 때 쓸 np.random.RandomState (없으면 전역 np.random)
         Returns:
           choice_cluster: X가 속한 클러스터 인덱스 (0~n-1)
           initial_state: 초기 좌표
@@ -93,7 +96,7 @@ def execute(X, n_clusters, device=None, tol=1e-4):
     device = device if device else TrainerMetadata().device
     X = torch.from_numpy(X).float().to(device)
 
-    initial_state = get_initial_state(X, n_clusters)
+    initial_state = get_initial_state(X, n_clusters, rng=rng)
 
     while True:
         # Expectation
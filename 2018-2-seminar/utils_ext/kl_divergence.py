@@ -5,17 +5,12 @@
 
 
 import torch
-from utils_kdm.trainer_metadata import TrainerMetadata
 
 
-# TODO: 논문에서 다시 공부하기
-def kl_divergence(new_actor, old_actor, s_batch):
-    device = TrainerMetadata().device
-    meow, logstd, std = new_actor(s_batch)
-    meow_old, logstd_old, std_old = old_actor(s_batch)
-    meow_old = meow_old.detach()
-    std_old = std_old.detach()
-    logstd_old = logstd_old.detach()
+def kl_divergence_from_stats(meow_old, logstd_old, meow, logstd):
+    # 두 정규분포 정책의 평균, log 표준편차만으로 KL 구하기 (정책망 forward 없음)
+    std_old = torch.exp(logstd_old)
+    std = torch.exp(logstd)
 
     # kl divergence between old policy and new policy : D( pi_old || pi_new )
     # pi_old -> mu0, logstd0, std0 / pi_new -> mu, logstd, std
@@ -24,3 +19,68 @@ def kl_divergence(new_actor, old_actor, s_batch):
          (2.0 * std.pow(2)) - 0.5
 
     return kl.sum(1, keepdim=True)
+
+
+# TODO: 논문에서 다시 공부하기
+def kl_divergence(new_actor, old_actor, s_batch):
+    meow, logstd, std = new_actor(s_batch)
+    meow_old, logstd_old, std_old = old_actor(s_batch)
+    meow_old = meow_old.detach()
+    logstd_old = logstd_old.detach()
+
+    return kl_divergence_from_stats(meow_old, logstd_old, meow, logstd)
+
+
+class KLMonitor(object):
+    # PPO early stopping 용 KL 추정
+    #
+    # kl_divergence() 는 부를 때마다 옛날 정책망, 새 정책망 둘 다 전체 배치 (4000개) 에 대해 forward 한다
+    # 옛날 정책의 출력은 업데이트 동안 안 바뀌므로 reset() 에서 한 번만 받아 두고
+    #   - minibatch = 이번 epoch 미니배치 학습 때 이미 구한 새 정책 출력으로 추정 (추가 forward 없음)
+    #                 (각 미니배치의 출력은 그 미니배치 업데이트 직전 정책 것이라 한 스텝씩 늦은 추정)
+    #   - subsample = 고정된 일부 상태 (subsample_size 개) 에 대해서만 새 정책망 forward
+    #   - full      = 전체 상태에 대해 새 정책망 forward (옛날 정책망 forward 만 없음)
+    MINIBATCH, SUBSAMPLE, FULL = 'minibatch', 'subsample', 'full'
+
+    def __init__(self, mode=MINIBATCH, subsample_size=512):
+        assert mode in (self.MINIBATCH, self.SUBSAMPLE, self.FULL)
+        self.mode = mode
+        self.subsample_size = subsample_size
+
+        self.s_batch, self.meow_old, self.logstd_old = None, None, None
+        self._kl_sum, self._count = None, 0
+
+    def reset(self, s_batch, meow_old, logstd_old):
+        # 업데이트 시작 전 (옛날) 정책의 출력을 받아 둔다
+        self.s_batch, self.meow_old, self.logstd_old = s_batch.detach(), meow_old.detach(), logstd_old.detach()
+
+        if self.mode == self.SUBSAMPLE and len(self.s_batch) > self.subsample_size:
+            index = torch.randperm(len(self.s_batch), device=self.s_batch.device)[:self.subsample_size]
+            self.s_batch = self.s_batch[index]
+            self.meow_old, self.logstd_old = self.meow_old[index], self.logstd_old[index]
+
+        self._kl_sum = torch.zeros((), device=self.s_batch.device)
+        self._count = 0
+
+    def accumulate(self, batch_index, meow, logstd):
+        # 미니배치 학습에서 구한 새 정책 출력 (batch_index 는 reset() 에 넘긴 배치 기준 인덱스)
+        if self.mode != self.MINIBATCH:
+            return
+
+        kl = kl_divergence_from_stats(self.meow_old[batch_index], self.logstd_old[batch_index],
+                                      meow.detach(), logstd.detach())
+        # 디바이스 위에서 더하기만 (동기화 없음)
+        self._kl_sum += kl.sum()
+        self._count += len(batch_index)
+
+    def estimate(self, actor):
+        # 평균 KL (0차원 텐서), minibatch 모드는 누적값을 비운다
+        if self.mode == self.MINIBATCH and self._count > 0:
+            kl = self._kl_sum / self._count
+            self._kl_sum = torch.zeros((), device=self.s_batch.device)
+            self._count = 0
+            return kl
+
+        with torch.no_grad():
+            meow, logstd, _ = actor(self.s_batch)
+        return kl_divergence_from_stats(self.meow_old, self.logstd_old, meow, logstd).mean()
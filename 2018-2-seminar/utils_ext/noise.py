@@ -11,9 +11,12 @@ from utils_kdm import TorchSerializable
 # Implemented by OpenAI on https://github.com/openai/baselines/blob/master/baselines/ddpg/noise.py
 class OrnsteinUhlenbeckNoise(TorchSerializable):
 
-    def __init__(self, action_dim, mu=0, theta=0.15, sigma=0.2):
+    # rng = np.random.RandomState (SeedManager.numpy_rng()), 없으면 전역 np.random
+    def __init__(self, action_dim, mu=0, theta=0.15, sigma=0.2, rng=None):
         super().__init__()
 
+        self.rng = rng if rng is not None else np.random
+
         self.action_dim = action_dim
         self.mu = mu
         self.theta = theta
@@ -33,6 +36,6 @@ class OrnsteinUhlenbeckNoise(TorchSerializable):
 
     def sample(self):
         dx = self.theta * (self.mu - self.X)
-        dx = dx + self.sigma * np.random.randn(len(self.X))
+        dx = dx + self.sigma * self.rng.randn(len(self.X))
         self.X = self.X + dx
         return self.X
@@ -1,3 +1,4 @@
+# -*- coding: utf-8 -*-
 #
 # From https://github.com/reinforcement-learning-kr/pg_travel/blob/master/mujoco/utils/running_state.py
 
@@ -5,25 +6,64 @@ from collections import deque
 
 import numpy as np
 
+from utils_kdm import TorchSerializable
+
 
 # from https://github.com/joschu/modular_rl
 # http://www.johndcook.com/blog/standard_deviation/
-class RunningStat(object):
+class RunningStat(TorchSerializable):
     def __init__(self, shape):
+        super().__init__()
+
         self._n = 0
         self._M = np.zeros(shape)
         self._S = np.zeros(shape)
 
+        self.register_serializable([
+            '_n',
+            '_M',
+            '_S',
+        ])
+
     def push(self, x):
+        # 관측 1개 (Welford) - 옛날 평균 복사 없이 제자리 갱신
+        # n == 1 이면 M = x, S = 0 이 되므로 따로 나누지 않음
         x = np.asarray(x)
         assert x.shape == self._M.shape
         self._n += 1
-        if self._n == 1:
-            self._M[...] = x
-        else:
-            oldM = self._M.copy()
-            self._M[...] = oldM + (x - oldM) / self._n
-            self._S[...] = self._S + (x - oldM) * (x - self._M)
+        delta = x - self._M
+        self._M += delta / self._n
+        self._S += delta * (x - self._M)
+
+    def push_batch(self, xs):
+        # 관측 여러 개 [k, shape] (환경 여러 개의 한 스텝 등)
+        # 배치 통계를 구해서 merge 와 같은 식으로 합침
+        xs = np.asarray(xs)
+        assert xs.shape[1:] == self._M.shape
+        if len(xs) == 0:
+            return
+        batch_mean = xs.mean(axis=0)
+        batch_sum_square = np.square(xs - batch_mean).sum(axis=0)
+        self._merge_stats(len(xs), batch_mean, batch_sum_square)
+
+    def merge(self, other):
+        # 다른 워커가 따로 모은 RunningStat 을 합침 (other 는 그대로)
+        assert other.shape == self.shape
+        if other.n == 0:
+            return
+        self._merge_stats(other.n, other.mean, other.sum_square)
+
+    def _merge_stats(self, n_b, mean_b, sum_square_b):
+        # Chan et al. 병렬 분산 공식
+        # n = n_a + n_b, δ = M_b - M_a
+        # M = M_a + δ * n_b / n
+        # S = S_a + S_b + δ^2 * n_a * n_b / n
+        n_a = self._n
+        n = n_a + n_b
+        delta = mean_b - self._M
+        self._M += delta * (n_b / n)
+        self._S += sum_square_b + np.square(delta) * (n_a * n_b / n)
+        self._n = n
 
     @property
     def n(self):
@@ -62,21 +102,34 @@ class RunningStat(object):
         return self._M.shape
 
 
-class ZFilter:
+class ZFilter(TorchSerializable):
     """
     y = (x-mean)/std
     using running estimates of mean,std
     """
 
     def __init__(self, shape, demean=True, destd=True, clip=10.0):
+        super().__init__()
+
         self.demean = demean
         self.destd = destd
         self.clip = clip
 
         self.rs = RunningStat(shape)
 
+        # 체크포인트에 정규화 통계도 같이 저장
+        self.register_serializable([
+            'rs',
+        ])
+
     def __call__(self, x, update=True):
-        if update: self.rs.push(x)
+        # x 는 관측 1개 [shape] 또는 환경 여러 개의 관측 [k, shape]
+        x = np.asarray(x)
+        if update:
+            if x.ndim > len(self.rs.shape):
+                self.rs.push_batch(x)
+            else:
+                self.rs.push(x)
         if self.demean:
             x = x - self.rs.mean
         if self.destd:
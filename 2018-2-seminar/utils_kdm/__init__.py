@@ -1,12 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import threading
 from abc import ABCMeta, abstractmethod
 
 import numpy as np
 import torch
 import torch.nn as nn
 
-from utils_kdm.manage_device import ManageDevice
+from utils_kdm.manage_device import ManageDevice, get_device
 
 
 #####################
@@ -49,65 +50,169 @@ class TorchSerializable(object):
 
         return ret
 
+    def _load_variable(self, k, state):
+        variable = getattr(self, k, None)
+        if variable is None:
+            print('load_state_dict(): Skipping not registered variable: {}'.format(k))
+        state_dict_method = getattr(variable, "state_dict", None)
+        if state_dict_method:
+            variable.load_state_dict(state)
+        else:
+            setattr(self, k, state)
+
     def load_state_dict(self, var_state):
         for k in self._registered_variables:
             if k not in var_state:
                 print('load_state_dict(): Skipping not registered variable: {}'.format(k))
                 continue
 
+            self._load_variable(k, var_state[k])
+
+    def state_dict_shards(self, depth, prefix=''):
+        # 등록된 변수 하나당 샤드 하나 = {'agent.algorithm_rl.actor': actor.state_dict(), ...}
+        # depth 만큼만 TorchSerializable 안으로 들어가고, 그 아래는 통째로 한 샤드로 만든다
+        # (Region 트리, 리플레이 메모리 등은 샤드 하나)
+        ret = dict()
+        for k in self._registered_variables:
             variable = getattr(self, k, None)
-            if variable is None:
-                print('load_state_dict(): Skipping not registered variable: {}'.format(k))
-            state_dict_method = getattr(variable, "state_dict", None)
-            if state_dict_method:
-                variable.load_state_dict(var_state[k])
+            key = prefix + k
+            if depth > 1 and isinstance(variable, TorchSerializable):
+                ret.update(variable.state_dict_shards(depth - 1, prefix=key + '.'))
+            else:
+                state_dict_method = getattr(variable, "state_dict", None)
+                ret[key] = variable.state_dict() if state_dict_method else variable
+
+        return ret
+
+    def load_state_dict_shards(self, shards):
+        # 필요한 샤드만 들어 있어도 된다 (예: 평가할 때 'agent.algorithm_rl.actor' 하나만)
+        children = dict()
+        for key, state in shards.items():
+            k, _, rest = key.partition('.')
+            if k not in self._registered_variables:
+                print('load_state_dict_shards(): Skipping not registered variable: {}'.format(k))
+                continue
+
+            if rest:
+                children.setdefault(k, dict())[rest] = state
             else:
-                setattr(self, k, var_state[k])
+                self._load_variable(k, state)
+
+        for k, child_shards in children.items():
+            getattr(self, k).load_state_dict_shards(child_shards)
 
 
 #####################
 # Torch 텐서 관련
 #####################
+# 환경 한 스텝마다 여러 번 불리므로 불필요한 복사/형변환/싱글턴 조회를 하지 않는다
+# - CPU: torch.as_tensor() = 이미 같은 dtype이면 복사 없이 numpy 메모리를 그대로 공유
+#        (그러므로 넘긴 numpy 배열을 나중에 제자리에서 고치면 텐서도 바뀜에 주의)
+# - CUDA: 고정(pinned) 메모리 버퍼에 한 번 복사한 뒤 non_blocking 전송
+class _PinnedStaging(object):
+
+    def __init__(self, ring_size=4):
+        # 전송이 끝나기 전에 같은 버퍼를 덮어쓰지 않도록 shape/dtype 별로 버퍼 여러 개를 돌려 쓴다
+        self.ring_size = ring_size
+        # 버퍼는 스레드마다 따로 (TrainerContext 트레이너 여러 개, DDPG 학습 스레드 등)
+        # 같이 쓰면 두 스레드가 같은 칸을 받아서 전송 전에 서로 덮어쓸 수 있다
+        self._local = threading.local()
+
+    def _get_ring(self, shape, dtype):
+        rings = getattr(self._local, 'rings', None)
+        if rings is None:
+            rings = self._local.rings = dict()
+
+        key = (shape, dtype)
+        ring = rings.get(key)
+        if ring is None:
+            slots = list()
+            for _ in range(self.ring_size):
+                # 기본 텐서 타입이 cuda 여도 버퍼는 반드시 CPU에
+                buffer = torch.empty(shape, dtype=dtype, device='cpu').pin_memory()
+                slots.append([buffer, buffer.numpy(), None])
+            # [버퍼 목록, 다음에 쓸 위치]
+            ring = rings[key] = [slots, 0]
+        return ring
+
+    def transfer(self, item, dtype, device):
+        ring = self._get_ring(item.shape, dtype)
+        slots, index = ring
+        ring[1] = (index + 1) % self.ring_size
+
+        buffer, buffer_np, event = slots[index]
+        if event is not None:
+            # ring_size 번 전에 보낸 전송이 아직 안 끝났으면 대기 (보통은 이미 끝나 있음)
+            event.synchronize()
+
+        # numpy 대입 = 형변환과 복사를 한 번에
+        buffer_np[...] = item
+        tensor = buffer.to(device, non_blocking=True)
+
+        event = torch.cuda.Event()
+        event.record()
+        slots[index][2] = event
+        return tensor
+
+
+_pinned_staging = _PinnedStaging()
+
+
+def _from_np(item, dtype, device):
+    device = device if device else get_device()
+    if device is not None and device.type == 'cuda':
+        return _pinned_staging.transfer(item, dtype, device)
+    return torch.as_tensor(item, dtype=dtype, device=device if device else 'cpu')
+
+
+def _from_scalar(item, dtype, device):
+    device = device if device else get_device()
+    if isinstance(item, torch.Tensor):
+        # 내발적 보상처럼 원소 1개짜리 텐서가 들어오는 경우 (기존처럼 그래프에서 떼어낸 [1] 모양)
+        return item.detach().to(device=device, dtype=dtype).reshape(1)
+    if isinstance(item, np.generic):
+        item = item.item()
+    # torch.full = 값을 커널 인자로 넘기므로 CUDA 에서도 호스트->디바이스 복사가 없다
+    return torch.full((1,), item, dtype=dtype, device=device)
+
+
 def t_uint8(item, device=None):
-    device = device if device else ManageDevice().get()
     if isinstance(item, np.ndarray):
-        return t_from_np_to_uint8(item, device)
+        return _from_np(item, torch.uint8, device)
+    elif isinstance(item, (list, tuple)):
+        return torch.tensor([item], device=device if device else get_device(), dtype=torch.uint8)
     else:
-        return torch.tensor([item], device=device, dtype=torch.uint8)
+        return _from_scalar(item, torch.uint8, device)
 
 
 def t_float32(item, device=None):
-    device = device if device else ManageDevice().get()
     if isinstance(item, np.ndarray):
-        return t_from_np_to_float32(item, device)
+        return _from_np(item, torch.float32, device)
+    elif isinstance(item, (list, tuple)):
+        return torch.tensor([item], device=device if device else get_device(), dtype=torch.float32)
     else:
-        return torch.tensor([item], device=device, dtype=torch.float32)
+        return _from_scalar(item, torch.float32, device)
 
 
 def t_long(item, device=None):
-    device = device if device else ManageDevice().get()
     if isinstance(item, np.ndarray):
-        return t_from_np_to_long(item, device)
+        return _from_np(item, torch.long, device)
+    elif isinstance(item, (list, tuple)):
+        return torch.tensor([item], device=device if device else get_device(), dtype=torch.long)
     else:
-        return torch.tensor([item], device=device, dtype=torch.long)
+        return _from_scalar(item, torch.long, device)
 
 
 def t_from_np_to_uint8(item, device=None):
-    # TODO: torch.as_tensor() 쓰면 복사 안 한다는데?
-    device = device if device else ManageDevice().get()
-    return torch.from_numpy(item).int().to(device)
+    return _from_np(item, torch.uint8, device)
 
 
 def t_from_np_to_float32(item, device=None):
-    # TODO: torch.as_tensor() 쓰면 복사 안 한다는데?
-    device = device if device else ManageDevice().get()
-    return torch.from_numpy(item).float().to(device)
+    return _from_np(item, torch.float32, device)
 
 
 def t_from_np_to_long(item, device=None):
-    # TODO: torch.as_tensor() 쓰면 복사 안 한다는데?
-    device = device if device else ManageDevice().get()
-    return torch.from_numpy(item).long().to(device)
+    return _from_np(item, torch.long, device)
 
 
 def maybe_float(item):
@@ -119,6 +224,38 @@ def maybe_float(item):
     return float(item)
 
 
+def maybe_numpy(item):
+    # 텐서가 들어오면 numpy 로 (원소 1개면 파이썬 숫자), 나머지는 그대로 반환
+    # 내발적 보상 등 텐서가 섞여 들어오는 전이를 numpy 버퍼에 쓸 때 사용
+    if isinstance(item, torch.Tensor):
+        item = item.detach()
+        return item.item() if item.numel() == 1 else item.cpu().numpy()
+    return item
+
+
+def tensor_nbytes(item, seen=None):
+    # 텐서, numpy 배열 (리스트, 튜플, dict 안에 든 것 포함) 이 차지하는 바이트
+    # 같은 저장소를 공유하는 뷰는 한 번만 센다 (저장소 전체 크기로)
+    # 파이썬 객체 자체 (리스트, namedtuple 등) 의 오버헤드는 안 셈
+    if seen is None:
+        seen = set()
+
+    if isinstance(item, torch.Tensor):
+        storage = item.storage()
+        key = (item.device, storage.data_ptr())
+        if key in seen:
+            return 0
+        seen.add(key)
+        return storage.size() * storage.element_size()
+    if isinstance(item, np.ndarray):
+        return item.nbytes
+    if isinstance(item, dict):
+        return sum(tensor_nbytes(v, seen) for v in item.values())
+    if isinstance(item, (list, tuple)):
+        return sum(tensor_nbytes(v, seen) for v in item)
+    return 0
+
+
 #####################
 # Torch 신경망 가중치 초기화 및 조작 관련
 #####################
@@ -130,7 +267,8 @@ def fanin_init(in_tensor):
 
 
 def soft_update_from_to(src_nn, dst_nn, tau=1.0):
-    for target_param, param in zip(dst_nn.parameters(), src_nn.parameters()):
-        target_param.data.copy_(
-            target_param.data * (1.0 - tau) + param.data * tau
-        )
+    # target*(1-tau) + param*tau 를 임시 텐서 없이 제자리에서 계산
+    # 매 스텝 부르는 경우 utils_kdm.target_network.TargetNetworkUpdater 가 더 빠르다
+    with torch.no_grad():
+        for target_param, param in zip(dst_nn.parameters(), src_nn.parameters()):
+            target_param.data.lerp_(param.data, tau)
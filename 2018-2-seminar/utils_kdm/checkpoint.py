@@ -1,20 +1,116 @@
 # -*- coding: utf-8 -*-
 
+import atexit
+import json
 import os
+import queue
 import shutil
+import threading
+from collections import deque
+
+import numpy as np
 import torch
 
 from utils_kdm.trainer_metadata import TrainerMetadata
 
 
+def _snapshot(item, clone=True):
+    # 학습 루프가 계속 돌아가도 저장 내용이 바뀌지 않도록 CPU 쪽으로 복사본을 만든다
+    # state_dict() 안의 텐서(가중치, Optimizer 상태)는 제자리(in-place)로 갱신되므로 반드시 복사
+    # 리스트 안의 텐서(리플레이 메모리 등)는 한 번 넣으면 안 바뀌는 기록이므로 CPU로 옮기기만 한다
+    if isinstance(item, torch.Tensor):
+        item = item.detach()
+        if clone:
+            return item.to('cpu', copy=True)
+        return item.cpu()
+    elif isinstance(item, np.ndarray):
+        return item.copy() if clone else item
+    elif isinstance(item, dict):
+        # OrderedDict, defaultdict 등 타입 유지
+        ret = item.copy()
+        for k, v in item.items():
+            ret[k] = _snapshot(v)
+        return ret
+    elif isinstance(item, tuple) and hasattr(item, '_fields'):
+        # namedtuple
+        return type(item)(*[_snapshot(v, clone=False) for v in item])
+    elif isinstance(item, (list, tuple)):
+        return type(item)(_snapshot(v, clone=False) for v in item)
+    elif isinstance(item, deque):
+        return deque((_snapshot(v, clone=False) for v in item), maxlen=item.maxlen)
+    return item
+
+
+class _AsyncWriter:
+    # 직렬화(torch.save)와 파일 쓰기는 백그라운드 스레드에서 처리
+    # 학습 루프는 CPU 스냅샷만 만들고 바로 돌아간다
+
+    def __init__(self, max_pending=2):
+        self._jobs = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+        self._thread.start()
+        self.last_error = None
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                self._jobs.task_done()
+                break
+            try:
+                func, args = job
+                func(*args)
+            except Exception as e:
+                # 여기서는 출력하고 기록만 해 두고, 메인 스레드가 다음 저장/wait()/close() 때 raise_if_failed() 로 올린다
+                self.last_error = e
+                print('Checkpoint writer error: {}'.format(e))
+            finally:
+                self._jobs.task_done()
+
+    def submit(self, func, *args):
+        # 대기열이 가득 찼으면 (디스크가 학습보다 느림) 여기서 기다린다
+        self._jobs.put((func, args))
+
+    def join(self):
+        self._jobs.join()
+
+    def raise_if_failed(self):
+        # 백그라운드 쓰기가 실패했으면 (디스크 부족, 권한 등) 체크포인트 없이 학습이 계속되지 않도록 에러를 올린다
+        error, self.last_error = self.last_error, None
+        if error is not None:
+            raise RuntimeError('Checkpoint writer failed: {}'.format(error)) from error
+
+    def close(self):
+        if self._thread.is_alive():
+            self._jobs.put(None)
+            self._thread.join()
+
+
 class Checkpoint:
 
-    # TODO: 폴더 없을 때 만들어 주기
-    def __init__(self, version, is_save=True, save_interval=10):
+    def __init__(self, version, is_save=True, save_interval=10, is_async=False,
+                 is_sharded=False, shard_depth=3, keep_last=None, keep_best=None):
         self.version = version
         self.is_save = is_save
         self.save_interval = save_interval
 
+        # 비동기 저장 = 스냅샷만 메인 스레드에서, 직렬화/쓰기는 백그라운드에서
+        self.is_async = is_async
+        self._writer = None
+        if self.is_async:
+            self._writer = _AsyncWriter()
+            atexit.register(self.close)
+
+        # 샤드 저장 = 등록된 변수 하나당 파일 하나 + manifest.json
+        # shard_depth=3 이면 'agent.algorithm_rl.actor' 단위로 나뉜다
+        self.is_sharded = is_sharded
+        self.shard_depth = shard_depth
+
+        # 보존 정책 (None = 전부 보존)
+        # keep_last = 최근 K개 에피소드, keep_best = 점수 높은 K개 에피소드
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+
     def is_saving_episode(self, current_epoch):
         return self.is_save and current_epoch % self.save_interval == 0
 
@@ -23,20 +119,189 @@ class Checkpoint:
         base_name = os.path.basename(os.path.realpath(full_path))
         return dir_path, base_name
 
+    def _get_save_dir(self, full_path):
+        dir_path, base_name = self._split_path_base(full_path)
+        save_dir = '{}/saved_model/{}'.format(dir_path, self.version)
+        os.makedirs(save_dir, exist_ok=True)
+        return save_dir
+
+    def _get_extension(self):
+        # 샤드 저장은 폴더, 통째로 저장은 파일
+        return '' if self.is_sharded else '.pt'
+
     def get_best_model_file_name(self, full_path):
         dir_path, base_name = self._split_path_base(full_path)
-        full_path = '{}/saved_model/{}/{}.best.pt'.format(dir_path, self.version, base_name)
+        full_path = '{}/saved_model/{}/{}.best{}'.format(dir_path, self.version, base_name, self._get_extension())
         return full_path
 
-    def save_checkpoint(self, full_path, var_state, is_best=False):
+    def get_episode_file_name(self, full_path, current_epoch):
         dir_path, base_name = self._split_path_base(full_path)
-        episode_path = "{}/saved_model/{}/{}.ep{}.pt".format(dir_path, self.version, base_name,
-                                                             str(var_state['current_epoch']))
-        var_state['version'] = self.version
-        torch.save(var_state, episode_path)
+        return '{}/{}.ep{}{}'.format(self._get_save_dir(full_path), base_name, str(current_epoch),
+                                     self._get_extension())
+
+    def _get_index_file_name(self, full_path):
+        dir_path, base_name = self._split_path_base(full_path)
+        return '{}/{}.index.json'.format(self._get_save_dir(full_path), base_name)
+
+    @staticmethod
+    def _atomic_save(var_state, path):
+        # 임시 파일에 다 쓴 다음 이름 바꾸기 = 쓰다가 죽어도 반쯤 쓰인 파일이 남지 않는다
+        tmp_path = '{}.tmp'.format(path)
+        torch.save(var_state, tmp_path)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _link_or_copy(src_path, dst_path):
+        # 복사 대신 하드 링크 (같은 파일 시스템이면 디스크 I/O 없음)
+        try:
+            os.link(src_path, dst_path)
+        except OSError:
+            # 하드 링크를 지원하지 않는 파일 시스템
+            shutil.copyfile(src_path, dst_path)
+
+    @staticmethod
+    def _remove(path):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
+
+    def _atomic_link(self, src_path, dst_path):
+        tmp_path = '{}.tmp'.format(dst_path)
+        self._remove(tmp_path)
+        if os.path.isdir(src_path):
+            os.makedirs(tmp_path)
+            for file_name in os.listdir(src_path):
+                self._link_or_copy(os.path.join(src_path, file_name), os.path.join(tmp_path, file_name))
+            # 폴더는 os.replace로 덮어쓸 수 없으므로 먼저 지운다
+            self._remove(dst_path)
+        else:
+            self._link_or_copy(src_path, tmp_path)
+        os.replace(tmp_path, dst_path)
+
+    @staticmethod
+    def _shard_file_name(key):
+        return '{}.pt'.format(key)
+
+    def _atomic_save_shards(self, shards, path, manifest):
+        tmp_path = '{}.tmp'.format(path)
+        self._remove(tmp_path)
+        os.makedirs(tmp_path)
+
+        manifest['shards'] = dict()
+        for key, state in shards.items():
+            file_name = self._shard_file_name(key)
+            torch.save(state, os.path.join(tmp_path, file_name))
+            manifest['shards'][key] = file_name
+
+        with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        self._remove(path)
+        os.replace(tmp_path, path)
+
+    def _update_index(self, full_path, current_epoch, score):
+        index_path = self._get_index_file_name(full_path)
+        index = dict()
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+
+        # JSON 키는 문자열만 가능
+        index[str(current_epoch)] = score
+
+        tmp_path = '{}.tmp'.format(index_path)
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, index_path)
+        return index
+
+    def _apply_retention(self, full_path, index):
+        if self.keep_last is None and self.keep_best is None:
+            return
+
+        epochs = sorted(int(epoch) for epoch in index.keys())
+        keep = set()
+        if self.keep_last is not None:
+            keep.update(epochs[-self.keep_last:] if self.keep_last > 0 else [])
+        if self.keep_best is not None:
+            scored = [epoch for epoch in epochs if index[str(epoch)] is not None]
+            scored.sort(key=lambda epoch: index[str(epoch)], reverse=True)
+            keep.update(scored[:self.keep_best])
+
+        # .best 는 하드 링크라서 원본 에피소드를 지워도 남아 있다
+        for epoch in epochs:
+            if epoch not in keep:
+                self._remove(self.get_episode_file_name(full_path, epoch))
+                del index[str(epoch)]
+
+        index_path = self._get_index_file_name(full_path)
+        tmp_path = '{}.tmp'.format(index_path)
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, index_path)
+
+    def _write(self, full_path, var_state, current_epoch, score, is_best):
+        episode_path = self.get_episode_file_name(full_path, current_epoch)
+        if self.is_sharded:
+            manifest = {
+                'version': self.version,
+                'current_epoch': current_epoch,
+                'score': score,
+            }
+            self._atomic_save_shards(var_state, episode_path, manifest)
+        else:
+            self._atomic_save(var_state, episode_path)
+
         if is_best:
-            shutil.copyfile(episode_path, self.get_best_model_file_name(full_path))
+            self._atomic_link(episode_path, self.get_best_model_file_name(full_path))
+
+        index = self._update_index(full_path, current_epoch, score)
+        self._apply_retention(full_path, index)
+
+    def save_checkpoint(self, full_path, var_state, is_best=False, score=None):
+        # is_sharded 이면 var_state는 TorchSerializable.state_dict_shards()의 결과
+        current_epoch = var_state['current_epoch']
+        if not self.is_sharded:
+            # 샤드 저장은 manifest.json 에 버전을 기록
+            var_state['version'] = self.version
+        score = None if score is None else float(score)
+
+        if self.is_async:
+            self._writer.raise_if_failed()
+            self._writer.submit(self._write, full_path, _snapshot(var_state), current_epoch, score, is_best)
+        else:
+            self._write(full_path, var_state, current_epoch, score, is_best)
+
+    def wait(self):
+        # 아직 쓰고 있는 체크포인트가 있으면 끝날 때까지 대기
+        if self._writer is not None:
+            self._writer.join()
+            self._writer.raise_if_failed()
 
-    def load_model(self, full_path=None, device=None):
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer.raise_if_failed()
+
+    @staticmethod
+    def _is_requested(key, shards):
+        # 'agent.algorithm_rl' 을 요청하면 그 아래 샤드 전부
+        return any(key == shard or key.startswith(shard + '.') for shard in shards)
+
+    def load_model(self, full_path=None, device=None, shards=None):
+        # shards = 불러올 샤드 키 목록 (None 이면 전부), 샤드 저장일 때만 의미 있음
+        self.wait()
         device = device if device else TrainerMetadata().device
-        return torch.load(full_path, map_location=device)
+        if not os.path.isdir(full_path):
+            return torch.load(full_path, map_location=device)
+
+        with open(os.path.join(full_path, 'manifest.json')) as f:
+            manifest = json.load(f)
+
+        var_state = dict()
+        for key, file_name in manifest['shards'].items():
+            if shards is None or self._is_requested(key, shards):
+                var_state[key] = torch.load(os.path.join(full_path, file_name), map_location=device)
+
+        return var_state
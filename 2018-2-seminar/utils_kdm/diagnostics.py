@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+
+import torch
+
+from utils_kdm.manage_device import get_device
+from utils_kdm.trainer_metadata import TrainerMetadata
+
+
+class Diagnostics(object):
+    # 학습 안쪽 루프(미니배치, 라인 서치)의 지표를 모아 뒀다가 한 번에 TrainerMetadata 로 넘기기
+    #
+    # TrainerMetadata().log() 는 부를 때마다 .item() 으로 GPU 동기화가 생긴다
+    # 대신 디바이스 텐서 그대로 모아 두고, flush() 에서 지표별 (마지막, 최대, 최소) 를 디바이스 위에서 구한 뒤
+    # 전체를 한 번에 호스트로 가져온다 (동기화 1번)
+    #
+    # level
+    #   0 = 끔 (record() 가 아무 것도 안 함)
+    #   1 = 업데이트/epoch 단위 지표 (손실, KL 등)
+    #   2 = 미니배치 단위 상세 지표까지 (정책 비율 최대/최소 등)
+    OFF, BASIC, VERBOSE = 0, 1, 2
+
+    def __init__(self, level=VERBOSE, device=None, metadata=None):
+        self.level = level
+        self.device = device if device else get_device()
+        # 기록할 TrainerMetadata (TrainerContext 마다 따로, None 이면 싱글턴)
+        self.metadata = metadata
+        # (indicator, variable) -> [값 목록, compute_maxmin]
+        self._records = OrderedDict()
+
+    def is_enabled(self, level=BASIC):
+        return self.level >= level
+
+    def record(self, value, indicator, variable='default_var', compute_maxmin=False, level=BASIC):
+        if self.level < level:
+            return
+
+        if isinstance(value, torch.Tensor):
+            # 그래프를 붙잡고 있지 않도록 떼어 둔다 (동기화는 없음)
+            value = value.detach().reshape(-1)[0]
+        else:
+            value = float(value)
+
+        key = (indicator, variable)
+        if key not in self._records:
+            self._records[key] = [list(), compute_maxmin]
+        self._records[key][0].append(value)
+
+    def flush(self):
+        if not self._records:
+            return
+
+        stats = list()
+        for values, _ in self._records.values():
+            if isinstance(values[0], torch.Tensor):
+                sequence = torch.stack([v.to(device=self.device, dtype=torch.float32) for v in values])
+            else:
+                sequence = torch.tensor(values, dtype=torch.float32, device=self.device)
+            stats.append(torch.stack([sequence[-1], sequence.max(), sequence.min()]))
+
+        # 지표 전체를 호스트로 한 번에
+        stats = torch.stack(stats).tolist()
+
+        metadata = self.metadata if self.metadata is not None else TrainerMetadata()
+        for ((indicator, variable), (_, compute_maxmin)), (last, maximum, minimum) in zip(self._records.items(), stats):
+            metadata.log_reduced(last, maximum, minimum, indicator, variable, compute_maxmin=compute_maxmin)
+
+        self._records.clear()
+
+    def clear(self):
+        self._records.clear()
@@ -55,3 +55,16 @@ class Drawer:
 
             win = self._abbreviate_win_name(env, win)
             self.viz.line(X=np.array([x]), Y=np.array([y]), name=variable, win=win, update='append', opts={'title': win})
+
+
+class NullDrawer:
+    # 그리지 않는 Drawer (스윕 워커 등 visdom 서버 없이 돌릴 때)
+
+    def __init__(self, env='main'):
+        self.default_env = env
+
+    def set_visdom_order(self, env, visdom_order):
+        pass
+
+    def draw_line(self, y, x=None, x_auto_increment=None, interval=None, env=None, win=None, variable=None):
+        pass
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import multiprocessing
+from collections import namedtuple
+
+import numpy as np
+import torch
+
+import utils_kdm as u
+from utils_kdm.trainer_context import resolve_context
+from utils_kdm.trainer_metadata import TrainerMetadata
+
+# 평가용 정책 스냅샷 (워커 프로세스로 넘어가므로 CPU 텐서만)
+# module_class(*module_args) 로 정책망을 다시 만들고 state_dict 를 불러온다
+# mode
+#   'deterministic' = 정책망 출력 그대로 (DDPG, 노이즈 없이)
+#   'gaussian_mean' = 정규분포 평균 (TRPO, PPO)
+#   'greedy'        = 출력 argmax (DQN 큐함수, A2C 행동 확률)
+EvaluationPolicy = namedtuple('EvaluationPolicy', ('module_class', 'module_args', 'state_dict', 'mode'))
+
+
+def snapshot_policy(module, module_class, module_args, mode):
+    # 학습이 계속 가중치를 고쳐도 평가 내용이 안 바뀌도록 CPU 복사본
+    state_dict = {k: v.detach().to('cpu', copy=True) for k, v in module.state_dict().items()}
+    return EvaluationPolicy(module_class, module_args, state_dict, mode)
+
+
+def snapshot_normalization(running_state):
+    # 학습 환경의 상태 정규화 (ZFilter, SharedNormalizer) 를 고정된 (평균, 표준편차, clip) 으로
+    if running_state is None:
+        return None
+    stat = getattr(running_state, 'rs', running_state)
+    return np.array(stat.mean, copy=True), np.array(stat.std, copy=True), running_state.clip
+
+
+def _select_action(module, state, mode):
+    with torch.no_grad():
+        output = module(u.t_from_np_to_float32(state))
+        if mode == 'gaussian_mean':
+            return output[0].cpu().numpy()
+        if mode == 'greedy':
+            return output.argmax(-1).item()
+        return output.cpu().numpy()
+
+
+def _run_episode(env_id, policy, seed, normalization):
+    # 워커 프로세스에서 실행 (spawn 이라 모듈 전역 상태 없이 시작)
+    # 평가는 작은 정책망 1개라서 CPU 로
+    # gym 은 워커에서만 필요 (알고리즘 모듈이 gym 없이도 import 되도록)
+    import gym
+    from utils_kdm.synthetic_env import maybe_register
+
+    TrainerMetadata().set_device(force_cpu=True)
+    torch.set_num_threads(1)
+
+    module = policy.module_class(*policy.module_args)
+    module.load_state_dict(policy.state_dict)
+    module.eval()
+
+    # 가짜 환경 (SyntheticSwimmer-v0 등) 은 워커에서도 등록해야 만들 수 있다
+    maybe_register(env_id)
+    env = gym.make(env_id)
+    if seed is not None:
+        env.seed(seed)
+
+    def _normalize(x):
+        if normalization is None:
+            return x
+        mean, std, clip = normalization
+        x = (x - mean) / (std + 1e-8)
+        return np.clip(x, -clip, clip) if clip else x
+
+    state = _normalize(env.reset())
+    score = 0.0
+    for _ in range(env.spec.max_episode_steps):
+        state, reward, done, _ = env.step(_select_action(module, state, policy.mode))
+        state = _normalize(state)
+        score += reward
+        if done:
+            break
+    env.close()
+    return score
+
+
+def _run_episode_star(args):
+    return _run_episode(*args)
+
+
+class AsyncEvaluator:
+    # 일정 간격마다 정책망 스냅샷으로 노이즈 없이 K 에피소드 평가 (학습과 겹쳐서)
+    #
+    # 평가 에피소드는 프로세스 풀 (spawn, 워커마다 자기 환경) 에서 돌고
+    # 메인 스레드는 submit() 으로 던지고 바로 돌아간다
+    # 결과는 poll() 에서 끝난 것만 TrainerMetadata 로 기록 (기다리지 않음)
+    #   'eval_score' 지표: mean / max / min
+    # 아직 안 끝난 평가가 max_pending 개면 이번 평가는 건너뛴다 (학습을 멈추지 않음)
+    def __init__(self, env_id, interval=10, episodes=5, num_workers=2, seed=None, max_pending=1, context=None):
+        self.context = resolve_context(context)
+        self.env_id = env_id
+        self.interval = interval
+        self.episodes = episodes
+        self.seed = seed
+        self.max_pending = max_pending
+
+        # fork 는 CUDA, 스레드 (학습 스레드, 체크포인트 쓰기) 와 같이 쓰면 위험하므로 spawn
+        self._pool = multiprocessing.get_context('spawn').Pool(num_workers)
+        # (평가 시작 에피소드, AsyncResult)
+        self._pending = list()
+        self.last_error = None
+        self.last_result = None
+
+        atexit.register(self.close)
+
+    def is_evaluating_episode(self, i_episode):
+        return self.interval > 0 and i_episode % self.interval == 0
+
+    def submit(self, i_episode, policy, normalization=None):
+        # policy = EvaluationPolicy (알고리즘의 evaluation_policy())
+        if len(self._pending) >= self.max_pending:
+            return False
+
+        tasks = list()
+        for k in range(self.episodes):
+            seed = None if self.seed is None else self.seed + i_episode * self.episodes + k
+            tasks.append((self.env_id, policy, seed, normalization))
+        self._pending.append((i_episode, self._pool.map_async(_run_episode_star, tasks)))
+        return True
+
+    def maybe_submit(self, i_episode, policy_func, normalization_func=None):
+        # 평가할 에피소드이고 자리가 있을 때만 스냅샷을 만든다 (스냅샷도 공짜가 아니므로)
+        if not self.is_evaluating_episode(i_episode) or len(self._pending) >= self.max_pending:
+            return False
+        normalization = normalization_func() if normalization_func is not None else None
+        return self.submit(i_episode, policy_func(), normalization)
+
+    def poll(self):
+        # 끝난 평가만 기록 (메인 스레드에서, finish_episode() 전에 부를 것)
+        still_pending = list()
+        for i_episode, result in self._pending:
+            if not result.ready():
+                still_pending.append((i_episode, result))
+                continue
+
+            try:
+                scores = result.get()
+            except Exception as e:
+                # 평가가 실패해도 학습은 계속
+                self.last_error = e
+                print('Evaluation error: {}'.format(e))
+                continue
+
+            self.last_result = (i_episode, scores)
+            self.context.metadata.log(float(np.mean(scores)), 'eval_score', 'mean')
+            self.context.metadata.log(float(np.max(scores)), 'eval_score', 'max')
+            self.context.metadata.log(float(np.min(scores)), 'eval_score', 'min')
+            self.context.metadata.console_log('Eval', '{:.2f} (ep {})'.format(float(np.mean(scores)), i_episode))
+        self._pending = still_pending
+
+    def wait(self):
+        # 남은 평가를 전부 기다린 뒤 기록
+        for _, result in self._pending:
+            result.wait()
+        self.poll()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
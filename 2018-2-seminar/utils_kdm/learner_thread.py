@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import threading
+from contextlib import contextmanager
+
+
+class LearnerThread:
+    # 학습(그라디언트) 스텝을 백그라운드 스레드에서 돌린다
+    # 메인 스레드는 환경 스텝마다 request_updates(n) 으로 학습 스텝 n개를 맡기고 바로 돌아간다
+    # -> 환경 스텝(시뮬레이터)과 학습 스텝(GPU/BLAS)이 겹쳐서 돌아감
+    #
+    # update_func 는 self.lock 을 잡은 채로 호출된다
+    # 리플레이 메모리에 넣기, 체크포인트 저장 등 학습 중에 건드리면 안 되는 일은 같은 lock 을 잡고 한다 (paused())
+
+    def __init__(self, update_func, max_pending_updates=1000, name='learner'):
+        self.update_func = update_func
+        # 학습이 환경보다 느릴 때 밀린 학습 스텝이 이만큼 넘으면 request_updates() 에서 기다린다
+        # (update-to-data ratio 가 한없이 낮아지는 것 방지)
+        self.max_pending_updates = max_pending_updates
+
+        self.lock = threading.RLock()
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._stopped = False
+
+        self.update_count = 0
+        self.last_error = None
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending == 0 and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    break
+                self._pending -= 1
+
+            try:
+                with self.lock:
+                    self.update_func()
+                    self.update_count += 1
+            except Exception as e:
+                # 메인 스레드의 다음 request_updates() 에서 다시 던진다
+                self.last_error = e
+                with self._cond:
+                    self._stopped = True
+                    self._cond.notify_all()
+                break
+
+            with self._cond:
+                self._cond.notify_all()
+
+    def request_updates(self, n=1):
+        with self._cond:
+            if self.last_error is not None:
+                raise RuntimeError('Learner thread stopped') from self.last_error
+
+            self._pending += n
+            self._cond.notify_all()
+            while self._pending > self.max_pending_updates and not self._stopped:
+                self._cond.wait()
+
+    def wait(self):
+        # 맡긴 학습 스텝이 전부 끝날 때까지 대기
+        with self._cond:
+            while self._pending > 0 and not self._stopped:
+                self._cond.wait()
+        # 마지막 스텝이 아직 lock 안에서 돌고 있을 수 있다
+        with self.lock:
+            pass
+
+    @contextmanager
+    def paused(self):
+        # 진행 중인 학습 스텝이 끝나면 멈추고, with 블록이 끝나면 다시 시작
+        with self.lock:
+            yield
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
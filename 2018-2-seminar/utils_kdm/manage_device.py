@@ -1,10 +1,35 @@
 # -*- coding: utf-8 -*-
 
 # noinspection PyMethodParameters
+import threading
+from contextlib import contextmanager
+
 import torch
 
 from utils_kdm.singleton import Singleton
 
+# 매 텐서 변환마다 ManageDevice() 싱글턴 조회를 하지 않도록 모듈 변수로 캐시
+_current_device = None
+# 스레드별로 덮어쓴 디바이스 (TrainerContext.activate())
+_local = threading.local()
+
+
+def get_device():
+    device = getattr(_local, 'device', None)
+    return device if device is not None else _current_device
+
+
+@contextmanager
+def device_scope(device):
+    # 이 스레드에서 디바이스를 안 주고 만드는 텐서 (u.t_float32() 등) 를 device 로
+    # None 이면 기존 (프로세스 전체) 디바이스 그대로
+    previous = getattr(_local, 'device', None)
+    _local.device = device
+    try:
+        yield
+    finally:
+        _local.device = previous
+
 
 # noinspection PyMethodParameters
 class ManageDevice(Singleton):
@@ -21,7 +46,8 @@ class ManageDevice(Singleton):
         return cls.device
 
     def set(cls, force_cpu=False, call_from=''):
-        if call_from is not 'TrainerMetadata':
+        global _current_device
+        if call_from != 'TrainerMetadata':
             print("TODO: 중요: 설정하는 주체가 TrainerMetadata 인지 확인하는 코드 넣기")
         if force_cpu or not torch.cuda.is_available():
             cls.device = torch.device('cpu')
@@ -29,3 +55,4 @@ class ManageDevice(Singleton):
         else:
             cls.device = torch.device('cuda:0')
             torch.set_default_tensor_type(torch.cuda.FloatTensor)
+        _current_device = cls.device
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+import os
+import resource
+from collections import OrderedDict
+
+import torch
+
+from utils_kdm.trainer_context import resolve_context
+
+
+def process_rss_bytes():
+    # 현재 RSS (리눅스 /proc), 없으면 최대 RSS (resource, 리눅스는 KB, macOS 는 바이트)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+class MemoryMonitor(object):
+    # 오래 돌리는 학습 (DDPG + LPM 등) 에서 구성 요소별 메모리 기록 + 예산 넘으면 경고
+    #
+    # 기본으로 재는 것
+    #   - rss_bytes              = 프로세스 RSS
+    #   - cuda_*_bytes           = CUDA 할당기 (allocated, max_allocated, cached)
+    #   - indicator_values       = TrainerMetadata.indicators 에 쌓인 값 개수 (+ 가장 긴 지표 길이)
+    # watch_agent() 로 추가
+    #   - memory_bytes           = 리플레이 메모리 / rollout 버퍼 (nbytes())
+    #   - regions, leaf_regions, exemplars, exemplar_bytes = 지역 트리 (LPM, FM)
+    # 그 외는 watch(이름, 함수) 로 직접
+    #
+    # 기록은 TrainerMetadata 의 'memory' 지표 (변수 = 이름) 로 (체크포인트에 남고, visdom 에는 안 그림)
+    # budgets = {이름: 최대값} 을 넘으면 처음 한 번만 경고 (다시 밑으로 내려가면 다시 경고 가능)
+    #
+    # 사용법 (finish_episode() 전에)
+    #   monitor = MemoryMonitor(interval=10, budgets={'rss_bytes': 8 * 2 ** 30, 'exemplars': 10 ** 6})
+    #   monitor.watch_agent(agent)
+    #   ...
+    #   monitor.maybe_report(i_episode)
+    #   TrainerMetadata().finish_episode(i_episode)
+    def __init__(self, interval=10, budgets=None, context=None):
+        self.context = resolve_context(context)
+        self.interval = interval
+        self.budgets = dict(budgets) if budgets else dict()
+
+        # 이름 -> 값 (숫자) 을 돌려주는 함수
+        self.probes = OrderedDict()
+        self._over_budget = set()
+        self.last_stats = None
+
+    def watch(self, name, func, budget=None):
+        self.probes[name] = func
+        if budget is not None:
+            self.budgets[name] = budget
+
+    def watch_agent(self, agent):
+        # runner 의 RLAgent (algorithm_rl, algorithm_im) 또는 알고리즘 하나
+        algorithm_rl = getattr(agent, 'algorithm_rl', agent)
+        memory = getattr(algorithm_rl, 'memory', None)
+        if memory is not None and hasattr(memory, 'nbytes'):
+            self.watch('memory_bytes', memory.nbytes)
+            self.watch('memory_len', lambda: len(memory))
+
+        algorithm_im = getattr(agent, 'algorithm_im', None)
+        region_manager = getattr(algorithm_im, 'region_manager', None)
+        if region_manager is not None:
+            # 트리를 한 번만 훑도록 네 값을 같이 구해 둔다
+            cache = dict()
+
+            def _region_stat(index):
+                def _probe():
+                    if index == 0 or 'stats' not in cache:
+                        cache['stats'] = region_manager.memory_stats()
+                    return cache['stats'][index]
+                return _probe
+
+            self.watch('regions', _region_stat(0))
+            self.watch('leaf_regions', _region_stat(1))
+            self.watch('exemplars', _region_stat(2))
+            self.watch('exemplar_bytes', _region_stat(3))
+
+    def collect(self):
+        stats = OrderedDict()
+        for name, func in self.probes.items():
+            stats[name] = func()
+
+        lengths = self.context.metadata.indicator_lengths()
+        stats['indicator_values'] = sum(lengths.values())
+        stats['indicator_max_len'] = max(lengths.values()) if lengths else 0
+
+        stats['rss_bytes'] = process_rss_bytes()
+        device = torch.device(self.context.device)
+        if device.type == 'cuda':
+            stats['cuda_allocated_bytes'] = torch.cuda.memory_allocated(device)
+            stats['cuda_max_allocated_bytes'] = torch.cuda.max_memory_allocated(device)
+            stats['cuda_cached_bytes'] = torch.cuda.memory_cached(device)
+        return stats
+
+    def is_reporting_episode(self, i_episode):
+        return self.interval > 0 and i_episode % self.interval == 0
+
+    def maybe_report(self, i_episode):
+        if not self.is_reporting_episode(i_episode):
+            return None
+        return self.report(i_episode)
+
+    def report(self, i_episode=None):
+        stats = self.collect()
+        metadata = self.context.metadata
+        for name, value in stats.items():
+            metadata.log(value, 'memory', name)
+        metadata.console_log('RSS', '{:.0f}MB'.format(stats['rss_bytes'] / 2 ** 20))
+
+        self._check_budgets(stats, i_episode)
+        self.last_stats = stats
+        return stats
+
+    def _check_budgets(self, stats, i_episode):
+        for name, budget in self.budgets.items():
+            if name not in stats:
+                continue
+            if stats[name] > budget:
+                if name not in self._over_budget:
+                    self._over_budget.add(name)
+                    print('Memory budget exceeded (ep {}): {} = {} > {}'.format(i_episode, name, stats[name], budget))
+            else:
+                self._over_budget.discard(name)
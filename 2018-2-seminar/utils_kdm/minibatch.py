@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import torch
+
+
+class MinibatchSampler(object):
+    # 한 번 모은 배치를 epoch 마다 섞어서 미니배치로 나눠 주기 (PPO 학습, TRPO 평가망 학습)
+    #
+    # numpy arange 를 섞고 미니배치마다 u.t_long() 으로 인덱스 텐서를 만들면
+    # 미니배치 하나당 호스트->디바이스 복사 1번 + 새 텐서 할당이 생긴다
+    # 대신
+    #   - 순열은 epoch 마다 디바이스 위에서 randperm 1번 (미리 할당한 버퍼에)
+    #   - 미니배치 인덱스는 그 순열의 슬라이스 (뷰, 복사 없음)
+    #   - 미니배치 텐서는 미리 할당한 버퍼에 index_select(out=) 로 채움
+    #
+    # 주의: 돌려주는 미니배치 텐서는 다음 미니배치에서 덮어쓴다 (backward 가 끝난 뒤에 다음으로 넘어갈 것)
+    #
+    # 사용법
+    #   sampler = MinibatchSampler([s_batch, a_batch], batch_size=64)
+    #   for epoch in range(num_epochs):
+    #       for batch_index, (sampled_s_batch, sampled_a_batch) in sampler:
+    #           ...
+    def __init__(self, tensors, batch_size, device=None):
+        # 미니배치는 학습 대상이 아니므로 그래프에서 떼어 둔다 (out= 은 autograd 를 지원하지 않음)
+        self.tensors = [tensor.detach() for tensor in tensors]
+        self.batch_size = batch_size
+        self.device = device if device else self.tensors[0].device
+
+        self.n = len(self.tensors[0])
+        assert all(len(tensor) == self.n for tensor in self.tensors)
+        # 기존처럼 마지막 자투리 미니배치는 버린다
+        self.num_batches = self.n // self.batch_size
+
+        self.permutation = torch.empty(self.n, dtype=torch.long, device=self.device)
+        self.buffers = [torch.empty((self.batch_size,) + tuple(tensor.shape[1:]),
+                                    dtype=tensor.dtype, device=tensor.device)
+                        for tensor in self.tensors]
+
+    def __len__(self):
+        return self.num_batches
+
+    def __iter__(self):
+        torch.randperm(self.n, out=self.permutation)
+
+        for i in range(self.num_batches):
+            batch_index = self.permutation[self.batch_size * i: self.batch_size * (i + 1)]
+            for tensor, buffer in zip(self.tensors, self.buffers):
+                torch.index_select(tensor, 0, batch_index, out=buffer)
+            yield batch_index, self.buffers
@@ -11,9 +11,12 @@ from utils_ext.running_state import ZFilter
 # 실험해보니 안 써도 학습은 되지만 엄청 느려진다 (TRPO)
 class NormalizedMujocoEnv(TimeLimit):
 
-    def __init__(self, env, state_size, clip, max_episode_seconds=None, max_episode_steps=None):
+    # normalizer 를 주면 (SharedNormalizer 등) 환경마다 ZFilter 를 따로 두지 않고 그걸로 정규화
+    def __init__(self, env, state_size, clip, max_episode_seconds=None, max_episode_steps=None, normalizer=None):
         super().__init__(env, max_episode_seconds, max_episode_steps)
-        self.running_state = ZFilter((state_size,), clip=clip)
+        if normalizer is None:
+            normalizer = ZFilter((state_size,), clip=clip)
+        self.running_state = normalizer
 
     def reset(self):
         state = super().reset()
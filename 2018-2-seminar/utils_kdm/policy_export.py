@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import math
+
+import torch
+import torch.nn as nn
+
+
+# 행동 선택용 정책망 내보내기 (TorchScript trace)
+#
+# get_action() 은 정책망 forward 후 샘플링/노이즈/자르기/argmax 를 파이썬(또는 numpy)에서 따로 한다
+# 대신 정책망 + 후처리를 감싼 모듈을 torch.jit.trace 로 그래프 하나로 만들어서
+#   - 파이썬 모듈 호출 오버헤드 없이 한 번 실행
+#   - 출력은 텐서 하나로 묶어서 호스트로는 한 번 복사
+#   - save_policy() 로 파이썬 클래스 정의 없이 읽을 수 있는 파일로 저장 (torch.jit.load 또는 load_policy())
+#
+# trace 된 모듈은 원본 정책망의 파라미터를 그대로 공유하므로 학습 (옵티마이저의 제자리 갱신) 이 바로 반영된다
+# 주의: 입력은 상태 1개 ([state_size]) 기준으로 trace 한다
+
+
+class GaussianPolicyExport(nn.Module):
+    # TRPO, PPO: 정규분포 정책
+    # 출력 = [행동, log 확률, 평균, log 표준편차, (가치 추정)] 을 이어 붙인 벡터 (get_action() 의 packed 와 같은 배치)
+    def __init__(self, actor, critic=None):
+        super().__init__()
+        self.actor = actor
+        self.critic = critic
+
+    def forward(self, state):
+        meow, logstd, std = self.actor(state)
+        action = meow + std * torch.randn_like(meow)
+        log_prob = (-(action - meow).pow(2) / (2 * std.pow(2)) - 0.5 * math.log(2 * math.pi) - logstd).sum(-1, keepdim=True)
+
+        outputs = [action, log_prob, meow, logstd]
+        if self.critic is not None:
+            outputs.append(self.critic(state).view(-1))
+        return torch.cat(outputs)
+
+
+class DeterministicPolicyExport(nn.Module):
+    # DDPG: 결정적 정책 + 탐험 노이즈 + 자르기
+    # 입력 = [상태, 노이즈] 를 이어 붙인 벡터 (호스트->디바이스 복사 1번)
+    # 오른스타인-우렌벡 노이즈는 시간 상관이 있는 상태를 가지므로 바깥에서 뽑아서 넘겨준다
+    def __init__(self, actor, state_size, action_low, action_high):
+        super().__init__()
+        self.actor = actor
+        self.state_size = state_size
+        self.action_low, self.action_high = float(action_low), float(action_high)
+
+    def forward(self, state_with_noise):
+        state, noise = state_with_noise[:self.state_size], state_with_noise[self.state_size:]
+        return torch.clamp(self.actor(state) + noise, min=self.action_low, max=self.action_high)
+
+
+class CategoricalPolicyExport(nn.Module):
+    # A2C: 행동 확률에서 샘플링 (누적 확률 역변환)
+    def __init__(self, actor):
+        super().__init__()
+        self.actor = actor
+
+    def forward(self, state):
+        probs = self.actor(state)
+        uniform = torch.rand_like(probs[..., :1])
+        index = (probs.cumsum(-1) < uniform).sum(-1)
+        # 반올림 오차로 누적 확률 끝이 1보다 조금 작을 때
+        return torch.clamp(index, max=probs.size(-1) - 1)
+
+
+class GreedyPolicyExport(nn.Module):
+    # DQN: 큐함수 argmax (ε-탐험은 정책망을 안 거치므로 바깥에서)
+    def __init__(self, policy):
+        super().__init__()
+        self.policy = policy
+
+    def forward(self, state):
+        return self.policy(state).argmax(-1)
+
+
+def trace_policy(module, example_input):
+    # 샘플링 노이즈 때문에 trace 검사 (같은 입력 -> 같은 출력) 는 끈다
+    with torch.no_grad():
+        return torch.jit.trace(module, example_input, check_trace=False)
+
+
+def save_policy(traced, path):
+    traced.save(path)
+
+
+def load_policy(path, device=None):
+    return torch.jit.load(path, map_location=device)
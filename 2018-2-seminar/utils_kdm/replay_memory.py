@@ -3,15 +3,21 @@
 import random
 from collections import namedtuple
 
-from utils_kdm import TorchSerializable
+import numpy as np
+import torch
+
+from utils_kdm import TorchSerializable, tensor_nbytes
+from utils_kdm.manage_device import get_device
 
 
 class ReplayMemory(TorchSerializable):
     # TODO: 주석 달기
-    def __init__(self, capacity, structure=None):
+    # rng = 샘플링용 random.Random (SeedManager.python_rng()), 없으면 전역 random 모듈
+    def __init__(self, capacity, structure=None, rng=None):
         super().__init__()
 
         self.capacity = capacity
+        self.rng = rng if rng is not None else random
         self.memory = []
         self.position = 0
         self.structure = structure if structure else self._default_structure()
@@ -31,8 +37,113 @@ class ReplayMemory(TorchSerializable):
         self.memory[self.position] = self.structure(*args)
         self.position = (self.position + 1) % self.capacity
 
+    def push_batch(self, *args):
+        # TransitionStaging 에서 청크 단위로 넘어온 필드별 배치를 한 줄씩 저장 (각 줄은 청크 텐서의 뷰)
+        for row in zip(*args):
+            self.push(*row)
+
     def sample(self, batch_size):
-        return random.sample(self.memory, min(len(self.memory), batch_size))
+        return self.rng.sample(self.memory, min(len(self.memory), batch_size))
+
+    def nbytes(self):
+        # 전이마다 텐서 객체라서 (같은 청크의 뷰는 한 번만) 전부 훑는다 = 느림, 자주 부르지 말 것
+        return tensor_nbytes(self.memory)
 
     def __len__(self):
         return len(self.memory)
+
+
+class ColumnarReplayMemory(TorchSerializable):
+    # 필드별로 [capacity, 필드 크기] 텐서를 디바이스에 미리 할당해 두는 순환 버퍼
+    # - push_batch = 필드당 슬라이스 복사 1~2번
+    # - sample = 인덱스 뽑기 1번 + 필드당 index_select 1번 (리스트 zip, torch.stack 없음)
+    # - 반환값은 structure(필드별 [batch_size, 필드 크기] 텐서)
+    # - generator = 인덱스 샘플링용 CPU torch.Generator (SeedManager.torch_generator()), 없으면 디바이스 전역 난수
+
+    # 버퍼 크기가 batch_size 의 이 배수 이하면 중복 없이 (randperm), 그보다 크면 중복 허용 (randint)
+    UNIQUE_SAMPLE_RATIO = 64
+
+    def __init__(self, capacity, field_sizes, field_dtypes, structure=None, device=None, generator=None):
+        super().__init__()
+
+        self.capacity = capacity
+        self.structure = structure if structure else self._default_structure()
+        self.device = device if device else get_device()
+        self.generator = generator
+        assert len(self.structure._fields) == len(field_sizes) == len(field_dtypes)
+
+        # dict 로 들고 있어야 체크포인트 스냅샷 때 복사된다 (제자리에서 계속 바뀌므로)
+        self.columns = dict()
+        for name, size, dtype in zip(self.structure._fields, field_sizes, field_dtypes):
+            self.columns[name] = torch.zeros((capacity, size), dtype=dtype, device=self.device)
+
+        self.position = 0
+        self.size = 0
+
+        self.register_serializable([
+            'capacity',
+            'columns',
+            'position',
+            'size',
+        ])
+
+    def _default_structure(self):
+        return namedtuple('Transition', ('state', 'action', 'reward', 'next_state', 'done'))
+
+    def _column_list(self):
+        return [self.columns[name] for name in self.structure._fields]
+
+    def push(self, *args):
+        # 한 줄씩 넣는 느린 경로 (TransitionStaging 안 쓸 때)
+        for column, value in zip(self._column_list(), args):
+            if not isinstance(value, torch.Tensor):
+                value = torch.as_tensor(np.asarray(value).reshape(-1), device='cpu')
+            column[self.position].copy_(value.reshape(-1))
+
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def push_batch(self, *args):
+        n = len(args[0])
+        assert n <= self.capacity
+
+        # 끝에 닿으면 앞으로 돌아가서 나머지를 쓴다
+        first = min(n, self.capacity - self.position)
+        for column, batch in zip(self._column_list(), args):
+            batch = batch.to(device=column.device, dtype=column.dtype)
+            column[self.position:self.position + first].copy_(batch[:first])
+            if first < n:
+                column[:n - first].copy_(batch[first:])
+
+        self.position = (self.position + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def sample(self, batch_size):
+        # 버퍼가 작을 때는 random.sample 처럼 중복 없이 (디바이스 위에서 끝남)
+        # 버퍼가 크면 randperm 이 O(size) 라서 중복 허용 randint 로 (중복 비율 약 batch_size / (2 * size) 로 무시할 만함)
+        if batch_size > self.size:
+            raise ValueError('Sample larger than population: {} > {}'.format(batch_size, self.size))
+
+        if self.generator is None:
+            kwargs = {'device': self.device}
+        else:
+            # CUDA 용 Generator 는 따로 못 만들어서 CPU 에서 뽑고 옮긴다 (인덱스 batch_size 개 복사 1번)
+            # device 를 꼭 줘야 한다 (기본 텐서 타입이 cuda 면 CUDA 텐서를 CPU Generator 로 뽑으려다 에러)
+            kwargs = {'generator': self.generator, 'device': 'cpu'}
+
+        if self.size <= batch_size * self.UNIQUE_SAMPLE_RATIO:
+            indices = torch.randperm(self.size, dtype=torch.long, **kwargs)[:batch_size]
+        else:
+            indices = torch.randint(0, self.size, (batch_size,), dtype=torch.long, **kwargs)
+        columns = self._column_list()
+        if indices.device != columns[0].device:
+            # 고정 (pinned) 메모리여야 non_blocking 전송이 실제로 비동기 (torch 의 고정 메모리 캐시에서 재사용)
+            indices = indices.pin_memory().to(columns[0].device, non_blocking=True)
+        return self.structure(*[column.index_select(0, indices) for column in columns])
+
+    def nbytes(self):
+        # 미리 할당한 용량 전체 (채운 만큼이 아님)
+        return tensor_nbytes(self.columns)
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import torch
+
+import utils_kdm as u
+from utils_kdm.manage_device import get_device
+
+
+class RolloutBuffer(object):
+    # on-policy 알고리즘 (TRPO, PPO) 용 한 epoch 분량 전이 버퍼
+    #
+    # Transition 리스트에 원소 1개짜리 텐서를 쌓고 학습 때 필드마다 torch.stack 하는 대신
+    #   - [steps, num_envs, 필드 크기] 버퍼를 미리 할당해 두고 스텝마다 제자리에 쓴다
+    #   - 필드들은 평탄한 버퍼 하나 안에 필드별로 연속되게 배치 (필드 순서대로 [steps, num_envs, 크기] 영역)
+    #   - get() 은 버퍼 전체를 디바이스로 한 번에 보내고 필드별 연속 뷰를 structure 로 묶어서 반환
+    #     (GAE 는 [T, N, 1] 뷰로 시간 축을 따라 환경 N개를 한꺼번에, 학습은 reshape(-1, 크기) 뷰로)
+    #
+    # 환경 여러 개: push() 의 각 필드는 환경 N개 분량 ([N, 크기]), 환경 1개면 [크기] 나 숫자도 됨
+    # 에피소드 중간에 epoch 가 끝나도 됨: get() 은 지금까지 쓴 스텝 [:t] 만 반환
+    #
+    # 주의: get() 이 반환한 뷰는 다음 epoch 의 get() 에서 덮어쓴다
+    def __init__(self, steps, num_envs, field_sizes, structure, device=None):
+        assert len(structure._fields) == len(field_sizes)
+
+        self.steps = steps
+        self.num_envs = num_envs
+        self.field_sizes = list(field_sizes)
+        self.structure = structure
+        self.device = device if device else get_device()
+
+        # 필드 i 는 평탄한 버퍼의 [offsets[i], offsets[i + 1]) 구간
+        self.offsets = np.cumsum([0] + [steps * num_envs * size for size in self.field_sizes])
+        total = int(self.offsets[-1])
+
+        self._is_cuda = self.device is not None and self.device.type == 'cuda'
+        if self._is_cuda:
+            # 고정(pinned) 메모리여야 non_blocking 전송이 가능
+            self._host_tensor = torch.zeros(total, dtype=torch.float32, device='cpu').pin_memory()
+            self._device_flat = torch.zeros(total, dtype=torch.float32, device=self.device)
+        else:
+            # CPU 면 numpy 버퍼를 그대로 공유 (복사 없음)
+            self._host_tensor = torch.zeros(total, dtype=torch.float32)
+            self._device_flat = self._host_tensor
+        host = self._host_tensor.numpy()
+
+        self._host_fields = [host[self.offsets[i]:self.offsets[i + 1]].reshape(steps, num_envs, size)
+                             for i, size in enumerate(self.field_sizes)]
+        self._device_fields = [self._device_flat[int(self.offsets[i]):int(self.offsets[i + 1])].view(steps, num_envs, size)
+                               for i, size in enumerate(self.field_sizes)]
+
+        self.t = 0
+
+    def push(self, *fields):
+        assert self.t < self.steps, 'RolloutBuffer is full (steps={})'.format(self.steps)
+
+        for host_field, size, value in zip(self._host_fields, self.field_sizes, fields):
+            host_field[self.t] = np.reshape(u.maybe_numpy(value), (self.num_envs, size))
+        self.t += 1
+
+    def is_full(self):
+        return self.t == self.steps
+
+    def get(self):
+        # 필드별 [t, num_envs, 크기] 연속 뷰 (structure 로 묶어서)
+        if self._is_cuda:
+            self._device_flat.copy_(self._host_tensor, non_blocking=True)
+
+        return self.structure(*[field[:self.t] for field in self._device_fields])
+
+    def clear(self):
+        self.t = 0
+
+    def nbytes(self):
+        # 호스트 + 디바이스 버퍼 (CPU 면 같은 버퍼라 한 번만)
+        return u.tensor_nbytes([self._host_tensor, self._device_flat])
+
+    def __len__(self):
+        return self.t * self.num_envs
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import random
+
+import numpy as np
+import torch
+
+
+# 시드 관리 = 실행 시드 하나에서 구성 요소마다 따로 난수 생성기를 파생
+#
+# 전역 난수 (random, np.random, torch) 하나를 다 같이 쓰면 어느 한 곳에서 난수를 한 번 더 뽑는 순간
+# (예: 최적화로 호출 순서가 바뀜) 나머지 전부의 난수열이 밀린다
+# 대신 이름 ('env', 'replay', 'noise', ...) 마다 seed 와 이름으로 정한 시드로 따로 생성기를 만든다
+#   - python_rng(name) = random.Random (random 모듈과 같은 메소드)
+#   - numpy_rng(name)  = np.random.RandomState (np.random 과 같은 메소드)
+#   - torch_generator(name) = CPU torch.Generator
+#   - torch 전역 난수 (정책 샘플링, 가중치 초기화, 디바이스 위 샘플링 등) 는 seed_globals() 에서 'torch' 로
+#
+# seed=None 이면 아무것도 정하지 않는다 (전역 random, np.random 을 그대로 돌려주므로 기존 동작과 같음)
+#
+# deterministic=True = 결정적 실행 (최적화 전후를 비트 단위로 같은지 비교할 때)
+#   - cuDNN 자동 튜닝 끄고 결정적 알고리즘만
+#   - 학습 스레드 등 실행 순서가 타이밍에 달린 기능은 쓰는 쪽에서 is_deterministic() 보고 끈다
+#   - 주의: CUDA 의 index_add, scatter_add 등 atomic 연산은 여기서 못 막는다
+#          PYTHONHASHSEED 도 프로세스 시작 전에 정해야 한다
+class SeedManager(object):
+    def __init__(self, seed=None, deterministic=False):
+        self.seed = seed
+        self.deterministic = deterministic
+        # 이름 -> 만들어 준 생성기 (reseed() 에서 다시 시드를 넣기 위해)
+        self._generators = dict()
+
+        if self.deterministic:
+            self.enable_deterministic()
+
+    def is_seeded(self):
+        return self.seed is not None
+
+    def is_deterministic(self):
+        return self.deterministic
+
+    def derive(self, name):
+        # (실행 시드, 이름) -> 32비트 시드 (파이썬 hash() 는 프로세스마다 달라서 못 씀)
+        digest = hashlib.sha256('{}:{}'.format(self.seed, name).encode('utf-8')).digest()
+        return int.from_bytes(digest[:4], 'little') & 0x7fffffff
+
+    def python_rng(self, name):
+        if not self.is_seeded():
+            return random
+        name = self._unique_name(name)
+        return self._remember(name, random.Random(self.derive(name)))
+
+    def numpy_rng(self, name):
+        if not self.is_seeded():
+            return np.random
+        name = self._unique_name(name)
+        return self._remember(name, np.random.RandomState(self.derive(name)))
+
+    def torch_generator(self, name):
+        # None 이면 torch 전역 난수 (generator=None 인자로 그대로 넘기면 됨)
+        if not self.is_seeded():
+            return None
+        name = self._unique_name(name)
+        generator = torch.Generator()
+        generator.manual_seed(self.derive(name))
+        return self._remember(name, generator)
+
+    def _unique_name(self, name):
+        # 같은 이름을 또 달라고 하면 (예: 같은 알고리즘 두 개) 'name#1', 'name#2', ... (만든 순서대로 정해짐)
+        if name not in self._generators:
+            return name
+        k = 1
+        while '{}#{}'.format(name, k) in self._generators:
+            k += 1
+        return '{}#{}'.format(name, k)
+
+    def _remember(self, name, generator):
+        self._generators[name] = generator
+        return generator
+
+    def seed_globals(self):
+        # torch (CPU, CUDA), random, np.random 전역 난수
+        if not self.is_seeded():
+            return
+        random.seed(self.derive('python'))
+        np.random.seed(self.derive('numpy'))
+        torch.manual_seed(self.derive('torch'))
+        if torch.cuda.is_available():
+            torch.cuda.manual_seed_all(self.derive('torch'))
+
+    def seed_env(self, env, name='env'):
+        if not self.is_seeded():
+            return
+        env.seed(self.derive(name))
+        # 행동 공간 샘플링 (env.action_space.sample()) 도
+        if hasattr(env.action_space, 'seed'):
+            env.action_space.seed(self.derive(name + '.action_space'))
+
+    def reseed(self, seed):
+        # 이미 나눠 준 생성기까지 새 시드로 (객체는 그대로, 상태만 바꿈)
+        # 처음에 seed=None 이었으면 나눠 준 게 전역 난수라 전역만 다시 정한다
+        self.seed = seed
+        for name, generator in self._generators.items():
+            if isinstance(generator, torch.Generator):
+                generator.manual_seed(self.derive(name))
+            else:
+                generator.seed(self.derive(name))
+        self.seed_globals()
+
+    @staticmethod
+    def enable_deterministic():
+        torch.backends.cudnn.deterministic = True
+        torch.backends.cudnn.benchmark = False
+
+
+_default_seed_manager = SeedManager()
+
+
+def default_seed_manager():
+    return _default_seed_manager
+
+
+def set_default_seeds(seed=None, deterministic=False):
+    # runner 용: 싱글턴 컨텍스트 (context=None) 로 만드는 알고리즘들이 쓸 시드
+    # 알고리즘, 환경을 만들기 전에 부를 것 (생성자에서 생성기를 받아 감)
+    global _default_seed_manager
+    _default_seed_manager = SeedManager(seed, deterministic=deterministic)
+    _default_seed_manager.seed_globals()
+    return _default_seed_manager
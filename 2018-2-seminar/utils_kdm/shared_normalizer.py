@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import copy
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+import utils_kdm as u
+from utils_ext.running_state import RunningStat
+
+
+class SharedNormalizer(u.TorchSerializable):
+    # 환경 여러 개 (여러 프로세스) 가 같은 통계로 상태를 정규화하기
+    #
+    # ZFilter 는 환경마다 따로 있고 스텝마다 통계가 바뀌어서, 병렬로 돌리면 환경마다 정규화가 달라진다
+    # 대신
+    #   - 중앙 통계 (RunningStat) 는 이 객체를 만든 프로세스 하나만 갱신
+    #     (RunningStat 자체는 공유 메모리가 아니다. 워커에 넘어간 복사본은 갱신도 안 되고 쓰지도 않음)
+    #   - 워커는 공유 메모리에 올린 고정된 (평균, 표준편차) 로 정규화만 하고 원본 관측을 모아 둔다
+    #   - epoch 끝에 모은 관측으로 중앙에서 한 번에 갱신 (push_batch) 후 공유 메모리에 다시 게시
+    #     (워커가 자기 RunningStat 을 따로 모았으면 merge_stat() 으로 합쳐도 됨)
+    #
+    # ZFilter 와 같은 __call__(x, update=True) 이라서 NormalizedMujocoEnv 에 그대로 넣을 수 있다
+    # torch.multiprocessing 으로 워커에 넘기면 frozen 텐서는 복사 없이 공유된다
+    def __init__(self, shape, demean=True, destd=True, clip=10.0):
+        super().__init__()
+
+        self.demean = demean
+        self.destd = destd
+        self.clip = clip
+
+        self.stat = RunningStat(shape)
+        # [0] = 평균, [1] = 표준편차 (rollout 동안 고정)
+        self.frozen = torch.zeros((2,) + tuple(shape), dtype=torch.float64).share_memory_()
+        # 게시한 통계의 관측 개수 (워커도 보도록 공유 메모리에)
+        self.frozen_n = torch.zeros(1, dtype=torch.int64).share_memory_()
+        # 워커 쪽: 아직 통계에 안 넣은 원본 관측
+        self.pending = list()
+
+        self.publish()
+
+        self.register_serializable([
+            'stat',
+        ])
+
+    def load_state_dict(self, var_state):
+        super().load_state_dict(var_state)
+        self.publish()
+
+    def publish(self):
+        # 중앙 통계를 공유 메모리로 (관측이 2개 미만이면 정규화 안 함 = 평균 0, 표준편차 1)
+        frozen = self.frozen.numpy()
+        if self.stat.n < 2:
+            frozen[0], frozen[1] = 0, 1
+        else:
+            frozen[0], frozen[1] = self.stat.mean, self.stat.std
+        self.frozen_n[0] = self.stat.n
+
+    def has_stats(self):
+        # 게시된 통계가 있는지 (첫 update() 전에는 없음)
+        return self.frozen_n.item() >= 2
+
+    @property
+    def mean(self):
+        return self.frozen[0].numpy()
+
+    @property
+    def std(self):
+        return self.frozen[1].numpy()
+
+    def normalize(self, x):
+        # 관측 1개 [shape] 또는 여러 개 [k, shape]
+        if self.demean:
+            x = x - self.mean
+        if self.destd:
+            x = x / (self.std + 1e-8)
+        # 통계가 없을 때 (첫 epoch) 는 원본 관측이라 clip 하면 값이 잘린다 (HalfCheetah 속도 등)
+        if self.clip and self.has_stats():
+            x = np.clip(x, -self.clip, self.clip)
+        return x
+
+    def __call__(self, x, update=True):
+        x = np.asarray(x)
+        if update:
+            self.pending.append(x)
+        return self.normalize(x)
+
+    def pop_observations(self):
+        # 워커 쪽: 모아 둔 원본 관측 [k, shape] 을 꺼내고 비움 (중앙으로 보낼 것)
+        if not self.pending:
+            return np.zeros((0,) + self.stat.shape)
+        observations = np.concatenate([np.reshape(x, (-1,) + self.stat.shape) for x in self.pending])
+        self.pending = list()
+        return observations
+
+    def update(self, observations=None):
+        # 중앙 쪽: epoch 당 한 번. observations 가 없으면 이 프로세스에서 모은 관측으로
+        if observations is None:
+            observations = self.pop_observations()
+        self.stat.push_batch(observations)
+        self.publish()
+
+    def merge_stat(self, stat):
+        # 중앙 쪽: 워커가 따로 모은 RunningStat 합치기 (게시는 update() 나 publish() 에서)
+        self.stat.merge(stat)
+
+    def fold_into(self, linear):
+        # 고정된 통계를 첫 Linear 층에 접어 넣은 복사본
+        mean = self.mean if self.demean else np.zeros(self.stat.shape)
+        std = self.std if self.destd else np.ones(self.stat.shape)
+        return fold_normalization_into_linear(linear, mean, std)
+
+
+def fold_normalization_into_linear(linear, mean, std, eps=1e-8):
+    # W((x - m) / (s + eps)) + b = (W / (s + eps)) x + (b - (W / (s + eps)) m)
+    # 정규화를 따로 안 해도 원본 관측을 그대로 넣으면 되는 Linear (원본은 그대로 두고 복사본 반환)
+    # 주의: clip 은 접을 수 없으므로 정규화한 값이 clip 범위 안일 때만 결과가 같다
+    weight = linear.weight.detach()
+    mean = torch.as_tensor(np.asarray(mean, dtype=np.float64), dtype=weight.dtype, device=weight.device)
+    std = torch.as_tensor(np.asarray(std, dtype=np.float64), dtype=weight.dtype, device=weight.device)
+
+    folded = copy.deepcopy(linear)
+    with torch.no_grad():
+        folded.weight.copy_(weight / (std + eps))
+        bias = linear.bias.detach() if linear.bias is not None else torch.zeros_like(folded.weight[:, 0])
+        new_bias = bias - torch.mv(folded.weight, mean)
+        if folded.bias is None:
+            folded.bias = nn.Parameter(new_bias)
+        else:
+            folded.bias.copy_(new_bias)
+    return folded
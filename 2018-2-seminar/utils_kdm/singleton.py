@@ -22,4 +22,8 @@ class Singleton(
         {}
     )
 ):
-    pass
+
+    @classmethod
+    def new_instance(cls, *args, **kwargs):
+        # 싱글턴 캐시를 거치지 않는 별도 인스턴스 (트레이너 여러 개를 한 프로세스에서 돌릴 때)
+        return type.__call__(cls, *args, **kwargs)
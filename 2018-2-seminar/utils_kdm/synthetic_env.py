@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import gym
+import numpy as np
+from gym import spaces
+from gym.envs.registration import registry, register
+from gym.utils import seeding
+
+
+# MuJoCo 없이 돌리는 가짜 연속 제어 환경 (벤치마크, 통합 실행 확인용)
+#
+# Swimmer-v2, HalfCheetah-v2 와 같은 상태/행동 크기, 행동 범위 [-1, 1], max_episode_steps 라서
+# runner, 알고리즘 코드를 그대로 돌릴 수 있다 (학습 성능은 의미 없음)
+#   - 동역학 = 안정된 선형 시스템 x' = A x + B a + 잡음 (numpy 만)
+#   - 보상 = 앞으로 가는 속도 대신 고정된 방향 w 로의 사영 - 행동 크기 벌점 (MuJoCo 보행 환경처럼)
+#   - 끝 = 시간 제한 (max_episode_steps) 에서만
+#   - step_cost = 스텝당 시뮬레이터 지연 흉내 (초, 바쁜 대기라서 실제 시뮬레이터처럼 CPU 를 잡아먹음)
+#
+# A, B, w 는 dynamics_seed 로 정해진다 (env.seed() 는 초기 상태, 잡음만 바꿈)
+# 그래서 같은 이름의 환경은 어느 프로세스에서 만들어도 같은 동역학
+class SyntheticLocomotionEnv(gym.Env):
+    metadata = {'render.modes': []}
+
+    def __init__(self, state_size, action_size, step_cost=0.0, dynamics_seed=0,
+                 noise_scale=0.01, ctrl_cost_weight=0.1):
+        self.state_size, self.action_size = state_size, action_size
+        self.step_cost = step_cost
+        self.noise_scale = noise_scale
+        self.ctrl_cost_weight = ctrl_cost_weight
+
+        # MuJoCo 환경과 같은 공간 (관측은 float64)
+        high = np.inf * np.ones(state_size)
+        self.observation_space = spaces.Box(-high, high, dtype=np.float64)
+        self.action_space = spaces.Box(-np.ones(action_size), np.ones(action_size), dtype=np.float32)
+
+        # 고유값 크기가 0.95 이하인 A (직교 행렬 * 0.95) 라서 상태가 발산하지 않는다
+        dynamics_rng = np.random.RandomState(dynamics_seed)
+        q, _ = np.linalg.qr(dynamics_rng.randn(state_size, state_size))
+        self.A = 0.95 * q
+        self.B = 0.1 * dynamics_rng.randn(state_size, action_size)
+        self.w = dynamics_rng.randn(state_size) / np.sqrt(state_size)
+
+        self.state = np.zeros(state_size)
+        self.np_random = None
+        self.seed()
+
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        return [seed]
+
+    def reset(self):
+        self.state = 0.1 * self.np_random.randn(self.state_size)
+        return np.array(self.state)
+
+    def step(self, action):
+        action = np.clip(np.asarray(action, dtype=np.float64).reshape(self.action_size), -1, 1)
+        self._simulate_cost()
+
+        self.state = self.A.dot(self.state) + self.B.dot(action) + \
+            self.noise_scale * self.np_random.randn(self.state_size)
+        forward_reward = float(self.w.dot(self.state))
+        ctrl_cost = self.ctrl_cost_weight * float(np.square(action).sum())
+        reward = forward_reward - ctrl_cost
+
+        return np.array(self.state), reward, False, dict(reward_fwd=forward_reward, reward_ctrl=-ctrl_cost)
+
+    def _simulate_cost(self):
+        if self.step_cost <= 0:
+            return
+        end = time.perf_counter() + self.step_cost
+        while time.perf_counter() < end:
+            pass
+
+    def render(self, mode='human'):
+        pass
+
+
+# 진짜 환경 이름 -> (가짜 환경 이름, 상태 크기, 행동 크기, max_episode_steps)
+SYNTHETIC_ENVS = {
+    'Swimmer-v2': ('SyntheticSwimmer-v0', 8, 2, 1000),
+    'HalfCheetah-v2': ('SyntheticHalfCheetah-v0', 17, 6, 1000),
+}
+
+
+def register_synthetic_envs(step_cost=0.0):
+    # gym.make('SyntheticSwimmer-v0') 등으로 만들 수 있게 등록
+    # 다시 부르면 새 step_cost 로 다시 등록
+    # 주의: 등록은 프로세스마다 따로 (spawn 한 평가 워커 등은 기본값 step_cost=0 으로 등록)
+    for _, (env_id, state_size, action_size, max_episode_steps) in sorted(SYNTHETIC_ENVS.items()):
+        if env_id in registry.env_specs:
+            del registry.env_specs[env_id]
+        register(
+            id=env_id,
+            entry_point='utils_kdm.synthetic_env:SyntheticLocomotionEnv',
+            max_episode_steps=max_episode_steps,
+            kwargs=dict(state_size=state_size, action_size=action_size, step_cost=step_cost),
+        )
+
+
+def is_synthetic_env(env_id):
+    return any(env_id == synthetic[0] for synthetic in SYNTHETIC_ENVS.values())
+
+
+def synthetic_env_id(env_id):
+    # runner 의 GYM_ENV 를 가짜 환경 이름으로 (이미 가짜 환경 이름이면 그대로)
+    if is_synthetic_env(env_id):
+        return env_id
+    if env_id not in SYNTHETIC_ENVS:
+        raise ValueError('No synthetic environment for {}'.format(env_id))
+    return SYNTHETIC_ENVS[env_id][0]
+
+
+def maybe_register(env_id):
+    # gym.make() 전에 (가짜 환경 이름일 때만 등록, 이미 등록돼 있으면 그대로)
+    if is_synthetic_env(env_id) and env_id not in registry.env_specs:
+        register_synthetic_envs()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import torch
+
+import utils_kdm as u
+
+
+def _flatten_parameters(module):
+    # 모듈의 모든 파라미터를 연속된 버퍼 하나로 옮기고, 각 파라미터는 그 버퍼의 뷰가 되게 한다
+    # Parameter 객체 자체는 그대로이므로 Optimizer 는 영향 없음
+    params = list(module.parameters())
+    total = sum(p.numel() for p in params)
+    flat = torch.empty(total, dtype=params[0].dtype, device=params[0].device)
+
+    offset = 0
+    for p in params:
+        n = p.numel()
+        flat[offset:offset + n].copy_(p.data.view(-1))
+        p.data = flat[offset:offset + n].view_as(p.data)
+        offset += n
+
+    return flat
+
+
+def _is_flat(module, flat):
+    # 누군가 param.data = ... 로 바꿔치기 했으면 (vector_to_parameters 등) 더 이상 뷰가 아니다
+    base, element_size = flat.data_ptr(), flat.element_size()
+    offset = 0
+    for p in module.parameters():
+        if p.data_ptr() != base + offset * element_size:
+            return False
+        offset += p.numel()
+    return offset == flat.numel()
+
+
+def _get_flat(module):
+    # 같은 신경망을 여러 updater 가 공유할 수 있으므로 (DDPG 정책망 -> 타겟망, 행동용 정책망)
+    # 이미 평탄화된 버퍼가 있으면 그대로 쓰고, 새로 만들 때만 모듈에 기억해 둔다
+    flat = getattr(module, '_flat_parameters', None)
+    if flat is None or not _is_flat(module, flat):
+        flat = _flatten_parameters(module)
+        module._flat_parameters = flat
+    return flat
+
+
+def _can_flatten(module):
+    params = list(module.parameters())
+    return len(params) > 0 and \
+        all(p.dtype == params[0].dtype and p.device == params[0].device for p in params)
+
+
+class TargetNetworkUpdater(object):
+    # 타겟망 갱신 (DDPG soft update, DQN 가중치 복사)
+    #
+    # 파라미터별로 target*(1-tau) + param*tau 를 계산하면 텐서마다 임시 텐서 2개 + 커널 여러 번
+    # 대신 두 신경망의 파라미터를 각각 연속 버퍼 하나로 모아 두고
+    #   soft update = dst.lerp_(src, tau)  (커널 1번, 임시 텐서 없음)
+    #   hard update = dst.copy_(src)       (커널 1번)
+    #
+    # .to(device), vector_to_parameters 등으로 파라미터가 바꿔치기 되면 뷰가 풀리므로
+    # 갱신할 때마다 확인해서 (파라미터 포인터 비교) 풀렸으면 다시 평탄화한다
+    def __init__(self, src_nn, dst_nn):
+        self.src_nn = src_nn
+        self.dst_nn = dst_nn
+
+        self.src_flat, self.dst_flat = None, None
+        self.refresh()
+
+    def refresh(self):
+        # 파라미터가 바꿔치기 됐을 때 다시 평탄화
+        if not (_can_flatten(self.src_nn) and _can_flatten(self.dst_nn)):
+            # dtype/device가 섞여 있으면 텐서별 갱신으로 대체
+            self.src_flat, self.dst_flat = None, None
+            return
+
+        self.src_flat = _get_flat(self.src_nn)
+        self.dst_flat = _get_flat(self.dst_nn)
+
+        assert self.src_flat.numel() == self.dst_flat.numel(), '두 신경망 구조가 다름'
+
+    def _check_flat(self):
+        # 뷰가 풀린 버퍼를 갱신하면 실제 파라미터와 상관없는 버퍼만 바뀌고 타겟망은 그대로 남는다
+        if not (_is_flat(self.src_nn, self.src_flat) and _is_flat(self.dst_nn, self.dst_flat)):
+            self.refresh()
+
+    def soft_update(self, tau):
+        if self.dst_flat is not None:
+            self._check_flat()
+        if self.dst_flat is None:
+            u.soft_update_from_to(src_nn=self.src_nn, dst_nn=self.dst_nn, tau=tau)
+            return
+
+        with torch.no_grad():
+            self.dst_flat.lerp_(self.src_flat, tau)
+
+    def hard_update(self):
+        if self.dst_flat is not None:
+            self._check_flat()
+        if self.dst_flat is None:
+            self.dst_nn.load_state_dict(self.src_nn.state_dict())
+            return
+
+        with torch.no_grad():
+            self.dst_flat.copy_(self.src_flat)
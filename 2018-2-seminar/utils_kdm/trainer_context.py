@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+
+import torch
+
+from utils_kdm.manage_device import device_scope
+from utils_kdm.seeding import SeedManager, default_seed_manager
+from utils_kdm.trainer_metadata import TrainerMetadata
+
+
+class TrainerContext(object):
+    # 트레이너 하나의 실행 환경 = 디바이스 + 지표 기록 (TrainerMetadata) + 난수 생성기 (SeedManager)
+    #
+    # TrainerMetadata(), ManageDevice() 는 프로세스에 하나뿐이라 에이전트 여러 개를 한 프로세스 (스레드 풀) 에서
+    # 돌리면 디바이스, 지표가 섞인다. 대신 알고리즘 생성자에 context 를 넘겨서 트레이너마다 따로 쓴다
+    #   context=None 이면 기존처럼 싱글턴 (default_context())
+    #
+    # 사용법
+    #   context = TrainerContext(force_cpu=True, seeds=SeedManager(seed))
+    #   context.metadata.reset(viz=NullDrawer(), checkpoint=..., agent=...)
+    #   algorithm_rl = PPO(state_size, action_size, context=context)
+    #   with context.activate():
+    #       ... (이 스레드에서 디바이스를 안 주고 만드는 텐서도 context.device 로)
+    def __init__(self, device=None, metadata=None, force_cpu=False, seeds=None):
+        if device is None:
+            device = 'cpu' if force_cpu or not torch.cuda.is_available() else 'cuda:0'
+        self._device = torch.device(device)
+
+        self._metadata = metadata if metadata is not None else TrainerMetadata.new_instance()
+        self._metadata.bind_device(self._device)
+
+        self._seeds = seeds if seeds is not None else SeedManager()
+
+    @property
+    def device(self):
+        return self._device
+
+    @property
+    def metadata(self):
+        return self._metadata
+
+    @property
+    def seeds(self):
+        return self._seeds
+
+    @contextmanager
+    def activate(self):
+        with device_scope(self.device):
+            yield self
+
+
+class _DefaultTrainerContext(TrainerContext):
+    # 싱글턴을 그대로 쓰는 기본 컨텍스트
+    # runner 가 객체 구성 뒤에 디바이스를 정하기도 하므로 부를 때마다 조회
+    def __init__(self):
+        pass
+
+    @property
+    def device(self):
+        return TrainerMetadata().device
+
+    @property
+    def metadata(self):
+        return TrainerMetadata()
+
+    @property
+    def seeds(self):
+        # runner 에서 set_default_seeds() 로 정한 것
+        return default_seed_manager()
+
+    @contextmanager
+    def activate(self):
+        yield self
+
+
+_default_context = _DefaultTrainerContext()
+
+
+def default_context():
+    return _default_context
+
+
+def resolve_context(context):
+    return context if context is not None else _default_context
@@ -45,6 +45,8 @@ class TrainerMetadata(TorchSerializable, Singleton):
         # 환경 설정
         cls.log_interval = None
         cls.save_full_path = None
+        # TrainerContext 로 따로 만든 인스턴스면 그 디바이스 (None 이면 ManageDevice 싱글턴)
+        cls._device = None
 
         cls.register_serializable([
             'current_epoch',
@@ -59,8 +61,13 @@ class TrainerMetadata(TorchSerializable, Singleton):
 
     @property
     def device(cls):
+        if cls._device is not None:
+            return cls._device
         return ManageDevice().get(call_from='TrainerMetadata')
 
+    def bind_device(cls, device):
+        cls._device = device
+
     def reset(cls,
               viz,
               checkpoint,
@@ -101,7 +108,10 @@ class TrainerMetadata(TorchSerializable, Singleton):
         if console_log_order is not None and type(console_log_order) is list:
             cls.console_log_order.extend(console_log_order)
 
-        ManageDevice().set(force_cpu, call_from='TrainerMetadata')
+        # TrainerContext 로 디바이스가 정해진 인스턴스면 프로세스 전체 디바이스 (ManageDevice) 는 건드리지 않는다
+        # (같은 프로세스의 다른 트레이너 디바이스가 바뀌므로)
+        if cls._device is None:
+            ManageDevice().set(force_cpu, call_from='TrainerMetadata')
 
     def set_device(cls, force_cpu=False):
         ManageDevice().set(force_cpu, call_from='TrainerMetadata')
@@ -122,6 +132,13 @@ class TrainerMetadata(TorchSerializable, Singleton):
                 # 한 에피소드 당 변수의 최대/평균/최소 등을 계산하기 위해 저장
                 cls._temp_for_maxmin_indicators[indicator][variable].append(value)
 
+    def log_reduced(cls, last, maximum, minimum, indicator='default_win', variable='default_var', compute_maxmin=False):
+        # 여러 번 log() 할 값을 미리 (마지막, 최대, 최소) 로 줄여서 한 번에 (Diagnostics.flush)
+        # 마지막 값은 show_only_last 로 남는 값, 최대/최소는 에피소드 최대/최소 계산에 그대로 쓰인다
+        cls._last_only_indicators[indicator][variable] = last
+        if compute_maxmin:
+            cls._temp_for_maxmin_indicators[indicator][variable].extend([maximum, minimum])
+
     def console_log(cls, name, value):
         cls.console_indicators[name] = value
         # 명시적으로 log 요청했는데도 order에 없는 경우, order 맨 뒤에 추가
@@ -131,22 +148,37 @@ class TrainerMetadata(TorchSerializable, Singleton):
     def save(cls):
         # state_dict 구성 속도가 느리므로 필요할 때만 구성
         if cls.checkpoint.is_saving_episode(cls.current_epoch):
-            var_state = cls.state_dict()
+            if cls.checkpoint.is_sharded:
+                var_state = cls.state_dict_shards(cls.checkpoint.shard_depth)
+            else:
+                var_state = cls.state_dict()
             is_best = False
+            current_score = None
             if 'score' in cls.indicators:
                 score = cls.indicators['score']['default_var']
-                max_score = max(score)
+                # 보존 정책 (keep_best) 은 에피소드별 점수로 순위를 매기므로 index 에는 이번 점수를 기록
+                # 최고 점수 (누적 최대값) 는 .best 를 바꿀지 정하는 데만 쓴다
+                current_score = u.maybe_float(score[-1])
+                max_score = u.maybe_float(max(score))
                 if max_score > cls.best_score:
                     cls.best_score = max_score
                     is_best = True
 
-            cls.checkpoint.save_checkpoint(cls.save_full_path, var_state, is_best)
+            cls.checkpoint.save_checkpoint(cls.save_full_path, var_state, is_best, score=current_score)
 
-    def load(cls):
+    def load(cls, shards=None):
+        # shards = 일부 샤드만 불러오기 (예: ['agent.algorithm_rl.actor']), 샤드 저장일 때만
         full_path = cls.checkpoint.get_best_model_file_name(cls.save_full_path)
         print("Loading checkpoint '{}'".format(full_path))
-        var_state = cls.checkpoint.load_model(full_path=full_path)
-        cls.load_state_dict(var_state)
+        var_state = cls.checkpoint.load_model(full_path=full_path, device=cls.device, shards=shards)
+        if cls.checkpoint.is_sharded:
+            cls.load_state_dict_shards(var_state)
+        else:
+            cls.load_state_dict(var_state)
+
+        if shards is not None:
+            print("Loading complete. Shards: {}".format(', '.join(sorted(var_state.keys()))))
+            return
 
         for indicator_name, variables in cls.indicators.items():
             for variable_name, variable_sequence in variables.items():
@@ -160,6 +192,14 @@ class TrainerMetadata(TorchSerializable, Singleton):
             score = cls.indicators['score']['default_var'][-1]
             print("Score: {:.2f}".format(max(score, default=0)))
 
+    def indicator_lengths(cls):
+        # {'지표/변수': 쌓인 값 개수} (indicators 는 에피소드마다 계속 늘어난다)
+        lengths = dict()
+        for indicator_name, variables in cls.indicators.items():
+            for variable_name, variable in variables.items():
+                lengths['{}/{}'.format(indicator_name, variable_name)] = len(variable)
+        return lengths
+
     def start_episode(cls):
         cls.start_time = time.time()
 
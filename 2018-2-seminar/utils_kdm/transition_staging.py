@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import torch
+
+import utils_kdm as u
+from utils_kdm.manage_device import get_device
+
+
+class TransitionStaging(object):
+    # append_sample() 마다 (s, a, r, s', done) 각각을 텐서로 만들면 스텝당 텐서 5개,
+    # GPU 라면 호스트->디바이스 복사 5번이 생긴다.
+    # 대신 미리 할당한 numpy 배열 한 줄에 원본 값을 써 두었다가,
+    # chunk_size 만큼 모이면 한 번에 (복사 1번) 보내고 필드별 뷰로 잘라서 sink 에 넘긴다.
+    #
+    # sink(*field_batches) 예시
+    #   - ReplayMemory.push_batch (DQN, DDPG)
+    # (TRPO, PPO 는 RolloutBuffer 에 바로 쓴다)
+    def __init__(self, field_sizes, field_dtypes, sink, chunk_size=64, device=None):
+        assert len(field_sizes) == len(field_dtypes)
+
+        self.field_sizes = list(field_sizes)
+        self.field_dtypes = list(field_dtypes)
+        self.sink = sink
+        self.chunk_size = chunk_size
+        self.device = device if device else get_device()
+
+        # 필드들을 한 줄에 이어 붙인 배열: [chunk_size, 전체 필드 크기 합]
+        self.offsets = np.cumsum([0] + self.field_sizes)
+        self.width = int(self.offsets[-1])
+
+        self._is_cuda = self.device is not None and self.device.type == 'cuda'
+        if self._is_cuda:
+            # 고정(pinned) 메모리여야 non_blocking 전송이 가능
+            self._host_tensor = torch.empty((self.chunk_size, self.width), dtype=torch.float32,
+                                            device='cpu').pin_memory()
+            self._host = self._host_tensor.numpy()
+        else:
+            self._host_tensor = None
+            self._host = np.empty((self.chunk_size, self.width), dtype=np.float32)
+
+        self._transfer_event = None
+        self.count = 0
+
+    def push(self, *fields):
+        if self._transfer_event is not None:
+            # 이전 청크가 아직 GPU로 가는 중이면 버퍼를 덮어쓰기 전에 대기
+            self._transfer_event.synchronize()
+            self._transfer_event = None
+
+        row = self._host[self.count]
+        for i, value in enumerate(fields):
+            row[self.offsets[i]:self.offsets[i + 1]] = u.maybe_numpy(value)
+        self.count += 1
+
+        if self.count == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.count == 0:
+            return
+
+        if self._is_cuda:
+            chunk = self._host_tensor[:self.count].to(self.device, non_blocking=True)
+            self._transfer_event = torch.cuda.Event()
+            self._transfer_event.record()
+        else:
+            # 버퍼는 재사용하므로 복사 1번
+            chunk = torch.from_numpy(self._host[:self.count].copy())
+
+        field_batches = list()
+        for i, dtype in enumerate(self.field_dtypes):
+            field = chunk[:, self.offsets[i]:self.offsets[i + 1]]
+            field_batches.append(field if dtype == torch.float32 else field.to(dtype))
+
+        self.count = 0
+        self.sink(*field_batches)
+
+    def clear(self):
+        self.count = 0
+
+    def __len__(self):
+        return self.count